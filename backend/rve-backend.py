@@ -2,6 +2,8 @@ import argparse
 import os
 import logging
 from src.RenderVideo import Render
+from src.StageGraph import parseStageWorkers
+from src.DeviceScheduler import parseDevices
 
 from src.Util import (
     checkForPytorch,
@@ -9,6 +11,8 @@ from src.Util import (
     checkForTensorRT,
     check_bfloat16_support,
     checkForDirectML,
+    checkForONNXRuntime,
+    checkForOpenVINO,
     checkForDirectMLHalfPrecisionSupport,
     checkForGMFSS,
 )
@@ -19,7 +23,7 @@ class HandleApplication:
         self.args = self.handleArguments()
         if not self.args.list_backends:
             self.checkArguments()
-            Render(
+            render = Render(
                 # model settings
                 inputFile=self.args.input,
                 outputFile=self.args.output,
@@ -27,6 +31,25 @@ class HandleApplication:
                 interpolateFactor=self.args.interpolateFactor,
                 upscaleModel=self.args.upscaleModel,
                 tile_size=self.args.tilesize,
+                tile_batch=self.args.tile_batch,
+                upscale_batch=self.args.upscale_batch,
+                cpu_replicas=self.args.cpu_replicas,
+                devices=parseDevices(self.args.devices),
+                skip_duplicates=self.args.skip_duplicates,
+                duplicate_tolerance=self.args.duplicate_tolerance,
+                tile_reuse=self.args.tile_reuse,
+                tile_reuse_threshold=self.args.tile_reuse_threshold,
+                quantize=self.args.quantize,
+                calibration_frames=self.args.calibration_frames,
+                onnx_providers=self.args.onnx_providers,
+                onnx_intra_threads=self.args.onnx_intra_threads,
+                onnx_inter_threads=self.args.onnx_inter_threads,
+                openvino_requests=self.args.openvino_requests,
+                openvino_threads=self.args.openvino_threads,
+                shape_buckets=self.args.shape_buckets,
+                bucket_max_waste=self.args.bucket_max_waste,
+                bucket_pad_mode=self.args.bucket_pad_mode,
+                overlap=self.args.overlap,
                 # backend settings
                 device="default",
                 backend=self.args.backend,
@@ -44,7 +67,16 @@ class HandleApplication:
                 trt_optimization_level=self.args.tensorrt_opt_profile,
                 rife_trt_mode=self.args.rife_trt_mode,
                 upscale_output_resolution=self.args.upscale_output_resolution,
+                crop=self.args.crop,
+                crop_output=self.args.crop_output,
+                stageWorkers=parseStageWorkers(self.args.stage_workers),
+                stageQueueSize=self.args.stage_queue_size,
+                processIO=self.args.process_io,
+                threads=self.args.threads,
+                pinThreads=self.args.pin_threads,
             )
+            # a failed render exits with an error, instead of leaving a short video behind as if it worked
+            render.waitForRender()
         else:
             half_prec_supp = False
             gmfss_supp = False
@@ -71,6 +103,7 @@ class HandleApplication:
                 import torch
 
                 availableBackends.append("pytorch")
+                availableBackends.append("pytorch-compile")
                 printMSG += f"PyTorch Version: {torch.__version__}\n"
                 half_prec_supp = check_bfloat16_support()
                 gmfss_supp = checkForGMFSS()
@@ -79,6 +112,13 @@ class HandleApplication:
                 availableBackends.append("ncnn")
                 printMSG += f"NCNN Version: 20220729\n"
                 from rife_ncnn_vulkan_python import Rife
+            if checkForONNXRuntime():
+                availableBackends.append("onnx")
+            if checkForOpenVINO():
+                availableBackends.append("openvino")
+                import openvino as ov
+
+                printMSG += f"OpenVINO Version: {ov.get_version()}\n"
             if checkForDirectML():
                 availableBackends.append("directml")
                 import onnxruntime as ort
@@ -121,14 +161,14 @@ class HandleApplication:
         parser.add_argument(
             "-l",
             "--overlap",
-            help="overlap size on tiled rendering (default=10)",
-            default=0,
+            help="overlap size on tiled rendering, every tile reaches this far into its neighbours and the shared area is blended (default=10)",
+            default=10,
             type=int,
         )
         parser.add_argument(
             "-b",
             "--backend",
-            help="backend used to upscale image. (pytorch/ncnn/tensorrt/directml, default=pytorch)",
+            help="backend used to upscale image. (pytorch/pytorch-compile/ncnn/tensorrt/directml/onnx/openvino, default=pytorch)",
             default="pytorch",
             type=str,
         )
@@ -150,9 +190,68 @@ class HandleApplication:
         )
         parser.add_argument(
             "--precision",
-            help="sets precision for model, (auto/float16/float32, default=auto)",
+            help="sets precision for model, int8 quantizes upscale models on the cpu (auto/float16/float32/int8, default=auto)",
             default="auto",
         )
+        parser.add_argument(
+            "--quantize",
+            help="How --precision int8 quantizes, static calibrates on frames from the video and quantizes convolutions, dynamic only quantizes linear layers (static/dynamic, default=static)",
+            choices=["static", "dynamic"],
+            default="static",
+        )
+        parser.add_argument(
+            "--calibration_frames",
+            help="Frames from the video used to calibrate static int8 quantization (default=8)",
+            type=int,
+            default=8,
+        )
+        parser.add_argument(
+            "--onnx_providers",
+            help="ONNX Runtime execution providers for the onnx backend, in order of preference. Ex: (CUDAExecutionProvider,CPUExecutionProvider, default=CPUExecutionProvider)",
+            type=str,
+            default="CPUExecutionProvider",
+        )
+        parser.add_argument(
+            "--onnx_intra_threads",
+            help="Threads ONNX Runtime uses inside an op, 0 uses the inference share of the thread budget on the cpu provider, and lets it decide otherwise (default=0)",
+            type=int,
+            default=0,
+        )
+        parser.add_argument(
+            "--onnx_inter_threads",
+            help="Threads ONNX Runtime uses to run independent ops at once, 0 lets it decide (default=0)",
+            type=int,
+            default=0,
+        )
+        parser.add_argument(
+            "--openvino_requests",
+            help="Frames the openvino backend works on at once, 0 uses what openvino picks for the cpu (default=0)",
+            type=int,
+            default=0,
+        )
+        parser.add_argument(
+            "--openvino_threads",
+            help="Threads the openvino backend uses, 0 uses the inference share of the thread budget (default=0)",
+            type=int,
+            default=0,
+        )
+        parser.add_argument(
+            "--shape_buckets",
+            help="Pad frames up to a common size (1436x1080 -> 1440x1080, 1912x800 -> 1920x800) and crop the output, so tensorrt engines, torch.compile graphs and onnx/openvino sessions are reused between videos of similar sizes",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--bucket_max_waste",
+            help="Largest part of a padded frame that can be padding before the frame keeps its own size instead, 0-1 (default=0.25)",
+            type=float,
+            default=0.25,
+        )
+        parser.add_argument(
+            "--bucket_pad_mode",
+            help="How the padding of --shape_buckets is filled (replicate/reflect, default=replicate)",
+            type=str,
+            default="replicate",
+        )
         parser.add_argument(
             "--tensorrt_opt_profile",
             help="sets tensorrt optimization profile for model, (1/2/3/4/5, default=3)",
@@ -189,10 +288,56 @@ class HandleApplication:
         )
         parser.add_argument(
             "--tilesize",
-            help="upscale images in smaller chunks, default is the size of the input video",
+            help="upscale images in smaller chunks, default is the size of the input video. auto picks the fastest size that fits in memory with a short probe, cached per model, device, precision and resolution (pytorch backends only)",
+            default="0",
+            type=str,
+        )
+        parser.add_argument(
+            "--tile_batch",
+            help="Number of tiles to upscale at once when using --tilesize, 0 sizes it automatically from the free memory (default=0)",
             default=0,
             type=int,
         )
+        parser.add_argument(
+            "--upscale_batch",
+            help="Number of frames to upscale at once, faster for small models and resolutions but uses more memory. Only used by the pytorch backend without tiling (default=1)",
+            default=1,
+            type=int,
+        )
+        parser.add_argument(
+            "--cpu_replicas",
+            help="Number of model copies to upscale with in parallel when running on the cpu, each in its own process. auto picks the fastest count with a short probe, 0 disables it (default=0)",
+            default="0",
+            type=str,
+        )
+        parser.add_argument(
+            "--devices",
+            help="Comma separated devices to upscale on, ex: cuda:0,cuda:1,cpu. More than one spreads the frames over all of them by how fast each one is (default=first gpu, or the cpu)",
+            default="",
+            type=str,
+        )
+        parser.add_argument(
+            "--skip_duplicates",
+            help="Reuse the upscaled output of the previous frame for frames that are (nearly) the same, common in animation and screen recordings.",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--duplicate_tolerance",
+            help="Max difference (0-255) of a frame's downscaled brightness for it to count as a duplicate with --skip_duplicates, 0 only skips exact duplicates (default=2.0)",
+            default=2.0,
+            type=float,
+        )
+        parser.add_argument(
+            "--tile_reuse",
+            help="Only upscale the tiles that changed since the previous frame, needs --tilesize. Speeds up mostly static video like screen recordings.",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--tile_reuse_threshold",
+            help="Max difference (0-255) of a tile for it to be reused with --tile_reuse, 0 only reuses unchanged tiles and gives the same output as upscaling every tile (default=0)",
+            default=0.0,
+            type=float,
+        )
         parser.add_argument(
             "--benchmark",
             help="Overwrite output video if it already exists.",
@@ -227,6 +372,45 @@ class HandleApplication:
             type=str,
             default=None,
         )
+        parser.add_argument(
+            "--crop",
+            help="Crop black bars before upscaling/interpolating, they are padded back afterwards. auto detects them from a few frames, or give the area to keep as width:height:x:y (default=none)",
+            type=str,
+            default="none",
+        )
+        parser.add_argument(
+            "--crop_output",
+            help="Output the cropped video instead of padding the black bars back",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--stage_workers",
+            help="Worker threads per render stage, stages not listed use 1, except normalize and denormalize which share the threads left in the thread budget. (stages=scenedetect,normalize,upscale,denormalize,interpolate) Ex: (denormalize=2,normalize=2)",
+            type=str,
+            default=None,
+        )
+        parser.add_argument(
+            "--stage_queue_size",
+            help="Max frames waiting between two render stages (default=8)",
+            type=int,
+            default=8,
+        )
+        parser.add_argument(
+            "--process_io",
+            help="Decode and encode in separate processes that exchange frames with the renderer through shared memory, keeps pipe I/O off the render process's GIL.",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--threads",
+            help="Total cpu threads to split between torch, ffmpeg and opencv, 0 reads it from the cpu topology and cgroup limits (default=0)",
+            type=int,
+            default=0,
+        )
+        parser.add_argument(
+            "--pin_threads",
+            help="Pin the render and ffmpeg processes to the cpus of the thread budget (linux only)",
+            action="store_true",
+        )
 
         return parser.parse_args()
 
@@ -242,8 +426,38 @@ class HandleApplication:
             raise os.error("Output file already exists!")
         if not os.path.isfile(self.args.input):
             raise os.error("Input file does not exist!")
-        if self.args.tilesize < 0:
-            raise ValueError("Tilesize must be greater than 0")
+        if self.args.tilesize != "auto" and not self.args.tilesize.isdigit():
+            raise ValueError("Tilesize must be auto or a number 0 or greater")
+        if self.args.overlap < 0:
+            raise ValueError("Overlap must be greater than 0")
+        if self.args.tile_batch < 0:
+            raise ValueError("Tile batch must be greater than 0")
+        if self.args.cpu_replicas != "auto" and not self.args.cpu_replicas.isdigit():
+            raise ValueError("CPU replicas must be auto or a number 0 or greater")
+        if self.args.tile_reuse_threshold < 0:
+            raise ValueError("Tile reuse threshold must be 0 or greater")
+        if self.args.duplicate_tolerance < 0:
+            raise ValueError("Duplicate tolerance must be 0 or greater")
+        if self.args.crop != "auto" and self.args.crop != "none":
+            # the size is checked once the video is opened
+            if len(self.args.crop.split(":")) != 4:
+                raise ValueError("Crop must be auto, none, or width:height:x:y")
+        if self.args.onnx_intra_threads < 0 or self.args.onnx_inter_threads < 0:
+            raise ValueError("ONNX Runtime threads must be 0 or greater")
+        if not 0 <= self.args.bucket_max_waste < 1:
+            raise ValueError("Bucket max waste must be between 0 and 1")
+        if self.args.bucket_pad_mode not in ("replicate", "reflect"):
+            raise ValueError("Bucket pad mode must be replicate or reflect")
+        if self.args.openvino_requests < 0 or self.args.openvino_threads < 0:
+            raise ValueError("OpenVINO requests and threads must be 0 or greater")
+        if self.args.calibration_frames < 1:
+            raise ValueError("Calibration frames must be at least 1")
+        if self.args.upscale_batch < 1:
+            raise ValueError("Upscale batch must be at least 1")
+        if self.args.threads < 0:
+            raise ValueError("Threads must be greater than 0")
+        if self.args.stage_queue_size < 1:
+            raise ValueError("Stage queue size must be at least 1")
         if self.args.interpolateFactor < 0:
             raise ValueError("Interpolation factor must be greater than 0")
         if self.args.interpolateFactor == 1 and self.args.interpolateModel:
@@ -0,0 +1,108 @@
+import cv2
+import numpy as np
+
+from .Util import log, printAndLog, sampleVideoFrames
+
+
+def evenDown(value: int) -> int:
+    return value - value % 2
+
+
+def evenUp(value: int) -> int:
+    return value + value % 2
+
+
+def contentBounds(
+    gray: np.ndarray, threshold: float
+) -> tuple[int, int, int, int] | None:
+    """
+    (left, top, right, bottom) of the part of a grayscale frame that isn't black bars, None if the whole frame is black.
+    Like ffmpeg cropdetect, a row or column counts as black if its average brightness is at most threshold, so grain on the bars doesn't stop them from being found.
+    """
+    rows = np.flatnonzero(gray.mean(axis=1) > threshold)
+    columns = np.flatnonzero(gray.mean(axis=0) > threshold)
+    if len(rows) == 0 or len(columns) == 0:
+        return None
+    return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+
+
+def detectCrop(
+    inputFile: str,
+    width: int,
+    height: int,
+    samples: int = 12,
+    threshold: float = 24,
+) -> tuple[int, int, int, int] | None:
+    """
+    Looks for black bars that stay the same over a few frames spread through the video.
+    Returns (x, y, width, height) of the area inside the bars, rounded to even numbers for yuv420, or None if there are no bars.
+    The area covers the content of every sampled frame, so bars that something is drawn on aren't cropped.
+    """
+    left, top, right, bottom = width, height, 0, 0
+    found = 0
+    for frame in sampleVideoFrames(inputFile, samples):
+        bounds = contentBounds(cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY), threshold)
+        if bounds is None:
+            continue
+        left = min(left, bounds[0])
+        top = min(top, bounds[1])
+        right = max(right, bounds[2])
+        bottom = max(bottom, bounds[3])
+        found += 1
+    if found == 0:
+        log("Crop detect: no usable frames")
+        return None
+    x, y = evenUp(left), evenUp(top)
+    crop = (x, y, evenDown(right - x), evenDown(bottom - y))
+    if crop[2] <= 0 or crop[3] <= 0 or crop[2:] == (width, height):
+        log("Crop detect: no black bars found")
+        return None
+    printAndLog(
+        f"Detected black bars, cropping to {crop[2]}x{crop[3]} at {crop[0]},{crop[1]}"
+    )
+    return crop
+
+
+def parseCrop(crop: str, width: int, height: int) -> tuple[int, int, int, int]:
+    """
+    Parses a crop in ffmpeg order, width:height:x:y, into (x, y, width, height)
+    """
+    try:
+        cropWidth, cropHeight, x, y = (int(value) for value in crop.split(":"))
+    except ValueError:
+        raise ValueError(
+            f"Invalid crop {crop}, please use auto, none, or width:height:x:y"
+        )
+    if (
+        cropWidth <= 0
+        or cropHeight <= 0
+        or x < 0
+        or y < 0
+        or x + cropWidth > width
+        or y + cropHeight > height
+    ):
+        raise ValueError(f"Crop {crop} does not fit in the {width}x{height} video")
+    if cropWidth % 2 or cropHeight % 2:
+        raise ValueError(f"Crop {crop} has to have an even width and height")
+    return x, y, cropWidth, cropHeight
+
+
+def outputCrop(
+    crop: tuple[int, int, int, int],
+    sourceWidth: int,
+    sourceHeight: int,
+    outputWidth: int,
+    outputHeight: int,
+) -> tuple[int, int, int, int]:
+    """
+    Where the cropped area ends up in an output of outputWidth x outputHeight, as (x, y, width, height).
+    Sizes are kept even, so the cropped output can be encoded on its own.
+    """
+    x, y, width, height = crop
+    scaleX = outputWidth / sourceWidth
+    scaleY = outputHeight / sourceHeight
+    outWidth = min(evenDown(round(width * scaleX)), outputWidth)
+    outHeight = min(evenDown(round(height * scaleY)), outputHeight)
+    outX = min(round(x * scaleX), outputWidth - outWidth)
+    outY = min(round(y * scaleY), outputHeight - outHeight)
+    return outX, outY, outWidth, outHeight
@@ -0,0 +1,234 @@
+import time
+import traceback
+from collections import deque
+from threading import Thread, Condition
+
+from .ReplicaPool import PendingFrame
+from .Util import log
+
+
+class DeviceExecutor:
+    """
+    One device the scheduler can send frames to.
+
+    Args:
+        name (str): Name for logs, ex: cuda:0.
+        function (callable): Takes a frame and returns the upscaled frame, has to be safe to call from concurrency threads at once.
+        concurrency (int, optional): Frames the device works on at once. Defaults to 1.
+        unload (callable, optional): Frees the device memory when the render is paused.
+        reload (callable, optional): Undoes unload.
+        smoothing (float, optional): Weight of the newest frame in the latency average. Defaults to 0.2.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        function,
+        concurrency: int = 1,
+        unload=None,
+        reload=None,
+        smoothing: float = 0.2,
+    ):
+        self.name = name
+        self.function = function
+        self.concurrency = max(1, concurrency)
+        self.unload = unload
+        self.reload = reload
+        self.smoothing = smoothing
+        self.queue = deque()
+        self.inFlight = 0
+        self.latency = None  # seconds per frame, moving average
+        self.framesDone = 0
+
+    def recordLatency(self, seconds: float):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += self.smoothing * (seconds - self.latency)
+        self.framesDone += 1
+
+    def expectedFinish(self, latency: float) -> float:
+        """
+        Time until one more frame queued here would be done
+        """
+        return (len(self.queue) + self.inFlight + 1) * latency / self.concurrency
+
+
+class DeviceScheduler:
+    """
+    Spreads frames over several devices (gpus, cpu replica groups) of different speeds.
+    Per frame latency is measured on every device while rendering, and a frame goes to the device that is expected to finish it first,
+    so faster devices get proportionally more frames. An idle device takes queued frames from a slower one when it can finish them sooner.
+    Any executors work, which is what lets the scheduling be checked with a few cpu stand-ins.
+
+    Args:
+        executors (list[DeviceExecutor]): The devices.
+    """
+
+    def __init__(self, executors: list[DeviceExecutor]):
+        self.executors = executors
+        self.condition = Condition()
+        self.running = True
+        self.threads = [
+            Thread(
+                target=self.workerLoop,
+                args=(executor,),
+                name=f"{executor.name}-executor",
+                daemon=True,
+            )
+            for executor in executors
+            for _ in range(executor.concurrency)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def knownLatency(self, executor: DeviceExecutor) -> float:
+        if executor.latency is not None:
+            return executor.latency
+        # not measured yet, assume it is as fast as the fastest device so it gets frames to measure with
+        known = [e.latency for e in self.executors if e.latency is not None]
+        return min(known) if known else 0.0
+
+    def submit(self, frame) -> PendingFrame:
+        waiter = PendingFrame()
+        with self.condition:
+            executor = min(
+                self.executors,
+                key=lambda e: (
+                    e.expectedFinish(self.knownLatency(e)),
+                    len(e.queue) + e.inFlight,
+                ),
+            )
+            executor.queue.append((frame, waiter))
+            self.condition.notify_all()
+        return waiter
+
+    def render(self, frame):
+        """
+        Upscales one frame on whichever device gets it, blocks until it is done
+        """
+        waiter = self.submit(frame)
+        waiter.event.wait()
+        if waiter.error is not None:
+            raise RuntimeError(waiter.error)
+        return waiter.output
+
+    def imap(self, frames, window: int = None):
+        """
+        Yields the upscaled frames in order, keeping up to window frames in flight
+        """
+        if window is None:
+            window = 2 * sum(e.concurrency for e in self.executors)
+        pending = deque()
+        for frame in frames:
+            pending.append(self.submit(frame))
+            if len(pending) >= window:
+                yield self.result(pending.popleft())
+        while pending:
+            yield self.result(pending.popleft())
+
+    def result(self, waiter: PendingFrame):
+        waiter.event.wait()
+        if waiter.error is not None:
+            raise RuntimeError(waiter.error)
+        return waiter.output
+
+    def takeWork(self, executor: DeviceExecutor):
+        """
+        Next frame for executor, from its own queue, or stolen from the end of the queue where it would wait the longest.
+        Has to be called with the condition held.
+        """
+        if executor.queue:
+            return executor.queue.popleft()
+        ownLatency = self.knownLatency(executor)
+        victim = None
+        longestWait = 0.0
+        for other in self.executors:
+            if other is executor or not other.queue:
+                continue
+            # when the last frame in the other queue would be done there
+            wait = (
+                (len(other.queue) + other.inFlight)
+                * self.knownLatency(other)
+                / other.concurrency
+            )
+            if wait > ownLatency and wait > longestWait:
+                victim, longestWait = other, wait
+        if victim is not None:
+            return victim.queue.pop()
+        return None
+
+    def workerLoop(self, executor: DeviceExecutor):
+        while True:
+            with self.condition:
+                work = self.takeWork(executor)
+                while work is None and self.running:
+                    self.condition.wait()
+                    work = self.takeWork(executor)
+                if work is None:
+                    return
+                executor.inFlight += 1
+            frame, waiter = work
+            start = time.perf_counter()
+            try:
+                waiter.output = executor.function(frame)
+            except Exception:
+                waiter.error = f"{executor.name} failed:\n{traceback.format_exc()}"
+            with self.condition:
+                executor.inFlight -= 1
+                if waiter.error is None:
+                    executor.recordLatency(time.perf_counter() - start)
+                # a finished frame can make stealing worth it for the idle devices
+                self.condition.notify_all()
+            waiter.event.set()
+
+    def unload(self):
+        for executor in self.executors:
+            if executor.unload is not None:
+                executor.unload()
+
+    def reload(self):
+        for executor in self.executors:
+            if executor.reload is not None:
+                executor.reload()
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        log(self.report())
+
+    def report(self) -> str:
+        lines = ["Device scheduler:"]
+        for executor in self.executors:
+            latency = (
+                f"{round(executor.latency * 1000, 2)}ms/frame"
+                if executor.latency is not None
+                else "no frames"
+            )
+            lines.append(
+                f"  {executor.name} (concurrency={executor.concurrency}): "
+                + f"{executor.framesDone} frames, {latency}"
+            )
+        return "\n".join(lines)
+
+
+def parseDevices(devices: str) -> list[str]:
+    """
+    Parses the --devices argument, ex: "cuda:0,cuda:1,cpu"
+    """
+    parsed = []
+    if not devices:
+        return parsed
+    for device in devices.split(","):
+        device = device.strip().lower()
+        if device != "cpu" and not (
+            device.startswith("cuda:") and device[len("cuda:") :].isdigit()
+        ):
+            raise ValueError(
+                f"Invalid device {device}, please use something like cuda:0,cuda:1,cpu"
+            )
+        parsed.append(device)
+    return parsed
@@ -0,0 +1,76 @@
+import cv2
+import numpy as np
+
+
+class DuplicateDetector:
+    """
+    Finds input frames that are (nearly) the same as the last frame that was actually upscaled, so the upscaled output can be reused.
+    Frames are compared by a small luma fingerprint, every cell of it is the average of a block of pixels,
+    comparing against the last upscaled frame instead of the previous one keeps slow changes from adding up over a long run.
+
+    Args:
+        width (int): Width of the frames.
+        height (int): Height of the frames.
+        tolerance (float, optional): Max difference of any fingerprint cell (0-255 luma) for a frame to count as a duplicate.
+            0 only skips frames that are byte for byte the same. Defaults to 2.0.
+        fingerprintWidth (int, optional): Width of the fingerprint, the height keeps the aspect ratio. Defaults to 128.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        tolerance: float = 2.0,
+        fingerprintWidth: int = 128,
+    ):
+        self.width = width
+        self.height = height
+        self.tolerance = tolerance
+        self.fingerprintSize = (
+            min(fingerprintWidth, width),
+            max(1, round(min(fingerprintWidth, width) * height / width)),
+        )
+        self.reference = None
+        self.framesChecked = 0
+        self.duplicates = 0
+        self.currentRun = 0
+        self.longestRun = 0
+
+    def fingerprint(self, frame) -> np.ndarray:
+        image = np.frombuffer(frame, dtype=np.uint8).reshape(
+            self.height, self.width, 3
+        )
+        small = cv2.resize(image, self.fingerprintSize, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_RGB2GRAY).astype(np.int16)
+
+    def isDuplicate(self, frame) -> bool:
+        """
+        Checks a frame against the last non duplicate frame, frames have to be passed in order
+        """
+        self.framesChecked += 1
+        if self.tolerance == 0:
+            current = bytes(frame)
+            duplicate = self.reference is not None and current == self.reference
+        else:
+            current = self.fingerprint(frame)
+            duplicate = (
+                self.reference is not None
+                and np.abs(current - self.reference).max() <= self.tolerance
+            )
+        if duplicate:
+            self.duplicates += 1
+            self.currentRun += 1
+            self.longestRun = max(self.longestRun, self.currentRun)
+        else:
+            self.reference = current
+            self.currentRun = 0
+        return duplicate
+
+    def report(self) -> str:
+        if self.framesChecked == 0:
+            return "Duplicate frames: no frames checked"
+        percent = round(self.duplicates / self.framesChecked * 100, 1)
+        return (
+            f"Duplicate frames: skipped {self.duplicates} of {self.framesChecked} ({percent}%), "
+            + f"longest run: {self.longestRun}"
+        )
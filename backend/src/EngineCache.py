@@ -0,0 +1,469 @@
+import os
+import sys
+import re
+import json
+import time
+import shutil
+import argparse
+from threading import Lock
+
+from .Util import log, printAndLog, modelsDirectory
+
+"""
+Keeps track of everything built from a model that can be rebuilt (tensorrt engines, int8 models, onnx exports, openvino models and blobs, torch.compile artifacts).
+Every artifact is recorded in an index with its size, when it was last used and what it was built with, so old ones can be removed:
+    artifacts built with runtime versions that aren't installed anymore can never be loaded again, prune removes them
+    if a size limit is set, the least recently used artifacts are removed once the cache is bigger than that
+Run with python -m src.EngineCache (list/prune/limit/prewarm).
+"""
+
+INDEX_NAME = "engine_cache.json"
+
+# what each kind of artifact looks like on disk, for artifacts made before the index existed
+ARTIFACT_SUFFIXES = {
+    "tensorrt": (".ts", ".dyn"),
+    "int8": (".pt",),
+    "onnx": (".onnx",),
+    "openvino": (".xml", ".blob"),
+    "torch_compile": (".bin",),
+}
+
+# runtime versions that are part of artifact file names, so artifacts found by a scan can still be judged stale
+NAME_VERSIONS = {
+    "tensorrt": re.compile(r"_trt-([^_]+)"),
+    "torch_tensorrt": re.compile(r"_torch_tensorrt-([^_]+)"),
+    "torch": re.compile(r"_torch-(.+)\.(?:bin|pt)$"),
+    "openvino": re.compile(r"_ov-(.+)\.xml$"),
+}
+
+indexLock = Lock()
+# artifacts used by this process are never evicted, they may still be loaded
+usedThisRun = set()
+
+
+def indexPath() -> str:
+    return os.path.join(modelsDirectory(), INDEX_NAME)
+
+
+def artifactFiles(path: str) -> list[str]:
+    """
+    The files that make up an artifact, openvino models keep their weights in a .bin next to the .xml
+    """
+    files = [path]
+    if path.endswith(".xml"):
+        files.append(path[:-4] + ".bin")
+    return files
+
+
+def artifactSize(path: str) -> int:
+    size = 0
+    for file in artifactFiles(path):
+        if os.path.isdir(file):
+            for root, _, names in os.walk(file):
+                size += sum(os.path.getsize(os.path.join(root, name)) for name in names)
+        elif os.path.isfile(file):
+            size += os.path.getsize(file)
+    return size
+
+
+def removeArtifact(path: str):
+    for file in artifactFiles(path):
+        if os.path.isdir(file):
+            shutil.rmtree(file, ignore_errors=True)
+        elif os.path.isfile(file):
+            os.remove(file)
+
+
+def keyFromName(name: str) -> dict:
+    key = {}
+    for runtime, pattern in NAME_VERSIONS.items():
+        match = pattern.search(name)
+        if match is not None:
+            key[runtime] = match.group(1)
+    return key
+
+
+def runtimeVersions() -> dict:
+    """
+    Versions of the installed runtimes, anything that can't be imported is left out so its artifacts aren't judged
+    """
+    versions = {}
+    try:
+        import torch
+
+        versions["torch"] = torch.__version__
+    except ImportError:
+        pass
+    try:
+        import tensorrt
+
+        versions["tensorrt"] = tensorrt.__version__
+    except ImportError:
+        pass
+    try:
+        import torch_tensorrt
+
+        versions["torch_tensorrt"] = torch_tensorrt.__version__
+    except ImportError:
+        pass
+    try:
+        import openvino as ov
+
+        versions["openvino"] = ov.get_version().split("-")[0]
+    except ImportError:
+        pass
+    try:
+        from .ExportONNX import EXPORT_VERSION
+
+        versions["onnx_export"] = str(EXPORT_VERSION)
+    except ImportError:
+        pass
+    return versions
+
+
+class EngineCache:
+    """
+    The index of built artifacts, stored as json in the models directory.
+    Entries are keyed by the artifact's path, with its kind, size, last use, and key (resolution, precision, device and the runtime versions it was built with).
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path if path is not None else indexPath()
+
+    def load(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("maxBytes", 0)
+        index.setdefault("entries", {})
+        return index
+
+    def save(self, index: dict):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # written next to the index and swapped in, so a crash or another process never sees half a file
+        tempPath = f"{self.path}.{os.getpid()}.tmp"
+        with open(tempPath, "w") as f:
+            json.dump(index, f, indent=4)
+        os.replace(tempPath, self.path)
+
+    def use(self, path: str, kind: str, key: dict = None):
+        """
+        Records that an artifact was built or loaded, then enforces the size limit
+        """
+        path = os.path.realpath(path)
+        usedThisRun.add(path)
+        try:
+            with indexLock:
+                index = self.load()
+                entry = index["entries"].get(path, {})
+                entry.update(
+                    {
+                        "kind": kind,
+                        "size": artifactSize(path),
+                        "lastUsed": time.time(),
+                    }
+                )
+                if key is not None:
+                    entry["key"] = {name: str(value) for name, value in key.items()}
+                entry.setdefault("key", {})
+                index["entries"][path] = entry
+                self.evict(index)
+                self.save(index)
+        except OSError as e:
+            # the cache is only bookkeeping, it should never stop a render
+            log(f"Unable to update the engine cache index: {e}")
+
+    def evict(self, index: dict) -> list[str]:
+        """
+        Removes the least recently used artifacts until the cache fits in maxBytes (0 is no limit)
+        """
+        maxBytes = index["maxBytes"]
+        if not maxBytes:
+            return []
+        entries = index["entries"]
+        total = sum(entry["size"] for entry in entries.values())
+        removed = []
+        for path, entry in sorted(
+            entries.items(), key=lambda item: item[1]["lastUsed"]
+        ):
+            if total <= maxBytes:
+                break
+            if path in usedThisRun:
+                continue
+            removeArtifact(path)
+            total -= entry["size"]
+            removed.append(path)
+            printAndLog(
+                f"Engine cache is over {maxBytes / 1e9:.2f}GB, removed {os.path.basename(path)}"
+            )
+        for path in removed:
+            del entries[path]
+        return removed
+
+    def scan(self, index: dict, directory: str = None):
+        """
+        Adds artifacts that aren't in the index yet (made by older versions, or copied in), their last use is their modification time.
+        Entries whose files are gone are dropped.
+        """
+        directory = directory if directory is not None else modelsDirectory()
+        entries = index["entries"]
+        for path in [path for path in entries if not os.path.exists(path)]:
+            del entries[path]
+        for root, _, names in os.walk(directory):
+            for name in names:
+                kind = self.guessKind(os.path.join(root, name))
+                path = os.path.realpath(os.path.join(root, name))
+                if kind is None or path in entries:
+                    continue
+                entries[path] = {
+                    "kind": kind,
+                    "size": artifactSize(path),
+                    "lastUsed": os.path.getmtime(path),
+                    "key": keyFromName(name),
+                }
+        inductor = os.path.realpath(
+            os.path.join(directory, "torch_compile", "inductor")
+        )
+        if os.path.isdir(inductor):
+            # inductor manages its own files, the whole directory is one entry
+            entries.setdefault(
+                inductor,
+                {
+                    "kind": "torch_compile",
+                    "lastUsed": os.path.getmtime(inductor),
+                    "key": {},
+                },
+            )
+            entries[inductor]["size"] = artifactSize(inductor)
+
+    def guessKind(self, path: str) -> str | None:
+        parts = path.split(os.sep)
+        if "inductor" in parts:
+            return None
+        name = os.path.basename(path)
+        for kind, suffixes in ARTIFACT_SUFFIXES.items():
+            if not name.endswith(suffixes):
+                continue
+            if kind == "tensorrt" and "_trt-" not in name:
+                return None
+            if kind == "int8" and "_int8-" not in name:
+                return None
+            if kind in ("onnx", "openvino", "torch_compile") and kind not in parts:
+                return None
+            return kind
+        return None
+
+    def staleEntries(self, index: dict) -> list[str]:
+        """
+        Artifacts built with a version of a runtime other than the installed one
+        """
+        versions = runtimeVersions()
+        stale = []
+        for path, entry in index["entries"].items():
+            for name, version in entry["key"].items():
+                if name in versions and versions[name] != version:
+                    stale.append(path)
+                    break
+        return stale
+
+    def prune(self, stale: bool = True, maxBytes: int = None) -> list[str]:
+        """
+        Removes stale artifacts, then evicts down to maxBytes (the saved limit if None)
+        """
+        with indexLock:
+            index = self.load()
+            self.scan(index)
+            removed = []
+            if stale:
+                for path in self.staleEntries(index):
+                    removeArtifact(path)
+                    del index["entries"][path]
+                    removed.append(path)
+                    printAndLog(f"Removed stale {os.path.basename(path)}")
+            if maxBytes is not None:
+                savedLimit = index["maxBytes"]
+                index["maxBytes"] = maxBytes
+                removed += self.evict(index)
+                index["maxBytes"] = savedLimit
+            else:
+                removed += self.evict(index)
+            self.save(index)
+        return removed
+
+    def setLimit(self, maxBytes: int):
+        with indexLock:
+            index = self.load()
+            index["maxBytes"] = maxBytes
+            self.save(index)
+
+    def entries(self) -> tuple[list[tuple[str, dict]], int]:
+        """
+        Every artifact, most recently used first, and the size limit
+        """
+        with indexLock:
+            index = self.load()
+            self.scan(index)
+            self.save(index)
+        return (
+            sorted(index["entries"].items(), key=lambda item: -item[1]["lastUsed"]),
+            index["maxBytes"],
+        )
+
+
+def waitForCompile(model):
+    # torch.compile models build in the background, prewarming is only done once they're ready
+    while hasattr(model, "ready") and not (model.ready or model.failed):
+        time.sleep(1)
+
+
+def prewarm(args):
+    """
+    Builds the engines a render with these settings would use, without a video
+    """
+    import numpy as np
+
+    frame = np.zeros((args.height, args.width, 3), dtype=np.uint8).tobytes()
+    if args.upscaleModel:
+        if args.backend in ("pytorch", "pytorch-compile", "tensorrt"):
+            from .UpscaleTorch import UpscalePytorch
+
+            upscale = UpscalePytorch(
+                args.upscaleModel,
+                precision=args.precision,
+                width=args.width,
+                height=args.height,
+                tilesize=args.tilesize,
+                backend=args.backend,
+            )
+            upscale.renderFrame(frame)
+            waitForCompile(upscale.model)
+        elif args.backend == "openvino":
+            from .UpscaleOpenVINO import UpscaleOpenVINO
+
+            UpscaleOpenVINO(
+                args.upscaleModel,
+                precision=args.precision,
+                width=args.width,
+                height=args.height,
+            ).renderFrame(frame)
+        elif args.backend == "onnx":
+            from .ExportONNX import ONNXExporter
+
+            ONNXExporter(args.upscaleModel, fp16=args.precision == "float16").export(
+                (args.width, args.height)
+            )
+        else:
+            raise ValueError(f"Prewarming is not supported for {args.backend}")
+    if args.interpolateModel:
+        if args.backend in ("pytorch", "pytorch-compile", "tensorrt"):
+            from .InterpolateTorch import InterpolateRifeTorch
+
+            interpolate = InterpolateRifeTorch(
+                args.interpolateModel,
+                width=args.width,
+                height=args.height,
+                dtype=args.precision,
+                backend=args.backend,
+            )
+            img0 = interpolate.frame_to_tensor(frame)
+            img1 = interpolate.frame_to_tensor(frame)
+            encoded = (
+                (None, None)
+                if interpolate.rife46 or interpolate.gmfss
+                else (interpolate.encode_Frame(img0), interpolate.encode_Frame(img1))
+            )
+            interpolate.process(img0, img1, 0.5, *encoded)
+            waitForCompile(interpolate.flownet)
+            waitForCompile(getattr(interpolate, "encode", None))
+        elif args.backend == "openvino":
+            from .InterpolateOpenVINO import InterpolateRifeOpenVINO
+
+            InterpolateRifeOpenVINO(
+                args.interpolateModel,
+                width=args.width,
+                height=args.height,
+                precision=args.precision,
+            )
+        elif args.backend == "onnx":
+            from .ExportONNX import ONNXExporter
+
+            ONNXExporter(args.interpolateModel).export((args.width, args.height))
+        else:
+            raise ValueError(f"Prewarming is not supported for {args.backend}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Manages the engines and compiled models built from models"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="Lists cached artifacts, most recently used first")
+    pruneParser = commands.add_parser(
+        "prune",
+        help="Removes artifacts built for runtime versions that aren't installed, and evicts down to the size limit",
+    )
+    pruneParser.add_argument(
+        "--max_size",
+        help="Evict down to this many GB this time, instead of the saved limit",
+        type=float,
+        default=None,
+    )
+    pruneParser.add_argument(
+        "--keep_stale",
+        help="Don't remove artifacts from other runtime versions",
+        action="store_true",
+    )
+    limitParser = commands.add_parser(
+        "limit", help="Sets the size limit enforced whenever something is cached"
+    )
+    limitParser.add_argument("size", help="Limit in GB, 0 for no limit", type=float)
+    prewarmParser = commands.add_parser(
+        "prewarm", help="Builds the engines a render would use ahead of time"
+    )
+    prewarmParser.add_argument(
+        "-b",
+        "--backend",
+        help="(pytorch/pytorch-compile/tensorrt/onnx/openvino, default=tensorrt)",
+        default="tensorrt",
+    )
+    prewarmParser.add_argument("--upscaleModel", type=str, default=None)
+    prewarmParser.add_argument("--interpolateModel", type=str, default=None)
+    prewarmParser.add_argument("--width", type=int, required=True)
+    prewarmParser.add_argument("--height", type=int, required=True)
+    prewarmParser.add_argument("--precision", type=str, default="auto")
+    prewarmParser.add_argument("-t", "--tilesize", type=int, default=0)
+    args = parser.parse_args()
+
+    cache = EngineCache()
+    if args.command == "list":
+        entries, maxBytes = cache.entries()
+        total = sum(entry["size"] for _, entry in entries)
+        for path, entry in entries:
+            lastUsed = time.strftime(
+                "%Y-%m-%d %H:%M", time.localtime(entry["lastUsed"])
+            )
+            print(
+                f"{entry['kind']:<14}{entry['size'] / 1e6:>10.1f}MB  {lastUsed}  {path}"
+            )
+        limit = f"{maxBytes / 1e9:.2f}GB" if maxBytes else "no limit"
+        print(f"{len(entries)} artifacts, {total / 1e9:.2f}GB ({limit})")
+    elif args.command == "prune":
+        removed = cache.prune(
+            stale=not args.keep_stale,
+            maxBytes=int(args.max_size * 1e9) if args.max_size is not None else None,
+        )
+        print(f"Removed {len(removed)} artifacts")
+    elif args.command == "limit":
+        cache.setLimit(int(args.size * 1e9))
+    elif args.command == "prewarm":
+        if not args.upscaleModel and not args.interpolateModel:
+            sys.exit(
+                "Nothing to prewarm, pass --upscaleModel and/or --interpolateModel"
+            )
+        prewarm(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+import os
+import hashlib
+import argparse
+
+import numpy as np
+import torch
+
+from .EngineCache import EngineCache
+from .Quantize import psnr
+from .Util import log, printAndLog, modelsDirectory
+
+# bumped when the export itself changes, so older cached exports aren't reused
+EXPORT_VERSION = 1
+
+
+def fileHash(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def parseShapes(shapes: str) -> list[tuple[int, int]]:
+    """
+    Parses bucket sizes like 1920x1080,1280x720 into [(width, height), ...]
+    """
+    parsed = []
+    for shape in shapes.split(","):
+        width, height = (int(value) for value in shape.lower().split("x"))
+        parsed.append((width, height))
+    return parsed
+
+
+def gridSamplerSymbolic(g, input, grid, interpolationMode, paddingMode, alignCorners):
+    """
+    The RIFE warp calls aten::grid_sampler_2d directly, which the exporter only knows through F.grid_sample, so map it to GridSample here
+    """
+    from torch.onnx import symbolic_helper
+
+    modes = ["bilinear", "nearest", "bicubic"]
+    paddings = ["zeros", "border", "reflection"]
+    return g.op(
+        "GridSample",
+        input,
+        grid,
+        mode_s=modes[symbolic_helper._maybe_get_const(interpolationMode, "i")],
+        padding_mode_s=paddings[symbolic_helper._maybe_get_const(paddingMode, "i")],
+        align_corners_i=int(symbolic_helper._maybe_get_const(alignCorners, "b")),
+    )
+
+
+class RifeExport(torch.nn.Module):
+    """
+    Wraps a RIFE IFNet so it takes one input, img0, img1 and the timestep stacked along the channels (1, 7, height, width).
+    The encoder and the warp grid are part of the graph, so the export works on its own.
+    Frames have to be padded to the size it was exported at.
+    """
+
+    def __init__(self, interpolate):
+        super().__init__()
+        self.flownet = interpolate.flownet
+        self.encode = None if interpolate.rife46 else interpolate.encode
+        self.register_buffer("tenFlow_div", interpolate.tenFlow_div)
+        self.register_buffer("backwarp_tenGrid", interpolate.backwarp_tenGrid)
+
+    def forward(self, x):
+        img0 = x[:, :3]
+        img1 = x[:, 3:6]
+        timestep = x[:, 6:7]
+        if self.encode is None:
+            return self.flownet(
+                img0, img1, timestep, self.tenFlow_div, self.backwarp_tenGrid
+            )
+        return self.flownet(
+            img0,
+            img1,
+            timestep,
+            self.tenFlow_div,
+            self.backwarp_tenGrid,
+            self.encode(img0),
+            self.encode(img1),
+        )
+
+
+class ONNXExporter:
+    """
+    Exports spandrel upscale models and RIFE models to onnx, for the onnx and directml backends.
+    Every export is checked against the pytorch model on random frames, and stored in a cache addressed by the hash of the model file and the export settings,
+    so exporting the same model the same way again just returns the cached file.
+
+    Args:
+        modelPath (str): .pth/.safetensors upscale model, or a RIFE .pkl.
+        cacheDir (str, optional): Where exports are stored. Defaults to models/onnx.
+        opset (int, optional): ONNX opset. Defaults to 17.
+        fp16 (bool, optional): Convert the export to float16. Defaults to False.
+        minPSNR (float, optional): Lowest PSNR against the pytorch model an export can have. Defaults to 40 (35 for float16).
+    """
+
+    def __init__(
+        self,
+        modelPath: str,
+        cacheDir: str = None,
+        opset: int = 17,
+        fp16: bool = False,
+        minPSNR: float = None,
+    ):
+        self.modelPath = modelPath
+        self.cacheDir = (
+            cacheDir
+            if cacheDir is not None
+            else os.path.join(modelsDirectory(), "onnx")
+        )
+        self.opset = opset
+        self.fp16 = fp16
+        self.minPSNR = minPSNR if minPSNR is not None else (35.0 if fp16 else 40.0)
+        self.isRife = modelPath.endswith(".pkl")
+        self.modelHash = fileHash(modelPath)
+
+    def cachePath(self, shape: tuple[int, int] | None) -> str:
+        """
+        dynamic exports have a shape of None
+        """
+        settings = f"{self.modelHash}-{shape}-{self.opset}-{self.fp16}-{EXPORT_VERSION}"
+        key = hashlib.sha256(settings.encode()).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(self.modelPath))[0]
+        shapeName = f"{shape[0]}x{shape[1]}" if shape is not None else "dynamic"
+        precision = "fp16" if self.fp16 else "fp32"
+        return os.path.join(
+            self.cacheDir, f"{name}_{shapeName}_{precision}_op{self.opset}_{key}.onnx"
+        )
+
+    def loadUpscaleModel(self):
+        from .spandrel import ModelLoader, ImageModelDescriptor
+
+        model = ModelLoader().load_from_file(self.modelPath)
+        assert isinstance(model, ImageModelDescriptor)
+        return model.model.eval().float(), model.scale
+
+    def loadRifeModel(self, width: int, height: int):
+        from .InterpolateTorch import InterpolateRifeTorch
+
+        interpolate = InterpolateRifeTorch(
+            self.modelPath, width=width, height=height, device="cpu", dtype="float32"
+        )
+        if interpolate.gmfss:
+            raise ValueError("GMFSS can't be exported to onnx")
+        if self.opset < 16:
+            raise ValueError("RIFE exports need opset 16 or newer for GridSample")
+        return RifeExport(interpolate).eval(), interpolate.pw, interpolate.ph
+
+    def exampleInput(self, width: int, height: int) -> torch.Tensor:
+        if self.isRife:
+            frames = torch.rand(1, 6, height, width)
+            return torch.cat([frames, torch.full((1, 1, height, width), 0.5)], dim=1)
+        return torch.rand(1, 3, height, width)
+
+    @torch.inference_mode()
+    def validate(self, model, path: str, shapes: list[tuple[int, int]]) -> float:
+        """
+        Runs random frames through the pytorch model and the export, returns the lowest PSNR between them
+        """
+        import onnxruntime as ort
+
+        session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        inputName = session.get_inputs()[0].name
+        lowest = float("inf")
+        for width, height in shapes:
+            image = self.exampleInput(width, height)
+            reference = model(image)
+            output = session.run(
+                None,
+                {
+                    inputName: image.numpy().astype(
+                        np.float16 if self.fp16 else np.float32
+                    )
+                },
+            )[0]
+            output = torch.from_numpy(output.astype(np.float32))
+            if self.isRife:
+                # the flownet returns a 0-255 hwc frame, ready to be written out
+                reference, output = reference / 255, output / 255
+            quality = psnr(reference, output)
+            log(f"ONNX export check at {width}x{height}: {quality:.2f}dB")
+            lowest = min(lowest, quality)
+        if lowest < self.minPSNR:
+            os.remove(path)
+            raise ValueError(
+                f"The onnx export doesn't match the pytorch model ({lowest:.2f}dB < {self.minPSNR}dB)"
+            )
+        return lowest
+
+    def export(self, shape: tuple[int, int] | None) -> str:
+        """
+        Exports for one (width, height), or with dynamic height and width if shape is None (upscale models only).
+        Returns the path of the onnx file.
+        """
+        path = self.cachePath(shape)
+        if os.path.isfile(path):
+            printAndLog(f"Using cached onnx export {path}")
+            self.recordUse(path, shape)
+            return path
+        os.makedirs(self.cacheDir, exist_ok=True)
+        metadata = {"export_version": str(EXPORT_VERSION)}
+        if self.isRife:
+            if shape is None:
+                raise ValueError(
+                    "RIFE exports need a shape, the warp grid depends on the frame size"
+                )
+            model, width, height = self.loadRifeModel(*shape)
+            metadata["padded_size"] = f"{width}x{height}"
+            checkShapes = [(width, height)]
+        else:
+            model, scale = self.loadUpscaleModel()
+            metadata["scale"] = str(scale)
+            width, height = shape if shape is not None else (256, 256)
+            # a different size catches shapes that were baked into the graph
+            checkShapes = (
+                [(width, height)] if shape is not None else [(256, 256), (200, 136)]
+            )
+        exampleInput = self.exampleInput(width, height)
+        dynamicAxes = None
+        if shape is None:
+            dynamicAxes = {
+                "input": {0: "batch", 2: "height", 3: "width"},
+                "output": {0: "batch", 2: "outputHeight", 3: "outputWidth"},
+            }
+        if self.isRife:
+            torch.onnx.register_custom_op_symbolic(
+                "aten::grid_sampler_2d", gridSamplerSymbolic, 16
+            )
+        tempPath = path + ".tmp"
+        torch.onnx.export(
+            model,
+            (exampleInput,),
+            tempPath,
+            input_names=["input"],
+            output_names=["output"],
+            dynamic_axes=dynamicAxes,
+            opset_version=self.opset,
+            dynamo=False,
+        )
+        self.finalize(tempPath, metadata)
+        quality = self.validate(model, tempPath, checkShapes)
+        os.replace(tempPath, path)
+        printAndLog(
+            f"Exported {self.modelPath} to {path} ({quality:.2f}dB against pytorch)"
+        )
+        self.recordUse(path, shape)
+        return path
+
+    def recordUse(self, path: str, shape: tuple[int, int] | None):
+        EngineCache().use(
+            path,
+            "onnx",
+            {
+                "model": os.path.basename(self.modelPath),
+                "shape": "dynamic" if shape is None else f"{shape[0]}x{shape[1]}",
+                "precision": "fp16" if self.fp16 else "fp32",
+                "onnx_export": EXPORT_VERSION,
+            },
+        )
+
+    def finalize(self, path: str, metadata: dict):
+        """
+        Adds the metadata, and converts to float16 if asked for
+        """
+        import onnx
+
+        model = onnx.load(path)
+        if self.fp16:
+            from onnxconverter_common import float16
+
+            model = float16.convert_float_to_float16(model)
+        for key, value in metadata.items():
+            entry = model.metadata_props.add()
+            entry.key = key
+            entry.value = value
+        onnx.save(model, path)
+
+    def exportAll(self, shapes: list[tuple[int, int]] | None) -> list[str]:
+        """
+        One export per bucket, or a single dynamic one if shapes is None
+        """
+        if shapes is None:
+            return [self.export(None)]
+        return [self.export(shape) for shape in shapes]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Exports upscale and RIFE models to onnx for the onnx and directml backends"
+    )
+    parser.add_argument(
+        "model", help="upscale model (.pth/.safetensors) or RIFE model (.pkl)"
+    )
+    parser.add_argument(
+        "--shapes",
+        help="Sizes to export for, one file per size. Ex: (1920x1080,1280x720, default=dynamic size, RIFE needs sizes)",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--fp16", help="Convert the export to float16", action="store_true"
+    )
+    parser.add_argument("--opset", help="ONNX opset (default=17)", type=int, default=17)
+    parser.add_argument(
+        "--cache_dir",
+        help="Where exports are stored (default=models/onnx)",
+        type=str,
+        default=None,
+    )
+    args = parser.parse_args()
+    exporter = ONNXExporter(
+        args.model, cacheDir=args.cache_dir, opset=args.opset, fp16=args.fp16
+    )
+    for exportPath in exporter.exportAll(
+        parseShapes(args.shapes) if args.shapes else None
+    ):
+        print(exportPath)
@@ -6,7 +6,10 @@ import queue
 import sys
 import time
 import math
+import multiprocessing as mp
 from multiprocessing import shared_memory
+from .SharedMemoryRing import SharedMemoryRing, decodeWorker, encodeWorker
+from .CropDetect import outputCrop
 from .Util import (
     currentDirectory,
     log,
@@ -17,6 +20,20 @@ from .Util import (
 from threading import Thread
 
 
+def acquireEncodeSlot(ring: SharedMemoryRing, encodeProcess) -> int:
+    """
+    Waits for the encode process to free a slot, raises if it died instead of waiting forever
+    """
+    while True:
+        try:
+            return ring.acquireFree(timeout=1)
+        except queue.Empty:
+            if not encodeProcess.is_alive():
+                raise RuntimeError(
+                    f"The encoder exited with code {encodeProcess.exitcode}, see {ffmpegLogFile()}"
+                )
+
+
 def convertTime(remaining_time):
     """
     Converts seconds to hours, minutes and seconds
@@ -33,6 +50,21 @@ def convertTime(remaining_time):
     return hours, minutes, seconds
 
 
+def parseResolution(resolution: str) -> tuple[int, int]:
+    """
+    Parses a resolution like 1920x1080 into (width, height)
+    """
+    try:
+        width, height = (int(value) for value in resolution.lower().split("x"))
+    except ValueError:
+        raise ValueError(
+            f"Invalid output resolution {resolution}, please use something like 1920x1080"
+        )
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Invalid output resolution {resolution}")
+    return width, height
+
+
 class FFMpegRender:
     """Args:
         inputFile (str): The path to the input file.
@@ -49,6 +81,9 @@ class FFMpegRender:
         shm (shared_memory.SharedMemory, optional): Shared memory object. Defaults to None.
         inputFrameChunkSize (int, optional): Size of input frame chunks. Defaults to None.
         outputFrameChunkSize (int, optional): Size of output frame chunks. Defaults to None.
+        resizedInBackend (bool, optional): Frames already come at upscale_output_resolution, so ffmpeg doesn't have to scale them. Defaults to False.
+        crop (tuple, optional): (x, y, width, height) of the source to decode, self.width and self.height have to already be the cropped size. Defaults to None.
+        cropOutput (bool, optional): Write the cropped output instead of padding the black bars back. Defaults to False.
     pass
     Gets the properties of the video file.
     Args:
@@ -95,6 +130,13 @@ class FFMpegRender:
         sharedMemoryID: str = None,
         channels=3,
         upscale_output_resolution: str = None,
+        resizedInBackend: bool = False,
+        crop: tuple = None,
+        cropOutput: bool = False,
+        processIO: bool = False,
+        ioRingSlots: int = 8,
+        decodeThreads: int = 0,
+        encodeThreads: int = 0,
     ):
         """
         Generates FFmpeg I/O commands to be used with VideoIO
@@ -106,6 +148,10 @@ class FFMpegRender:
         encoder: str, The exact name of the encoder ffmpeg will use (default=libx264)
         pixelFormat: str, The pixel format ffmpeg will use, (default=yuv420p)
         overwrite: bool, overwrite existing output file if it exists
+        processIO: bool, run the ffmpeg decode and encode loops in their own processes, exchanging frames through shared memory rings
+        ioRingSlots: int, number of frames each shared memory ring can hold
+        decodeThreads: int, threads ffmpeg uses to decode, 0 lets ffmpeg decide
+        encodeThreads: int, threads ffmpeg uses to encode, 0 lets ffmpeg decide
         """
         self.inputFile = inputFile
         self.outputFile = outputFile
@@ -120,20 +166,50 @@ class FFMpegRender:
         self.overwrite = overwrite
         self.readingDone = False
         self.writingDone = False
+        # why the decoder or encoder stopped early, raised by whoever waits for the render
+        self.readError = None
+        self.writeError = None
         self.writeOutPipe = False
         self.previewFrame = None
         self.crf = crf
         self.sharedMemoryID = sharedMemoryID
         self.upscale_output_resolution = upscale_output_resolution
+        self.resizedInBackend = resizedInBackend
+        self.crop = crop
+        self.cropOutput = cropOutput
+        # size of the final video, and where the (cropped) rendered frames go in it
+        if upscale_output_resolution is not None:
+            self.fullWidth, self.fullHeight = parseResolution(upscale_output_resolution)
+        else:
+            self.fullWidth = self.sourceWidth * self.upscaleTimes
+            self.fullHeight = self.sourceHeight * self.upscaleTimes
+        self.contentArea = (
+            outputCrop(
+                crop,
+                self.sourceWidth,
+                self.sourceHeight,
+                self.fullWidth,
+                self.fullHeight,
+            )
+            if crop is not None
+            else (0, 0, self.fullWidth, self.fullHeight)
+        )
+        # size of the frames coming out of the render
+        self.outputWidth = self.width * self.upscaleTimes
+        self.outputHeight = self.height * self.upscaleTimes
+        if upscale_output_resolution is not None and resizedInBackend:
+            self.outputWidth, self.outputHeight = self.contentArea[2:]
+        self.processIO = processIO
+        self.ioRingSlots = ioRingSlots
+        self.decodeThreads = decodeThreads
+        self.encodeThreads = encodeThreads
 
         self.subtitleFiles = []
         self.sharedMemoryThread = Thread(
             target=lambda: self.writeOutInformation(self.outputFrameChunkSize)
         )
         self.inputFrameChunkSize = self.width * self.height * channels
-        self.outputFrameChunkSize = (
-            self.width * self.upscaleTimes * self.height * self.upscaleTimes * channels
-        )
+        self.outputFrameChunkSize = self.outputWidth * self.outputHeight * channels
         self.shm = shared_memory.SharedMemory(
             name=self.sharedMemoryID, create=True, size=self.outputFrameChunkSize
         )
@@ -211,6 +287,9 @@ class FFMpegRender:
 
         self.width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         self.height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        # width and height become the cropped size if black bars are cropped
+        self.sourceWidth = self.width
+        self.sourceHeight = self.height
         self.totalInputFrames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         self.fps = cap.get(cv2.CAP_PROP_FPS)
 
@@ -218,10 +297,17 @@ class FFMpegRender:
 
     def getFFmpegReadCommand(self):
         log("Generating FFmpeg READ command...")
-        command = [
-            f"{ffmpegPath()}",
+        command = [f"{ffmpegPath()}"]
+        if self.decodeThreads > 0:
+            command += ["-threads", f"{self.decodeThreads}"]
+        command += [
             "-i",
             f"{self.inputFile}",
+        ]
+        if self.crop is not None:
+            x, y, width, height = self.crop
+            command += ["-vf", f"crop={width}:{height}:{x}:{y}"]
+        command += [
             "-f",
             "image2pipe",
             "-pix_fmt",
@@ -247,7 +333,7 @@ class FFMpegRender:
                 "-vcodec",
                 "rawvideo",
                 "-s",
-                f"{self.width * self.upscaleTimes}x{self.height * self.upscaleTimes}",
+                f"{self.outputWidth}x{self.outputHeight}",
                 "-r",
                 f"{self.fps * self.ceilInterpolateFactor}",
                 "-i",
@@ -263,16 +349,19 @@ class FFMpegRender:
                 "-loglevel",
                 "error",
             ]
-            if self.upscale_output_resolution is not None:
-                try:
-                    w,h = self.upscale_output_resolution.split("x")
-                except Exception:
-                    print("Invalid output resolution, please use something like 1920x1080. Exiting.")
-                    sys.exit()
-                command += [
-                    "-vf",
-                    f"scale={w}:{h}",
-                ]
+            filters = []
+            x, y, width, height = self.contentArea
+            if self.upscale_output_resolution is not None and not self.resizedInBackend:
+                filters.append(f"scale={width}:{height}")
+            if self.crop is not None and not self.cropOutput:
+                # pad the bars back with exact black
+                filters.append(
+                    f"pad={self.fullWidth}:{self.fullHeight}:{x}:{y}:black"
+                )
+            if filters:
+                command += ["-vf", ",".join(filters)]
+            if self.encodeThreads > 0:
+                command += ["-threads", f"{self.encodeThreads}"]
             for i in self.encoder.split():
                 command.append(i)
 
@@ -295,7 +384,7 @@ class FFMpegRender:
                 "-vcodec",
                 "rawvideo",
                 "-video_size",
-                f"{self.width*self.upscaleTimes}x{self.upscaleTimes*self.height}",
+                f"{self.outputWidth}x{self.outputHeight}",
                 "-pix_fmt",
                 "rgb24",
                 "-r",
@@ -310,6 +399,9 @@ class FFMpegRender:
         return command
 
     def readinVideoFrames(self):
+        if self.processIO:
+            self.readinVideoFramesFromProcess()
+            return
         log("Starting Video Read")
         self.readProcess = subprocess.Popen(
             self.getFFmpegReadCommand(),
@@ -327,6 +419,40 @@ class FFMpegRender:
         self.readProcess.stdout.close()
         self.readProcess.terminate()
 
+    def readinVideoFramesFromProcess(self):
+        """
+        Decoding happens in another process, so pipe reads don't hold the GIL the render thread needs.
+        The frame is copied out of the ring right away, so the slot can be reused by the decoder.
+        """
+        log("Starting Video Read in a separate process")
+        ring = SharedMemoryRing(
+            slotSize=self.inputFrameChunkSize, slotCount=self.ioRingSlots
+        )
+        decodeProcess = mp.get_context("spawn").Process(
+            target=decodeWorker,
+            args=(self.getFFmpegReadCommand(), ring.connectionInfo()),
+            name="decoder",
+            daemon=True,
+        )
+        decodeProcess.start()
+        try:
+            while True:
+                slot = ring.takeFilled(decodeProcess)
+                if slot is None:
+                    break
+                view = ring.slotView(slot)
+                self.readQueue.put(bytes(view))
+                view.release()
+                ring.releaseFree(slot)
+        except RuntimeError as e:
+            printAndLog(f"ERROR: The decoder failed, {e}")
+            self.readError = e
+        log("Ending Video Read")
+        self.readQueue.put(None)
+        self.readingDone = True
+        decodeProcess.join()
+        ring.close()
+
     def returnFrame(self, frame):
         return frame
 
@@ -400,6 +526,9 @@ class FFMpegRender:
         self.startTime = time.time()
         self.framesRendered: int = 1
         self.last_length: int = 0
+        if self.processIO:
+            self.writeOutVideoFramesToProcess()
+            return
         with open(ffmpegLogFile(), "w") as f:
             with subprocess.Popen(
                 self.getFFmpegWriteCommand(),
@@ -425,3 +554,45 @@ class FFMpegRender:
                 self.writingDone = True
 
                 printAndLog(f"\nTime to complete render: {round(renderTime, 2)}")
+
+    def writeOutVideoFramesToProcess(self):
+        """
+        Same as writeOutVideoFrames, but the pipe writes happen in another process that reads the frames from a shared memory ring
+        """
+        ring = SharedMemoryRing(
+            slotSize=self.outputFrameChunkSize, slotCount=self.ioRingSlots
+        )
+        encodeProcess = mp.get_context("spawn").Process(
+            target=encodeWorker,
+            args=(self.getFFmpegWriteCommand(), ring.connectionInfo(), ffmpegLogFile()),
+        )
+        encodeProcess.start()
+        try:
+            while True:
+                frame = self.writeQueue.get()
+                if frame is None:
+                    break
+                self.previewFrame = frame
+                slot = acquireEncodeSlot(ring, encodeProcess)
+                ring.writeSlot(slot, frame)
+                ring.publish(slot)
+                self.framesRendered += 1
+            ring.finish()
+            encodeProcess.join()
+            if encodeProcess.exitcode != 0:
+                raise RuntimeError(
+                    f"The encoder exited with code {encodeProcess.exitcode}, see {ffmpegLogFile()}"
+                )
+        except RuntimeError as e:
+            printAndLog(f"ERROR: {e}")
+            self.writeError = e
+            # the render thread blocks on a full queue otherwise
+            while frame is not None:
+                frame = self.writeQueue.get()
+        finally:
+            ring.close()
+
+        renderTime = time.time() - self.startTime
+        self.writingDone = True
+
+        printAndLog(f"\nTime to complete render: {round(renderTime, 2)}")
@@ -0,0 +1,300 @@
+import torch
+from threading import Lock
+
+
+class TensorRing:
+    """
+    A fixed set of preallocated tensors, handed out round robin.
+    A tensor is reused count frames later, so count has to be larger than the number of frames that can be alive at once
+    (render stages queue frames between each other).
+
+    Args:
+        count (int): Number of tensors.
+        shape (tuple): Shape of every tensor.
+        dtype (torch.dtype): Data type of every tensor.
+        device (torch.device): Device the tensors are allocated on.
+        pin_memory (bool, optional): Allocate page locked host memory, for async copies from/to the gpu. Defaults to False.
+        memory_format (torch.memory_format, optional): Layout of 4d tensors, channels_last matches frames coming from hwc buffers. Defaults to torch.contiguous_format.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        shape: tuple,
+        dtype: torch.dtype,
+        device: torch.device,
+        pin_memory: bool = False,
+        memory_format: torch.memory_format = torch.contiguous_format,
+    ):
+        self.tensors = [
+            torch.empty(
+                shape,
+                dtype=dtype,
+                device=device,
+                pin_memory=pin_memory,
+                memory_format=memory_format,
+            ).zero_()
+            for _ in range(max(1, count))
+        ]
+        self.index = 0
+        self.lock = Lock()
+
+    def next(self) -> torch.Tensor:
+        with self.lock:
+            tensor = self.tensors[self.index]
+            self.index = (self.index + 1) % len(self.tensors)
+        return tensor
+
+    def __len__(self):
+        return len(self.tensors)
+
+
+class TransferRing:
+    """
+    Rotating staging buffers for copying frames between the host and the device.
+    Every slot has a page locked host buffer, a device buffer and an event recorded after the last copy that used the slot,
+    so only the slot that comes around again is waited on, and the copies of the other slots can still be running.
+    On the cpu the copies are not needed, slots only have a host buffer and no events.
+
+    Args:
+        count (int): Number of slots, the max copies in flight.
+        shape (tuple): Shape of every buffer.
+        device (torch.device): Device to copy to/from.
+        dtype (torch.dtype, optional): Defaults to torch.uint8.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        shape: tuple,
+        device: torch.device,
+        dtype: torch.dtype = torch.uint8,
+    ):
+        count = max(1, count)
+        self.shape = shape
+        self.targetDevice = torch.device(device)
+        self.cuda = self.targetDevice.type == "cuda"
+        self.hostBuffers = TensorRing(
+            count, shape, dtype, torch.device("cpu"), pin_memory=self.cuda
+        ).tensors
+        self.deviceBuffers = (
+            TensorRing(count, shape, dtype, device).tensors if self.cuda else None
+        )
+        self.events = [torch.cuda.Event() for _ in range(count)] if self.cuda else None
+        # device buffers in other dtypes, for converting frames in place
+        self.workBuffers = {}
+        # a slot can only be used by one thread at a time
+        self.slotLocks = [Lock() for _ in range(count)]
+        self.index = 0
+        self.lock = Lock()
+
+    def acquire(self) -> int:
+        """
+        Takes the next slot, waits until the copies that last used it are done
+        """
+        with self.lock:
+            slot = self.index
+            self.index = (self.index + 1) % len(self.slotLocks)
+        self.slotLocks[slot].acquire()
+        if self.cuda:
+            self.events[slot].synchronize()
+        return slot
+
+    def record(self, slot: int, stream):
+        """
+        Marks the work queued on stream so far as using the slot
+        """
+        if self.cuda:
+            self.events[slot].record(stream)
+
+    def release(self, slot: int, stream=None):
+        """
+        Hands a slot back, the work queued on stream so far has to finish before it is used again
+        """
+        if stream is not None:
+            self.record(slot, stream)
+        self.slotLocks[slot].release()
+
+    def wait(self, slot: int):
+        """
+        Blocks until the copies queued on the slot are done, for reading the host buffer
+        """
+        if self.cuda:
+            self.events[slot].synchronize()
+
+    def toDevice(self, slot: int) -> torch.Tensor:
+        """
+        Queues the copy of the host buffer to the device buffer on the current stream, returns the device buffer
+        """
+        if self.cuda:
+            self.deviceBuffers[slot].copy_(self.hostBuffers[slot], non_blocking=True)
+        return self.device(slot)
+
+    def toHost(self, slot: int):
+        """
+        Queues the copy of the device buffer to the host buffer on the current stream
+        """
+        if self.cuda:
+            self.hostBuffers[slot].copy_(self.deviceBuffers[slot], non_blocking=True)
+
+    def workBuffer(self, slot: int, dtype: torch.dtype) -> torch.Tensor:
+        """
+        A device buffer of the slot's shape in dtype, allocated the first time it is asked for
+        """
+        key = (slot, dtype)
+        if key not in self.workBuffers:
+            self.workBuffers[key] = torch.empty(
+                self.shape, dtype=dtype, device=self.targetDevice
+            )
+        return self.workBuffers[key]
+
+    def host(self, slot: int) -> torch.Tensor:
+        return self.hostBuffers[slot]
+
+    def device(self, slot: int) -> torch.Tensor:
+        return self.deviceBuffers[slot] if self.cuda else self.hostBuffers[slot]
+
+
+def recordReady(tensor: torch.Tensor, stream):
+    """
+    Marks the point on stream where tensor is done being written, instead of synchronizing the whole stream
+    """
+    if stream is not None and tensor.is_cuda:
+        event = torch.cuda.Event()
+        event.record(stream)
+        tensor.readyEvent = event
+
+
+def waitReady(tensor: torch.Tensor, stream):
+    """
+    Makes stream wait on the device until tensor is ready, the host does not block
+    """
+    event = getattr(tensor, "readyEvent", None)
+    if event is not None and stream is not None:
+        stream.wait_event(event)
+        # keeps the caching allocator from reusing the memory while stream still reads it
+        tensor.record_stream(stream)
+
+
+def normalizeFrame(frame: torch.Tensor, output: torch.Tensor):
+    """
+    Writes a uint8 hwc frame into a float nchw tensor (or a view of one) as 0-1, in place.
+    Two in place passes, ops with an out tensor of another dtype than their input allocate a converted copy of the input.
+    """
+    output.copy_(frame.permute(2, 0, 1).unsqueeze(0))
+    output.mul_(1 / 255)
+
+
+def denormalizeFrame(image: torch.Tensor, work: torch.Tensor, output: torch.Tensor):
+    """
+    Writes a 0-1 nchw frame into a uint8 hwc tensor, clamped and scaled in work (hwc, the dtype of image) first
+    """
+    torch.clamp(image[0].permute(1, 2, 0), 0.0, 1.0, out=work)
+    work.mul_(255)
+    # truncates like .byte()
+    output.copy_(work)
+
+
+def countAllocations(function, frames: int) -> tuple[float, float]:
+    """
+    Allocations (over 1kb, torch wraps python scalars in tiny tensors) and milliseconds per frame, after a warm up frame
+    """
+    import time
+    from torch.profiler import profile, ProfilerActivity
+
+    function()
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+    with profile(activities=activities, profile_memory=True) as profiler:
+        for _ in range(frames):
+            function()
+    allocations = sum(
+        1
+        for event in profiler.events()
+        if event.name != "[memory]"
+        and max(event.self_cpu_memory_usage, event.self_device_memory_usage) > 1024
+    )
+    start = time.perf_counter()
+    for _ in range(frames):
+        function()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    milliseconds = (time.perf_counter() - start) * 1000
+    return allocations / frames, milliseconds / frames
+
+
+def main():
+    """
+    Micro benchmark of converting frames to and from the model's format, the allocating conversions the backends used before against normalizeFrame/denormalizeFrame
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Compares per frame allocations of the frame conversions"
+    )
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--scale", type=int, default=2)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument(
+        "--dtype", type=str, default="float32", choices=["float32", "float16"]
+    )
+    parser.add_argument("--frames", type=int, default=20)
+    args = parser.parse_args()
+    device = torch.device(args.device)
+    dtype = getattr(torch, args.dtype)
+    outputShape = (args.height * args.scale, args.width * args.scale, 3)
+
+    inputTransfers = TransferRing(1, (args.height, args.width, 3), device)
+    outputTransfers = TransferRing(1, outputShape, device)
+    inputFrames = TensorRing(
+        1,
+        (1, 3, args.height, args.width),
+        dtype,
+        device,
+        memory_format=torch.channels_last,
+    )
+    upscaled = torch.rand(
+        (1, 3, outputShape[0], outputShape[1]), dtype=dtype, device=device
+    )
+    staged = inputTransfers.toDevice(0)
+
+    def allocatingInput():
+        return staged.to(dtype=dtype).permute(2, 0, 1).unsqueeze(0).mul_(1 / 255)
+
+    def allocatingOutput():
+        outputTransfers.host(0).copy_(
+            upscaled.clamp(0.0, 1.0)
+            .squeeze(0)
+            .permute(1, 2, 0)
+            .mul(255)
+            .float()
+            .byte(),
+            non_blocking=True,
+        )
+
+    def preallocatedInput():
+        normalizeFrame(staged, inputFrames.next())
+
+    def preallocatedOutput():
+        denormalizeFrame(
+            upscaled, outputTransfers.workBuffer(0, dtype), outputTransfers.device(0)
+        )
+        outputTransfers.toHost(0)
+
+    print(f"{args.width}x{args.height} {args.dtype} on {device}, {args.scale}x output")
+    for name, function in (
+        ("input, allocating", allocatingInput),
+        ("input, preallocated", preallocatedInput),
+        ("output, allocating", allocatingOutput),
+        ("output, preallocated", preallocatedOutput),
+    ):
+        allocations, milliseconds = countAllocations(function, args.frames)
+        print(
+            f"{name:<22}{allocations:>6.1f} allocations/frame {milliseconds:>8.2f}ms/frame"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import numpy as np
+import openvino as ov
+from threading import Lock
+from time import sleep
+
+from .UpscaleOpenVINO import compileModel
+from .Util import log
+
+
+class InterpolateRifeOpenVINO:
+    """
+    Interpolates with RIFE on openvino, the model takes img0, img1 and the timestep stacked into one 7 channel input, like the onnx exports.
+    Every timestep between two frames has its own infer request, they're all started with the first timestep so they run at once.
+
+    Args:
+        modelPath (str): RIFE .pkl model, or an .onnx model from ExportONNX at the padded size.
+        ceilInterpolateFactor (int, optional): Frames made for every input frame. Defaults to 2.
+        width (int, optional): Width of the input frames. Defaults to 1920.
+        height (int, optional): Height of the input frames. Defaults to 1080.
+        precision (str, optional): auto/float16/float32. Defaults to "auto".
+        threads (int, optional): Inference threads, 0 lets openvino decide. Defaults to 0.
+    """
+
+    def __init__(
+        self,
+        modelPath: str,
+        ceilInterpolateFactor: int = 2,
+        width: int = 1920,
+        height: int = 1080,
+        precision: str = "auto",
+        threads: int = 0,
+    ):
+        self.modelPath = modelPath
+        self.ceilInterpolateFactor = ceilInterpolateFactor
+        self.width = width
+        self.height = height
+        self.precision = precision
+        self.threads = threads
+        # the padded size comes from the model
+        self.pw = None
+        self.ph = None
+        self.timesteps = [
+            (n + 1) * 1.0 / ceilInterpolateFactor
+            for n in range(ceilInterpolateFactor - 1)
+        ]
+        self.lock = Lock()
+        self._load()
+        # the render keeps the first frame of a pair in frame0Buffer and converts every next frame into frame1Buffer,
+        # the padding is never written so it stays zero. kept across reloads, the render still holds them
+        self.frame0Buffer = np.zeros((1, 3, self.ph, self.pw), dtype=np.float32)
+        self.frame1Buffer = np.zeros((1, 3, self.ph, self.pw), dtype=np.float32)
+
+    def onnxModelPath(self) -> str:
+        """
+        openvino can't convert the grid sampler RIFE calls directly, so .pkl models go through the onnx export (cached after the first time)
+        """
+        if self.modelPath.endswith(".onnx"):
+            return self.modelPath
+        from .ExportONNX import ONNXExporter
+
+        return ONNXExporter(self.modelPath).export((self.width, self.height))
+
+    def _load(self):
+        model = ov.Core().read_model(self.onnxModelPath())
+        inputShape = model.inputs[0].get_partial_shape()
+        if inputShape.is_dynamic:
+            raise ValueError(
+                "RIFE models for openvino need a static input shape, export them with --shapes"
+            )
+        self.ph, self.pw = inputShape.to_shape()[2:]
+        self.compiledModel = compileModel(model, self.precision, self.threads)
+        # one request and input per timestep, the timestep channel never changes so it's filled once
+        self.requests = []
+        self.inputs = []
+        for timestep in self.timesteps:
+            inputBuffer = np.zeros((1, 7, self.ph, self.pw), dtype=np.float32)
+            inputBuffer[:, 6] = timestep
+            request = self.compiledModel.create_infer_request()
+            request.set_input_tensor(ov.Tensor(inputBuffer, shared_memory=True))
+            self.requests.append(request)
+            self.inputs.append(inputBuffer)
+        # new requests haven't been started on the current frames
+        self.started = False
+        # set last, process waits for it after a hotUnload
+        self.requestForTimestep = dict(zip(self.timesteps, self.requests))
+        log(
+            f"OpenVINO RIFE at {self.pw}x{self.ph}, {len(self.requests)} infer requests"
+        )
+
+    def normFrame(self, frame, output: np.ndarray = None) -> np.ndarray:
+        """
+        Converts into frame1Buffer, so the result is only valid until the next call
+        """
+        if output is None:
+            output = self.frame1Buffer
+        image = np.frombuffer(frame, dtype=np.uint8).reshape(self.height, self.width, 3)
+        np.multiply(
+            image.transpose(2, 0, 1),
+            np.float32(1 / 255),
+            out=output[0, :, : self.height, : self.width],
+        )
+        return output
+
+    def normFrame0(self, frame) -> np.ndarray:
+        """
+        normFrame for the first frame of a clip, which goes into frame0Buffer
+        """
+        return self.normFrame(frame, self.frame0Buffer)
+
+    def copyFrame(self, frameCopiedTo: np.ndarray, frameToCopy: np.ndarray):
+        np.copyto(frameCopiedTo, frameToCopy)
+
+    def startAll(self, img0: np.ndarray, img1: np.ndarray):
+        for request, inputBuffer in zip(self.requests, self.inputs):
+            inputBuffer[:, :3] = img0
+            inputBuffer[:, 3:6] = img1
+            request.start_async()
+        self.started = True
+
+    def process(self, img0, img1, timestep, f0encode=None, f1encode=None):
+        with self.lock:
+            # paused, hotReload brings the requests back
+            while self.requestForTimestep is None:
+                sleep(1)
+            # render asks for the timesteps in order, so the first one starts the rest.
+            # after a reload in between timesteps they're started again on the same frames
+            if timestep == self.timesteps[0] or not self.started:
+                self.startAll(img0, img1)
+            request = self.requestForTimestep[timestep]
+            request.wait()
+            return request.get_output_tensor().data.astype(np.uint8)
+
+    def uncacheFrame(self):
+        pass
+
+    def hotUnload(self):
+        """
+        Waits for the frame being interpolated and the requests running in the background before releasing them
+        """
+        with self.lock:
+            for request in self.requests:
+                request.wait()
+            self.requests = None
+            self.requestForTimestep = None
+            self.inputs = None
+            self.compiledModel = None
+
+    def hotReload(self):
+        self._load()
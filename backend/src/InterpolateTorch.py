@@ -2,6 +2,19 @@ import torch
 import torch.nn.functional as F
 
 from .InterpolateArchs.DetectInterpolateArch import ArchDetect
+from .FrameBuffers import TensorRing, TransferRing, recordReady, waitReady
+from .EngineCache import EngineCache
+from .TorchCompile import BackgroundCompile
+from .TorchDevice import (
+    resolveDevice,
+    resolvePrecision,
+    createStream,
+    streamContext,
+    synchronize,
+    autocastContext,
+    prepareModel,
+    emptyCache,
+)
 import math
 import os
 import logging
@@ -9,7 +22,6 @@ import gc
 from .Util import (
     printAndLog,
     errorAndLog,
-    check_bfloat16_support,
     log,
     warnAndLog,
 )
@@ -38,6 +50,7 @@ class InterpolateRifeTorch:
         trt_optimization_level (int, optional): Optimization level for TensorRT optimization. Defaults to 5.
         trt_cache_dir (str, optional): Directory to cache TensorRT engine files. Defaults to modelsDirectory().
         trt_debug (bool, optional): Flag to enable TensorRT debug mode. Defaults to False.
+        shapeBuckets (ShapeBuckets, optional): Pads frames up to a bucket size instead of the next multiple of 32, so engines and compiled models are shared between similar resolutions. Defaults to None.
 
     Methods:
         process(img0, img1, timestep):
@@ -93,6 +106,7 @@ class InterpolateRifeTorch:
         dtype: str = "auto",
         backend: str = "pytorch",
         UHDMode: bool = False,
+        shapeBuckets=None,
         # trt options
         trt_workspace_size: int = 0,
         trt_max_aux_streams: int | None = None,
@@ -101,16 +115,9 @@ class InterpolateRifeTorch:
         trt_debug: bool = False,
         rife_trt_mode: str = "accurate",
         trt_static_shape: bool = True,
+        pipelineDepth: int = 3,
     ):
-        if device == "default":
-            if torch.cuda.is_available():
-                device = torch.device(
-                    "cuda", 0
-                )  # 0 is the device index, may have to change later
-            else:
-                device = torch.device("cpu")
-        else:
-            device = torch.device(device)
+        device = resolveDevice(device)
 
         printAndLog("Using device: " + str(device))
 
@@ -119,7 +126,7 @@ class InterpolateRifeTorch:
         self.height = height
 
         self.device = device
-        self.dtype = self.handlePrecision(dtype)
+        self.dtype, self.autocastDtype = resolvePrecision(dtype, device)
         self.trt_workspace_size = trt_workspace_size
         self.trt_max_aux_streams = trt_max_aux_streams
         self.trt_optimization_level = trt_optimization_level
@@ -130,6 +137,7 @@ class InterpolateRifeTorch:
         self.trt_cache_dir = trt_cache_dir
         self.backend = backend
         self.ceilInterpolateFactor = ceilInterpolateFactor
+        self.shapeBuckets = shapeBuckets
         # set up streams for async processing
         self.scale = 1
         self.img0 = None
@@ -139,6 +147,8 @@ class InterpolateRifeTorch:
         self.trt_debug = trt_debug  # too much output, i would like a progress bar tho
         self.rife_trt_mode = rife_trt_mode
         self.trt_static_shape = trt_static_shape
+        # pinned staging buffers per direction
+        self.pipelineDepth = pipelineDepth
 
         if UHDMode:
             self.scale = 0.5
@@ -148,9 +158,20 @@ class InterpolateRifeTorch:
     def _load(self):
         IFNet = None
         GMFSS = None
-        self.stream = torch.cuda.Stream()
-        self.prepareStream = torch.cuda.Stream()
-        with torch.cuda.stream(self.prepareStream):
+        self.stream = createStream(self.device)
+        self.prepareStream = createStream(self.device)
+        self.outputStream = createStream(self.device)
+        self.inputTransfers = TransferRing(
+            count=self.pipelineDepth,
+            shape=(self.height * self.width * 3,),
+            device=self.device,
+        )
+        self.outputTransfers = TransferRing(
+            count=self.pipelineDepth,
+            shape=(self.height, self.width, 3),
+            device=self.device,
+        )
+        with streamContext(self.prepareStream):
             state_dict = torch.load(
                 self.interpolateModel,
                 map_location=self.device,
@@ -214,9 +235,26 @@ class InterpolateRifeTorch:
 
             # model unspecific setup
             tmp = max(_pad, int(_pad / self.scale))
-            self.pw = math.ceil(self.width / tmp) * tmp
-            self.ph = math.ceil(self.height / tmp) * tmp
-            self.padding = (0, self.pw - self.width, 0, self.ph - self.height)
+            # gmfss crops to the frame size itself, so it isn't bucketed
+            self.bucketed = self.shapeBuckets is not None and not self.gmfss
+            if self.bucketed:
+                self.pw, self.ph = self.shapeBuckets.bucket(
+                    self.width, self.height, tmp
+                )
+            else:
+                self.pw = math.ceil(self.width / tmp) * tmp
+                self.ph = math.ceil(self.height / tmp) * tmp
+            # normalized frames at the padded size, zero padding is only written here
+            self.inputFrames = TensorRing(
+                count=self.pipelineDepth,
+                shape=(1, 3, self.ph, self.pw),
+                dtype=self.dtype,
+                device=self.device,
+            )
+            # the first frame of every clip stays img0 for the whole clip and later frames are copied into it (copyTensor), so it gets a buffer outside of the ring
+            self.frame0Buffer = torch.zeros(
+                (1, 3, self.ph, self.pw), dtype=self.dtype, device=self.device
+            )
             # caching the timestep tensor in a dict with the timestep as a float for the key
             self.timestepDict = {}
             if GMFSS is not None:
@@ -239,6 +277,8 @@ class InterpolateRifeTorch:
                     warnAndLog(
                         "TensorRT is not implemented for GMFSS yet, falling back to PyTorch"
                     )
+                if self.backend == "pytorch-compile":
+                    log("torch.compile is not used for GMFSS")
 
             elif IFNet is not None:
                 for n in range(self.ceilInterpolateFactor):
@@ -252,13 +292,14 @@ class InterpolateRifeTorch:
                     self.timestepDict[timestep] = timestep_tens
                 # rife specific setup
                 self.set_rife_args()  # sets backwarp_tenGrid and tenFlow_div
+                # bucketed flownets keep the padding, tensor_to_frame crops it, so the graph doesn't depend on the frame size
                 self.flownet = IFNet(
                     scale=self.scale,
                     ensemble=False,
                     dtype=self.dtype,
                     device=self.device,
-                    width=self.width,
-                    height=self.height,
+                    width=self.pw if self.bucketed else self.width,
+                    height=self.ph if self.bucketed else self.height,
                 )
 
                 state_dict = {
@@ -276,6 +317,7 @@ class InterpolateRifeTorch:
                     self.encode.eval().to(device=self.device, dtype=self.dtype)
                 self.flownet.load_state_dict(state_dict=state_dict, strict=False)
                 self.flownet.eval().to(device=self.device, dtype=self.dtype)
+                self.flownet = prepareModel(self.flownet, self.device)
                 if self.backend == "tensorrt":
                     from .TensorRTHandler import TorchTensorRTHandler
 
@@ -287,7 +329,11 @@ class InterpolateRifeTorch:
                         os.path.realpath(self.trt_cache_dir),
                         (
                             f"{os.path.basename(self.interpolateModel)}"
-                            + f"_{self.width}x{self.height}"
+                            + (
+                                f"_{self.pw}x{self.ph}"
+                                if self.bucketed
+                                else f"_{self.width}x{self.height}"
+                            )
                             + f"_{'fp16' if self.dtype == torch.float16 else 'fp32'}"
                             + f"_scale-{self.scale}"
                             + f"_{torch.cuda.get_device_name(self.device)}"
@@ -312,6 +358,14 @@ class InterpolateRifeTorch:
                     )
                     trt_engine_path = base_trt_engine_path + ".dyn"
                     encode_trt_engine_path = base_trt_engine_path + "_encode.dyn"
+                    trtCacheKey = {
+                        "model": os.path.basename(self.interpolateModel),
+                        "shape": f"{self.pw}x{self.ph}",
+                        "precision": str(self.dtype).split(".")[-1],
+                        "device": torch.cuda.get_device_name(self.device),
+                        "tensorrt": trtHandler.tensorrt_version,
+                        "torch_tensorrt": trtHandler.torch_tensorrt_version,
+                    }
 
                     # lay out inputs
                     # load flow engine
@@ -403,6 +457,9 @@ class InterpolateRifeTorch:
                                 f"Loading TensorRT engine from {encode_trt_engine_path}"
                             )
                             self.encode = trtHandler.load_engine(encode_trt_engine_path)
+                            EngineCache().use(
+                                encode_trt_engine_path, "tensorrt", trtCacheKey
+                            )
 
                         # export flow engine
                         printAndLog(
@@ -418,7 +475,27 @@ class InterpolateRifeTorch:
 
                     printAndLog(f"Loading TensorRT engine from {trt_engine_path}")
                     self.flownet = trtHandler.load_engine(trt_engine_path)
-        self.prepareStream.synchronize()
+                    EngineCache().use(trt_engine_path, "tensorrt", trtCacheKey)
+                if self.backend == "pytorch-compile":
+                    self.compileModels()
+        synchronize(self.prepareStream)
+
+    def compileModels(self):
+        """
+        Wraps the flownet and the encoder, they run eagerly until they're compiled in the background
+        """
+        cacheName = f"{os.path.basename(self.interpolateModel)}_{self.pw}x{self.ph}_{str(self.dtype).split('.')[-1]}_{self.device.type}"
+        context = lambda: autocastContext(self.device, self.autocastDtype)
+        self.flownet = BackgroundCompile(
+            self.flownet, cacheName=cacheName, device=self.device, context=context
+        )
+        if not self.rife46:
+            self.encode = BackgroundCompile(
+                self.encode,
+                cacheName=cacheName + "_encode",
+                device=self.device,
+                context=context,
+            )
 
     @torch.inference_mode()
     def set_rife_args(self):
@@ -439,21 +516,16 @@ class InterpolateRifeTorch:
         ).to(dtype=torch.float32, device=self.device)
         self.backwarp_tenGrid = torch.cat([tenHorizontal, tenVertical], 1)
 
-    def handlePrecision(self, precision):
-        if precision == "auto":
-            return torch.float16 if check_bfloat16_support() else torch.float32
-        if precision == "float32":
-            return torch.float32
-        if precision == "float16":
-            return torch.float16
-        if precision == "bfloat16":
-            return torch.bfloat16
-
     @torch.inference_mode()
     def copyTensor(self, tensorToCopy: torch.Tensor, tensorCopiedTo: torch.Tensor):
-        with torch.cuda.stream(self.stream):
+        # queued behind the interpolations that still read tensorToCopy
+        with streamContext(self.stream):
+            waitReady(tensorCopiedTo, self.stream)
             tensorToCopy.copy_(tensorCopiedTo, non_blocking=True)
-        self.stream.synchronize()
+            # the last read of a frame from frame_to_tensor, its buffer can be reused after this
+            recordReady(tensorCopiedTo, self.stream)
+            # and frame0Buffer isn't rewritten by the next clip before this copy into it
+            recordReady(tensorToCopy, self.stream)
 
     def hotUnload(self):
         self.flownet = None
@@ -461,10 +533,11 @@ class InterpolateRifeTorch:
         self.tenFlow_div = None
         self.backwarp_tenGrid = None
         self.f0encode = None
-        gc.collect()
-        torch.cuda.empty_cache()
-        torch.cuda.reset_max_memory_allocated()
-        torch.cuda.reset_max_memory_cached()
+        self.inputTransfers = None
+        self.outputTransfers = None
+        self.inputFrames = None
+        self.frame0Buffer = None
+        emptyCache(self.device)
 
     @torch.inference_mode()
     def hotReload(self):
@@ -474,29 +547,37 @@ class InterpolateRifeTorch:
     def process(self, img0, img1, timestep, f0encode=None, f1encode=None):
         while self.flownet is None:
             sleep(1)
-        with torch.cuda.stream(self.stream):
+        with streamContext(self.stream):
+            for tensor in (img0, img1, f0encode, f1encode):
+                if tensor is not None:
+                    waitReady(tensor, self.stream)
             timestep = self.timestepDict[timestep]
-            if not self.gmfss:
-                if not self.rife46:
-                    output = self.flownet(
-                        img0,
-                        img1,
-                        timestep,
-                        self.tenFlow_div,
-                        self.backwarp_tenGrid,
-                        f0encode,
-                        f1encode,
-                    )
-                else:
-                    output = self.flownet(
-                        img0, img1, timestep, self.tenFlow_div, self.backwarp_tenGrid
-                    )
-            else:
-                # output = F.interpolate(self.flownet(img0, img1, timestep), (self.height, self.width), mode="bilinear")
-                output = self.flownet(img0, img1, timestep)
-        self.stream.synchronize()
+            with autocastContext(self.device, self.autocastDtype):
+                output = self.runFlownet(img0, img1, timestep, f0encode, f1encode)
+            recordReady(output, self.stream)
         return self.tensor_to_frame(output)
 
+    def runFlownet(self, img0, img1, timestep, f0encode, f1encode):
+        if not self.gmfss:
+            if not self.rife46:
+                output = self.flownet(
+                    img0,
+                    img1,
+                    timestep,
+                    self.tenFlow_div,
+                    self.backwarp_tenGrid,
+                    f0encode,
+                    f1encode,
+                )
+            else:
+                output = self.flownet(
+                    img0, img1, timestep, self.tenFlow_div, self.backwarp_tenGrid
+                )
+        else:
+            # output = F.interpolate(self.flownet(img0, img1, timestep), (self.height, self.width), mode="bilinear")
+            output = self.flownet(img0, img1, timestep)
+        return output
+
     @torch.inference_mode()
     def uncacheFrame(self):
         self.f0encode = None
@@ -504,36 +585,54 @@ class InterpolateRifeTorch:
 
     @torch.inference_mode()
     def tensor_to_frame(self, frame: torch.Tensor):
-        return frame.float().byte().contiguous().cpu().numpy()
+        slot = self.outputTransfers.acquire()
+        with streamContext(self.outputStream):
+            waitReady(frame, self.outputStream)
+            if self.bucketed:
+                frame = frame[: self.height, : self.width]
+            # converted to uint8 on the device, truncating like .byte()
+            self.outputTransfers.device(slot).copy_(frame)
+            self.outputTransfers.toHost(slot)
+            self.outputTransfers.record(slot, self.outputStream)
+        self.outputTransfers.wait(slot)
+        output = self.outputTransfers.host(slot).numpy().copy()
+        self.outputTransfers.release(slot)
+        return output
 
     @torch.inference_mode()
     def encode_Frame(self, frame: torch.Tensor):
         while self.encode is None:
             sleep(1)
-        with torch.cuda.stream(self.prepareStream):
-            frame = self.encode(frame)
-        self.prepareStream.synchronize()
+        with streamContext(self.prepareStream):
+            waitReady(frame, self.prepareStream)
+            with autocastContext(self.device, self.autocastDtype):
+                frame = self.encode(frame)
+            recordReady(frame, self.prepareStream)
         return frame
 
     @torch.inference_mode()
-    def norm(self, frame: torch.Tensor):
-        return (
-            frame.reshape(self.height, self.width, 3)
-            .permute(2, 0, 1)
-            .unsqueeze(0)
-            .div(255.0)
-        )
+    def frame0_to_tensor(self, frame) -> torch.Tensor:
+        """
+        frame_to_tensor for the first frame of a clip, which goes into frame0Buffer instead of the ring
+        """
+        return self.frame_to_tensor(frame, self.frame0Buffer)
 
     @torch.inference_mode()
-    def frame_to_tensor(self, frame) -> torch.Tensor:
-        with torch.cuda.stream(self.prepareStream):
-            frame = self.norm(
-                torch.frombuffer(
-                    frame,
-                    dtype=torch.uint8,
-                ).to(device=self.device, dtype=self.dtype, non_blocking=True)
-            )
-            frame = F.pad(frame, self.padding)
-
-        self.prepareStream.synchronize()
-        return frame
+    def frame_to_tensor(self, frame, output: torch.Tensor = None) -> torch.Tensor:
+        slot = self.inputTransfers.acquire()
+        self.inputTransfers.host(slot).copy_(torch.frombuffer(frame, dtype=torch.uint8))
+        if output is None:
+            output = self.inputFrames.next()
+        with streamContext(self.prepareStream):
+            # copyTensor marks when the last frame in this buffer was done being read
+            waitReady(output, self.prepareStream)
+            staged = self.inputTransfers.toDevice(slot)
+            frame = output[:, :, : self.height, : self.width]
+            # converted and scaled in place
+            frame.copy_(staged.view(self.height, self.width, 3).permute(2, 0, 1))
+            frame.div_(255.0)
+            if self.bucketed:
+                self.shapeBuckets.fillPaddingTensor(output, self.width, self.height)
+            self.inputTransfers.release(slot, self.prepareStream)
+            recordReady(output, self.prepareStream)
+        return output
@@ -0,0 +1,231 @@
+import queue
+import numpy as np
+from threading import Thread
+from typing import Iterator, Iterable
+
+from .RenderVideo import Render
+from .Util import printAndLog, log
+
+
+class RenderPipeline(Render):
+    """
+    In-process interface to the render pipeline, for embedding upscaling/interpolation in other python code.
+    Unlike Render, nothing is started on construction, and no ffmpeg process is used on the output side.
+
+    Args:
+        inputFile (str, optional): Video to decode frames from when process() is called without frames.
+        width (int, optional): Width of the input frames, required if inputFile is None.
+        height (int, optional): Height of the input frames, required if inputFile is None.
+        queueSize (int, optional): Max frames buffered between the feeder, render and output. Defaults to 50.
+        The rest of the options are the same as Render.
+
+    Usage:
+        with RenderPipeline(width=1920, height=1080, upscaleModel="2x_model.pth") as pipeline:
+            for frame in pipeline.process(frames):  # frames is any iterable of (height, width, 3) uint8 rgb arrays
+                ...
+    """
+
+    def __init__(
+        self,
+        inputFile: str = None,
+        width: int = None,
+        height: int = None,
+        # backend settings
+        backend="pytorch",
+        device="default",
+        precision="auto",
+        # model settings
+        upscaleModel=None,
+        interpolateModel=None,
+        interpolateFactor: int = 1,
+        tile_size=0,
+        tile_batch: int = 0,
+        upscale_batch: int = 1,
+        cpu_replicas=0,
+        devices: list = None,
+        overlap: int = 10,
+        skip_duplicates: bool = False,
+        duplicate_tolerance: float = 2.0,
+        tile_reuse: bool = False,
+        tile_reuse_threshold: float = 0.0,
+        quantize: str = "static",
+        calibration_frames: int = 8,
+        onnx_providers: str = "CPUExecutionProvider",
+        onnx_intra_threads: int = 0,
+        onnx_inter_threads: int = 0,
+        openvino_requests: int = 0,
+        openvino_threads: int = 0,
+        shape_buckets: bool = False,
+        bucket_max_waste: float = 0.25,
+        bucket_pad_mode: str = "replicate",
+        # misc
+        sceneDetectMethod: str = "none",
+        sceneDetectSensitivity: float = 3.0,
+        trt_optimization_level: int = 3,
+        rife_trt_mode: str = "accurate",
+        stageWorkers: dict = None,
+        queueSize: int = 50,
+    ):
+        self.inputFile = inputFile
+        self.pausedFile = None
+        self.queueSize = queueSize
+        self.started = False
+        self.stopRequested = False
+        self.readingDone = False
+        self.writingDone = False
+        self.processIO = False
+        self.setupRenderSettings(
+            backend=backend,
+            device=device,
+            precision=precision,
+            upscaleModel=upscaleModel,
+            interpolateModel=interpolateModel,
+            interpolateFactor=interpolateFactor,
+            tile_size=tile_size,
+            tile_batch=tile_batch,
+            upscale_batch=upscale_batch,
+            cpu_replicas=cpu_replicas,
+            devices=devices,
+            overlap=overlap,
+            skip_duplicates=skip_duplicates,
+            duplicate_tolerance=duplicate_tolerance,
+            tile_reuse=tile_reuse,
+            tile_reuse_threshold=tile_reuse_threshold,
+            quantize=quantize,
+            calibration_frames=calibration_frames,
+            onnx_providers=onnx_providers,
+            onnx_intra_threads=onnx_intra_threads,
+            onnx_inter_threads=onnx_inter_threads,
+            openvino_requests=openvino_requests,
+            openvino_threads=openvino_threads,
+            shape_buckets=shape_buckets,
+            bucket_max_waste=bucket_max_waste,
+            bucket_pad_mode=bucket_pad_mode,
+            sceneDetectMethod=sceneDetectMethod,
+            sceneDetectSensitivity=sceneDetectSensitivity,
+            trt_optimization_level=trt_optimization_level,
+            rife_trt_mode=rife_trt_mode,
+            stageWorkers=stageWorkers,
+        )
+        if inputFile is not None:
+            self.getVideoProperties(inputFile)
+        elif width is None or height is None:
+            raise ValueError("width and height are required when no inputFile is given")
+        else:
+            self.width = width
+            self.height = height
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        """
+        Loads the models, this is the slow part (and where TensorRT engines get built).
+        """
+        if self.started:
+            return
+        printAndLog("Using backend: " + self.backend)
+        if self.upscaleModel:
+            self.setupUpscale()
+            printAndLog("Using Upscaling Model: " + self.upscaleModel)
+        if self.interpolateModel:
+            self.setupInterpolate()
+            printAndLog("Using Interpolation Model: " + self.interpolateModel)
+        self.inputFrameChunkSize = self.width * self.height * 3
+        self.outputWidth = self.width * self.upscaleTimes
+        self.outputHeight = self.height * self.upscaleTimes
+        self.started = True
+
+    def close(self):
+        """
+        Unloads the models, start() has to be called again before the pipeline can be reused.
+        """
+        if not self.started:
+            return
+        self.started = False
+        if hasattr(self, "hotUnload"):
+            self.hotUnload()
+        log("Closed render pipeline")
+
+    def feedFrames(self, frames: Iterable[np.ndarray]):
+        try:
+            for frame in frames:
+                if self.stopRequested:
+                    break
+                if frame.shape != (self.height, self.width, 3):
+                    raise ValueError(
+                        f"Expected a frame of shape {(self.height, self.width, 3)}, got {frame.shape}"
+                    )
+                frame = np.ascontiguousarray(frame, dtype=np.uint8)
+                # ncnn only accepts actual bytes objects
+                self.readQueue.put(frame.tobytes() if self.ncnn else frame)
+        except Exception as e:
+            # raised again in process(), on the consumers thread
+            self.feedError = e
+        finally:
+            self.readQueue.put(None)
+            self.readingDone = True
+
+    def frameToArray(self, frame) -> np.ndarray:
+        if isinstance(frame, np.ndarray):
+            return frame.reshape(self.outputHeight, self.outputWidth, 3)
+        return np.frombuffer(frame, dtype=np.uint8).reshape(
+            self.outputHeight, self.outputWidth, 3
+        )
+
+    def process(self, frames: Iterable[np.ndarray] = None) -> Iterator[np.ndarray]:
+        """
+        Lazily yields rendered frames as (outputHeight, outputWidth, 3) uint8 rgb arrays.
+        If frames is None, the frames are decoded from inputFile.
+        Every call is treated as a separate clip, so interpolation does not blend across calls.
+        """
+        if not self.started:
+            raise RuntimeError(
+                "RenderPipeline.start() has to be called before process()"
+            )
+        if frames is None and self.inputFile is None:
+            raise ValueError("No frames given, and no inputFile to decode them from")
+
+        self.readQueue = queue.Queue(maxsize=self.queueSize)
+        self.writeQueue = queue.Queue(maxsize=self.queueSize)
+        self.setupFrame0 = None
+        self.stopRequested = False
+        self.readingDone = False
+        self.feedError = None
+        self.readError = None
+        self.renderError = None
+        if frames is None:
+            feederThread = Thread(target=self.readinVideoFrames)
+        else:
+            feederThread = Thread(target=self.feedFrames, args=(frames,))
+        renderThread = Thread(target=self.render)
+        feederThread.start()
+        renderThread.start()
+        try:
+            while True:
+                frame = self.writeQueue.get()
+                if frame is None:
+                    break
+                yield self.frameToArray(frame)
+        finally:
+            # consumer stopped early, unblock the feeder and render threads
+            self.stopRequested = True
+            if frames is None and hasattr(self, "readProcess"):
+                self.readProcess.terminate()
+            while renderThread.is_alive():
+                try:
+                    self.writeQueue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            feederThread.join()
+            renderThread.join()
+        if self.feedError is not None:
+            raise self.feedError
+        if self.readError is not None:
+            raise self.readError
+        if self.renderError is not None:
+            raise self.renderError
@@ -0,0 +1,183 @@
+import os
+import math
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from .EngineCache import EngineCache
+from .Util import log, printAndLog, warnAndLog
+
+# stored next to the quantized model in the cache, so the report doesn't need the float32 model
+PSNR_FILE = "psnr"
+
+
+def calibrationInputs(
+    frames: list[np.ndarray], width: int, height: int
+) -> list[torch.Tensor]:
+    """
+    Turns rgb frames into model inputs of width x height, cut from the middle of the frame, or padded if the frame is smaller
+    """
+    inputs = []
+    for frame in frames:
+        image = torch.from_numpy(np.ascontiguousarray(frame)).permute(2, 0, 1)
+        image = image.unsqueeze(0).float().mul_(1 / 255)
+        frameHeight, frameWidth = image.shape[-2:]
+        if frameWidth < width or frameHeight < height:
+            image = F.pad(
+                image,
+                (0, max(0, width - frameWidth), 0, max(0, height - frameHeight)),
+                "replicate",
+            )
+            frameHeight, frameWidth = image.shape[-2:]
+        y = (frameHeight - height) // 2
+        x = (frameWidth - width) // 2
+        inputs.append(
+            image[:, :, y : y + height, x : x + width].contiguous(
+                memory_format=torch.channels_last
+            )
+        )
+    return inputs
+
+
+def psnr(reference: torch.Tensor, image: torch.Tensor) -> float:
+    mse = torch.mean((reference.clamp(0, 1) - image.clamp(0, 1)) ** 2).item()
+    if mse == 0:
+        return math.inf
+    return 10 * math.log10(1 / mse)
+
+
+def quantizeStatic(
+    model: torch.nn.Module, inputs: list[torch.Tensor]
+) -> torch.nn.Module:
+    """
+    Post training static quantization with fx, the activation ranges come from running the inputs through the model.
+    Quantizes convolutions too, which is what most upscale archs are made of.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    prepared = prepare_fx(model, get_default_qconfig_mapping("x86"), (inputs[0],))
+    for image in inputs:
+        prepared(image)
+    return convert_fx(prepared)
+
+
+def quantizeDynamic(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    Dynamic quantization, weights are int8 and activations are quantized on the fly.
+    Only linear layers are supported, so it only helps transformer archs.
+    """
+    if not any(isinstance(module, torch.nn.Linear) for module in model.modules()):
+        warnAndLog(
+            "The model has no layers dynamic quantization supports, use static quantization instead"
+        )
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def quantizedModelPath(
+    modelPath: str, cacheDir: str, mode: str, width: int, height: int
+) -> str:
+    return os.path.join(
+        os.path.realpath(cacheDir),
+        f"{os.path.basename(modelPath)}"
+        + f"_int8-{mode}"
+        + f"_{width}x{height}"
+        + f"_torch-{torch.__version__}"
+        + ".pt",
+    )
+
+
+def recordUse(cachePath: str, modelPath: str, mode: str, width: int, height: int):
+    EngineCache().use(
+        cachePath,
+        "int8",
+        {
+            "model": os.path.basename(modelPath),
+            "shape": f"{width}x{height}",
+            "precision": f"int8-{mode}",
+            "torch": torch.__version__,
+        },
+    )
+
+
+@torch.inference_mode()
+def loadQuantizedModel(
+    model: torch.nn.Module,
+    modelPath: str,
+    width: int,
+    height: int,
+    mode: str = "static",
+    calibrationFrames: list[np.ndarray] = None,
+    cacheDir: str = None,
+) -> torch.nn.Module:
+    """
+    Returns an int8 version of a float32 cpu model, for inputs of width x height.
+    The quantized model is traced and cached next to the model, later runs load it from there, even for other videos.
+    Static quantization is calibrated on calibrationFrames (frames from the input), without them it falls back to dynamic.
+    Archs fx can't trace fall back to dynamic as well.
+    Prints the PSNR of the int8 output against the float32 output.
+    """
+    if cacheDir is None:
+        cacheDir = os.path.dirname(modelPath)
+    # a cached static model doesn't need frames, so look for it before falling back.
+    # a cached dynamic model only stands in for static when there are no frames to calibrate with, it barely quantizes conv models
+    modes = (
+        ["static", "dynamic"] if mode == "static" and not calibrationFrames else [mode]
+    )
+    for cachedMode in modes:
+        cachePath = quantizedModelPath(modelPath, cacheDir, cachedMode, width, height)
+        if os.path.isfile(cachePath):
+            extraFiles = {PSNR_FILE: ""}
+            quantized = torch.jit.load(
+                cachePath, map_location="cpu", _extra_files=extraFiles
+            )
+            printAndLog(
+                f"Loaded int8 model from {cachePath}, PSNR against float32: {extraFiles[PSNR_FILE].decode()}dB"
+            )
+            recordUse(cachePath, modelPath, cachedMode, width, height)
+            return quantized
+    if mode == "static" and not calibrationFrames:
+        warnAndLog("No frames to calibrate with, using dynamic quantization")
+        mode = "dynamic"
+    cachePath = quantizedModelPath(modelPath, cacheDir, mode, width, height)
+
+    if calibrationFrames:
+        inputs = calibrationInputs(calibrationFrames, width, height)
+    else:
+        inputs = [
+            torch.rand(1, 3, height, width).contiguous(
+                memory_format=torch.channels_last
+            )
+        ]
+    # the last frame is kept out of the calibration to measure the quality with
+    calibration = inputs[:-1] if len(inputs) > 1 else inputs
+    testInput = inputs[-1]
+
+    quantized = None
+    if mode == "static":
+        try:
+            quantized = quantizeStatic(model, calibration)
+        except Exception as e:
+            warnAndLog(
+                f"Static quantization is not supported for this arch, using dynamic: {e}"
+            )
+            mode = "dynamic"
+            cachePath = quantizedModelPath(modelPath, cacheDir, mode, width, height)
+    if quantized is None:
+        quantized = quantizeDynamic(model)
+
+    quantized = torch.jit.freeze(torch.jit.trace(quantized, testInput).eval())
+    quality = psnr(model(testInput), quantized(testInput))
+    printAndLog(
+        f"Quantized the model to int8 ({mode}), PSNR against float32: {quality:.2f}dB"
+    )
+    try:
+        torch.jit.save(quantized, cachePath, _extra_files={PSNR_FILE: f"{quality:.2f}"})
+        log(f"Saved int8 model to {cachePath}")
+        recordUse(cachePath, modelPath, mode, width, height)
+    except (OSError, RuntimeError) as e:
+        log(f"Unable to cache the int8 model: {e}")
+    return quantized
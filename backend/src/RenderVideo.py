@@ -3,9 +3,16 @@ import os
 import math
 from time import sleep
 
-from .FFmpeg import FFMpegRender
+from .FFmpeg import FFMpegRender, parseResolution
 from .SceneDetect import SceneDetect
-from .Util import printAndLog, log, removeFile
+from .StageGraph import Stage, StageGraph
+from .ThreadBudget import setupThreadBudget, ThreadBudget
+from .ReplicaPool import ReplicaPool, probeReplicaCount, cpuSetsFor
+from .DeviceScheduler import DeviceScheduler, DeviceExecutor
+from .DuplicateDetect import DuplicateDetector
+from .CropDetect import detectCrop, parseCrop, outputCrop
+from .ShapeBuckets import ShapeBuckets
+from .Util import printAndLog, log, removeFile, sampleVideoFrames
 
 # try/except imports
 try:
@@ -20,9 +27,31 @@ try:
 except ImportError:
     log("WARN: unable to import pytorch.")
 try:
-    from .UpscaleONNX import UpscaleONNX
+    from .UpscaleONNX import UpscaleONNX, parseProviders
 except ImportError:
-    log("WARN: unable to import directml.")
+    log("WARN: unable to import onnxruntime.")
+try:
+    from .UpscaleOpenVINO import UpscaleOpenVINO
+    from .InterpolateOpenVINO import InterpolateRifeOpenVINO
+except ImportError:
+    log("WARN: unable to import openvino.")
+
+# backends that go through UpscalePytorch and InterpolateRifeTorch
+TORCH_BACKENDS = ("pytorch", "pytorch-compile", "tensorrt")
+
+
+class RenderFrame:
+    """
+    A frame moving through the render stages
+    """
+
+    __slots__ = ("frame", "transition", "duplicate")
+
+    def __init__(self, frame, transition: bool = False):
+        self.frame = frame
+        self.transition = transition
+        # the upscaled output of the previous frame can be reused
+        self.duplicate = False
 
 
 class Render(FFMpegRender):
@@ -63,6 +92,25 @@ class Render(FFMpegRender):
         interpolateModel=None,
         interpolateFactor: int = 1,
         tile_size=None,
+        tile_batch: int = 0,
+        upscale_batch: int = 1,
+        cpu_replicas=0,
+        devices: list = None,
+        overlap: int = 10,
+        skip_duplicates: bool = False,
+        duplicate_tolerance: float = 2.0,
+        tile_reuse: bool = False,
+        tile_reuse_threshold: float = 0.0,
+        quantize: str = "static",
+        calibration_frames: int = 8,
+        onnx_providers: str = "CPUExecutionProvider",
+        onnx_intra_threads: int = 0,
+        onnx_inter_threads: int = 0,
+        openvino_requests: int = 0,
+        openvino_threads: int = 0,
+        shape_buckets: bool = False,
+        bucket_max_waste: float = 0.25,
+        bucket_pad_mode: str = "replicate",
         # ffmpeg settings
         encoder: str = "libx264",
         pixelFormat: str = "yuv420p",
@@ -77,6 +125,13 @@ class Render(FFMpegRender):
         trt_optimization_level: int = 3,
         rife_trt_mode: str = "accurate",
         upscale_output_resolution: str = None,
+        crop: str = "none",
+        crop_output: bool = False,
+        stageWorkers: dict = None,
+        stageQueueSize: int = 8,
+        processIO: bool = False,
+        threads: int = 0,
+        pinThreads: bool = False,
     ):
         if pausedFile is None:
             pausedFile = os.path.basename(inputFile) + "_paused_state.txt"
@@ -84,31 +139,75 @@ class Render(FFMpegRender):
         self.pausedFile = pausedFile
         with open(self.pausedFile, "w") as f:
             f.write("False")
-        self.backend = backend
-        self.upscaleModel = upscaleModel
-        self.interpolateModel = interpolateModel
-        self.tilesize = tile_size
-        self.device = device
-        self.precision = precision
-        self.upscaleTimes = 1  # if no upscaling, it will default to 1
-        self.interpolateFactor = interpolateFactor
-        # max timestep is a hack to make sure ncnn cache frames too early, and ncnn breaks if i modify the code at all so ig this is what we are doing
-        self.maxTimestep = (interpolateFactor - 1) / interpolateFactor
-        self.ncnn = self.backend == "ncnn"
-        self.ceilInterpolateFactor = math.ceil(self.interpolateFactor)
-        self.setupRender = self.returnFrame  # set it to not convert the bytes to array by default, and just pass chunk through
-        self.setupFrame0 = None
-        self.doEncodingOnFrame = False
-        self.isPaused = False
-        self.sceneDetectMethod = sceneDetectMethod
-        self.sceneDetectSensitivty = sceneDetectSensitivity
+        self.setupRenderSettings(
+            backend=backend,
+            device=device,
+            precision=precision,
+            upscaleModel=upscaleModel,
+            interpolateModel=interpolateModel,
+            interpolateFactor=interpolateFactor,
+            tile_size=tile_size,
+            tile_batch=tile_batch,
+            upscale_batch=upscale_batch,
+            cpu_replicas=cpu_replicas,
+            devices=devices,
+            overlap=overlap,
+            skip_duplicates=skip_duplicates,
+            duplicate_tolerance=duplicate_tolerance,
+            tile_reuse=tile_reuse,
+            tile_reuse_threshold=tile_reuse_threshold,
+            quantize=quantize,
+            calibration_frames=calibration_frames,
+            onnx_providers=onnx_providers,
+            onnx_intra_threads=onnx_intra_threads,
+            onnx_inter_threads=onnx_inter_threads,
+            openvino_requests=openvino_requests,
+            openvino_threads=openvino_threads,
+            shape_buckets=shape_buckets,
+            bucket_max_waste=bucket_max_waste,
+            bucket_pad_mode=bucket_pad_mode,
+            sceneDetectMethod=sceneDetectMethod,
+            sceneDetectSensitivity=sceneDetectSensitivity,
+            trt_optimization_level=trt_optimization_level,
+            rife_trt_mode=rife_trt_mode,
+            stageWorkers=stageWorkers,
+            stageQueueSize=stageQueueSize,
+        )
         self.sharedMemoryID = sharedMemoryID
-        self.trt_optimization_level = trt_optimization_level
-        self.rife_trt_mode = rife_trt_mode
-        self.uncacheNextFrame = False
+        self.pinThreads = pinThreads
         # get video properties early
         self.getVideoProperties(inputFile)
+        # everything after this, the models included, only sees the area inside the black bars
+        self.crop = None
+        if crop == "auto":
+            self.crop = detectCrop(inputFile, self.width, self.height)
+        elif crop != "none":
+            self.crop = parseCrop(crop, self.width, self.height)
+        if self.crop is not None:
+            self.width, self.height = self.crop[2], self.crop[3]
+        # has to happen before the models are loaded, torch threads are fixed once used
+        self.threadBudget = setupThreadBudget(
+            totalThreads=threads,
+            cpuInference=self.usesCPUInference(),
+            sceneDetect=bool(interpolateModel) and sceneDetectMethod != "none",
+            benchmark=benchmark,
+            pinThreads=pinThreads,
+        )
 
+        # the pytorch backends resize on the device, the others leave it to ffmpeg
+        self.outputResolution = (None, None)
+        if upscale_output_resolution:
+            fullWidth, fullHeight = parseResolution(upscale_output_resolution)
+            self.outputResolution = (fullWidth, fullHeight)
+            if self.crop is not None:
+                self.outputResolution = outputCrop(
+                    self.crop,
+                    self.sourceWidth,
+                    self.sourceHeight,
+                    fullWidth,
+                    fullHeight,
+                )[2:]
+        self.resizedInBackend = False
         printAndLog("Using backend: " + self.backend)
         if upscaleModel:
             self.setupUpscale()
@@ -118,7 +217,7 @@ class Render(FFMpegRender):
             self.setupInterpolate()
 
             printAndLog("Using Interpolation Model: " + self.interpolateModel)
-        self.renderThread = Thread(target=self.render)
+        self.renderThread = Thread(target=self.renderAndRelease)
         super().__init__(
             inputFile=inputFile,
             outputFile=outputFile,
@@ -132,6 +231,12 @@ class Render(FFMpegRender):
             sharedMemoryID=sharedMemoryID,
             channels=3,
             upscale_output_resolution=upscale_output_resolution,
+            resizedInBackend=self.resizedInBackend,
+            crop=self.crop,
+            cropOutput=crop_output,
+            processIO=processIO,
+            decodeThreads=self.threadBudget.decodeThreads,
+            encodeThreads=self.threadBudget.encodeThreads,
         )
 
         self.sharedMemoryThread.start()
@@ -144,6 +249,190 @@ class Render(FFMpegRender):
         self.renderThread.start()
         self.readPausedFileThread1.start()
 
+    def setupRenderSettings(
+        self,
+        backend="pytorch",
+        device="default",
+        precision="float16",
+        upscaleModel=None,
+        interpolateModel=None,
+        interpolateFactor: int = 1,
+        tile_size=None,
+        tile_batch: int = 0,
+        upscale_batch: int = 1,
+        cpu_replicas=0,
+        devices: list = None,
+        overlap: int = 10,
+        skip_duplicates: bool = False,
+        duplicate_tolerance: float = 2.0,
+        tile_reuse: bool = False,
+        tile_reuse_threshold: float = 0.0,
+        quantize: str = "static",
+        calibration_frames: int = 8,
+        onnx_providers: str = "CPUExecutionProvider",
+        onnx_intra_threads: int = 0,
+        onnx_inter_threads: int = 0,
+        openvino_requests: int = 0,
+        openvino_threads: int = 0,
+        shape_buckets: bool = False,
+        bucket_max_waste: float = 0.25,
+        bucket_pad_mode: str = "replicate",
+        sceneDetectMethod: str = "pyscenedetect",
+        sceneDetectSensitivity: float = 3.0,
+        trt_optimization_level: int = 3,
+        rife_trt_mode: str = "accurate",
+        stageWorkers: dict = None,
+        stageQueueSize: int = 8,
+    ):
+        """
+        Sets the model and render state shared by every way of driving a render (CLI or in-process pipeline)
+        """
+        self.backend = backend
+        self.upscaleModel = upscaleModel
+        self.interpolateModel = interpolateModel
+        # "auto" is probed by UpscalePytorch
+        self.tilesize = tile_size if tile_size in (None, "auto") else int(tile_size)
+        self.tileBatch = tile_batch
+        self.upscaleBatch = max(1, upscale_batch)
+        # 0 disables the cpu replica pool, "auto" probes for the best count
+        self.cpuReplicas = cpu_replicas if cpu_replicas == "auto" else int(cpu_replicas)
+        self.replicaPool = None
+        # backends that run several frames at once raise this
+        self.upscaleWorkers = 1
+        # more than one device spreads the upscale over all of them
+        self.devices = devices if devices is not None else []
+        self.deviceScheduler = None
+        self.threadBudget = None
+        self.pinThreads = False
+        self.overlap = overlap
+        # Render sets these from the ffmpeg options, RenderPipeline keeps the defaults
+        self.outputResolution = (None, None)
+        self.resizedInBackend = False
+        self.crop = None
+        self.skipDuplicates = skip_duplicates
+        self.duplicateTolerance = duplicate_tolerance
+        self.duplicateDetector = None
+        self.tileReuse = tile_reuse
+        self.tileReuseThreshold = tile_reuse_threshold
+        self.tileReuseReport = None
+        self.quantize = quantize
+        self.calibrationFrames = calibration_frames
+        self.onnxProviders = onnx_providers
+        self.onnxIntraThreads = onnx_intra_threads
+        self.onnxInterThreads = onnx_inter_threads
+        self.openvinoRequests = openvino_requests
+        self.openvinoThreads = openvino_threads
+        self.shapeBuckets = (
+            ShapeBuckets(maxWaste=bucket_max_waste, padMode=bucket_pad_mode)
+            if shape_buckets
+            else None
+        )
+        self.device = device
+        if len(self.devices) == 1:
+            self.device = self.devices[0]
+        self.precision = precision
+        self.upscaleTimes = 1  # if no upscaling, it will default to 1
+        self.interpolateFactor = interpolateFactor
+        # max timestep is a hack to make sure ncnn cache frames too early, and ncnn breaks if i modify the code at all so ig this is what we are doing
+        self.maxTimestep = (interpolateFactor - 1) / interpolateFactor
+        self.ncnn = self.backend == "ncnn"
+        self.ceilInterpolateFactor = math.ceil(self.interpolateFactor)
+        self.setupRender = self.returnFrame  # set it to not convert the bytes to array by default, and just pass chunk through
+        self.setupFrame0 = None
+        self.renderError = None
+        # backends that keep the first frame in its own buffer set this, otherwise frameSetupFunction is used
+        self.frame0SetupFunction = None
+        self.doEncodingOnFrame = False
+        self.isPaused = False
+        self.sceneDetectMethod = sceneDetectMethod
+        self.sceneDetectSensitivty = sceneDetectSensitivity
+        self.trt_optimization_level = trt_optimization_level
+        self.rife_trt_mode = rife_trt_mode
+        self.uncacheNextFrame = False
+        # worker count per render stage, see stageWorkerCount for the stages not in here
+        self.stageWorkers = stageWorkers if stageWorkers is not None else {}
+        self.stageQueueSize = stageQueueSize
+        self.upscaleSetupFunction = self.returnFrame
+        self.denormalize = None
+
+    def framesInFlight(self) -> int:
+        """
+        Max number of upscaled frames alive at once, from the upscale stage until the denormalize stage is done with them.
+        Also covers the normalized frames, from the normalize stage until they are upscaled.
+        """
+        return (
+            self.stageQueueSize
+            + self.stageWorkerCount("normalize")
+            + self.stageWorkerCount("upscale") * self.upscaleBatch
+            + self.stageWorkerCount("denormalize")
+            + 1
+        )
+
+    def stageWorkerCount(self, name: str, default: int = 1) -> int:
+        """
+        Workers of a render stage, from --stage_workers if it is set there.
+        Otherwise normalize and denormalize (stateless, and mostly waiting on copies) share the worker threads left in the thread budget.
+        """
+        if name in self.stageWorkers:
+            return self.stageWorkers[name]
+        if (
+            name in ("normalize", "denormalize")
+            and self.threadBudget is not None
+            and not self.replicasUseWorkerThreads()
+        ):
+            # every worker adds a preallocated frame in flight, and these stages are light
+            return max(1, min(2, self.threadBudget.workerThreads // 2))
+        return default
+
+    def replicasUseWorkerThreads(self) -> bool:
+        """
+        cpu replicas next to a gpu get the worker threads, torch in this process only launches gpu kernels
+        """
+        return (
+            bool(self.cpuReplicas) and "cpu" in self.devices and len(self.devices) > 1
+        )
+
+    def usesCPUInference(self) -> bool:
+        if self.backend == "openvino":
+            return True
+        if self.backend == "onnx":
+            return self.onnxRunsOnCPU()
+        if self.backend not in TORCH_BACKENDS or self.backend == "tensorrt":
+            return False
+        if self.device != "default":
+            return str(self.device).startswith("cpu")
+        try:
+            import torch
+
+            return not torch.cuda.is_available()
+        except ImportError:
+            return False
+
+    def onnxRunsOnCPU(self) -> bool:
+        """
+        onnxruntime runs on the first provider in the list that it was built with
+        """
+        try:
+            import onnxruntime
+
+            available = onnxruntime.get_available_providers()
+        except ImportError:
+            return False
+        providers = [
+            provider.strip()
+            for provider in self.onnxProviders.split(",")
+            if provider.strip() in available
+        ]
+        return not providers or providers[0] == "CPUExecutionProvider"
+
+    def inferenceThreads(self, threads: int) -> int:
+        """
+        threads if it was set, otherwise the torch share of the thread budget when the models run on the cpu, 0 leaves it to the backend
+        """
+        if threads or self.threadBudget is None or not self.threadBudget.cpuInference:
+            return threads
+        return self.threadBudget.torchThreads
+
     def readPausedFileThread(self):
         activate = True
         self.prevState = False
@@ -163,7 +452,7 @@ class Render(FFMpegRender):
             sleep(1)
 
     def i0Norm(self, frame):
-        self.setupFrame0 = self.frameSetupFunction(frame)
+        self.setupFrame0 = (self.frame0SetupFunction or self.frameSetupFunction)(frame)
         if self.doEncodingOnFrame:
             self.encodedFrame0 = self.encodeFrame(self.setupFrame0)
 
@@ -180,11 +469,15 @@ class Render(FFMpegRender):
             if self.doEncodingOnFrame:
                 self.copyFrame(self.encodedFrame0, self.encodedFrame1)
 
-    def renderInterpolate(self, frame, transition=False):
+    def renderInterpolate(self, frame, transition=False) -> list:
+        """
+        Returns the frames that go between the previous frame and this one
+        """
+        interpolatedFrames = []
         if frame is not None:
             if self.setupFrame0 is None:
                 self.i0Norm(frame)
-                return
+                return interpolatedFrames
             self.i1Norm(frame)
 
             for n in range(self.ceilInterpolateFactor - 1):
@@ -211,30 +504,349 @@ class Render(FFMpegRender):
                         timestep=self.maxTimestep,
                     )
 
-                self.writeQueue.put(frame)
+                interpolatedFrames.append(frame)
 
             self.onEndOfInterpolateCall()
+        return interpolatedFrames
 
-    def render(self):
-        while True:
-            if not self.isPaused:
-                frame = self.readQueue.get()
-                if frame is None:
-                    break
-                if self.upscaleModel:
-                    frame = self.upscale(self.frameSetupFunction(frame))
-
-                if self.interpolateModel:
-                    if self.sceneDetectMethod.lower() != "none":
-                        self.renderInterpolate(frame, self.scDetectFunc(frame))
-                    else:
-                        self.renderInterpolate(frame, False)
+    def sceneDetectStage(self, item: RenderFrame) -> list:
+        item.transition = self.scDetectFunc(item.frame)
+        return [item]
+
+    def duplicateStage(self, item: RenderFrame) -> list:
+        item.duplicate = self.duplicateDetector.isDuplicate(item.frame)
+        return [item]
+
+    def normalizeStage(self, item: RenderFrame) -> list:
+        if not item.duplicate:
+            item.frame = self.upscaleSetupFunction(item.frame)
+        return [item]
+
+    def upscaleStage(self, item: RenderFrame) -> list:
+        if not item.duplicate:
+            item.frame = self.upscaleTensor(item.frame)
+        return [item]
+
+    def upscaleBatchStage(self, items: list[RenderFrame]) -> list:
+        toUpscale = [item for item in items if not item.duplicate]
+        if toUpscale:
+            frames = self.upscaleTensorBatch([item.frame for item in toUpscale])
+            for item, frame in zip(toUpscale, frames):
+                item.frame = frame
+        return [[item] for item in items]
+
+    def denormalizeStage(self, item: RenderFrame) -> list:
+        if not item.duplicate:
+            item.frame = self.denormalize(item.frame)
+        return [item]
 
-                self.writeQueue.put(frame)
+    def reuseStage(self, item: RenderFrame) -> list:
+        if item.duplicate:
+            item.frame = self.lastUpscaledFrame
+        else:
+            self.lastUpscaledFrame = item.frame
+        return [item]
+
+    def interpolateStage(self, item: RenderFrame) -> list:
+        outputs = [
+            RenderFrame(frame)
+            for frame in self.renderInterpolate(item.frame, item.transition)
+        ]
+        outputs.append(item)
+        return outputs
+
+    def buildRenderStages(self) -> list[Stage]:
+        """
+        Lays out the render as decode -> duplicates -> scenedetect -> normalize -> upscale -> denormalize -> reuse -> interpolate -> encode.
+        Decode and encode are the ffmpeg threads, the rest are only added if they have something to do.
+        """
+        stages = []
+        useDuplicates = self.skipDuplicates and bool(self.upscaleModel)
+
+        def addStage(name, function, stateful=False, batchSize=1, workers=1):
+            stages.append(
+                Stage(
+                    name=name,
+                    function=function,
+                    workers=self.stageWorkerCount(name, workers),
+                    stateful=stateful,
+                    batchSize=batchSize,
+                )
+            )
+
+        if useDuplicates:
+            # a new detector every render, so the first frame is never compared to the last one of a previous run
+            self.duplicateDetector = DuplicateDetector(
+                self.width, self.height, tolerance=self.duplicateTolerance
+            )
+            addStage("duplicates", self.duplicateStage, stateful=True)
+        # scene detect looks at the decoded frame, so it can run while earlier frames are still being upscaled
+        if self.interpolateModel and self.sceneDetectMethod.lower() != "none":
+            addStage("scenedetect", self.sceneDetectStage, stateful=True)
+        if self.upscaleModel:
+            if self.upscaleSetupFunction is not self.returnFrame:
+                addStage("normalize", self.normalizeStage)
+            if self.deviceScheduler is not None:
+                # every worker waits on one frame, 2 per frame a device works on keeps them all busy
+                addStage(
+                    "upscale",
+                    self.upscaleStage,
+                    workers=2
+                    * sum(e.concurrency for e in self.deviceScheduler.executors),
+                )
+            elif self.replicaPool is not None:
+                # every worker waits on one frame, 2 per replica keeps them all busy
+                addStage(
+                    "upscale", self.upscaleStage, workers=2 * self.replicaPool.replicas
+                )
+            elif self.upscaleBatch > 1:
+                addStage("upscale", self.upscaleBatchStage, batchSize=self.upscaleBatch)
             else:
-                sleep(1)
-        self.writeQueue.put(None)
-        removeFile(self.pausedFile)
+                # reused tiles are compared to the previous frame, so they have to come in order
+                addStage(
+                    "upscale",
+                    self.upscaleStage,
+                    stateful=self.tileReuse,
+                    workers=self.upscaleWorkers,
+                )
+            if self.denormalize is not None:
+                addStage("denormalize", self.denormalizeStage)
+            if useDuplicates:
+                addStage("reuse", self.reuseStage, stateful=True)
+        if self.interpolateModel:
+            addStage("interpolate", self.interpolateStage, stateful=True)
+        return stages
+
+    def render(self):
+        """
+        Runs the frames through the stage graph, an error that stops it is kept in renderError for whoever waits on the render
+        """
+        graph = None
+        try:
+            graph = StageGraph(
+                stages=self.buildRenderStages(),
+                inputQueue=self.readQueue,
+                outputQueue=self.writeQueue,
+                queueSize=self.stageQueueSize,
+                isPaused=lambda: self.isPaused,
+                inputFunction=RenderFrame,
+                outputFunction=lambda item: item.frame,
+            )
+            graph.run()
+        except Exception as e:
+            log(f"ERROR: render failed: {e}")
+            self.renderError = e
+        finally:
+            if graph is not None:
+                log(graph.timingReport())
+            if self.duplicateDetector is not None:
+                printAndLog(self.duplicateDetector.report())
+            if self.tileReuseReport is not None:
+                printAndLog(self.tileReuseReport())
+            self.writeQueue.put(None)
+            if self.pausedFile is not None:
+                removeFile(self.pausedFile)
+
+    def waitForRender(self):
+        """
+        Blocks until the output is written, and raises the error that stopped the decoder, the render or the encoder, the frames before it are still written out
+        """
+        self.ffmpegReadThread.join()
+        self.renderThread.join()
+        self.ffmpegWriteThread.join()
+        if self.readError is not None:
+            raise self.readError
+        if self.renderError is not None:
+            raise self.renderError
+        if self.writeError is not None:
+            raise self.writeError
+
+    def renderAndRelease(self):
+        """
+        Renders the whole video, then shuts down anything that outlives the models (cpu replica processes, device threads)
+        """
+        try:
+            self.render()
+        finally:
+            if self.deviceScheduler is not None:
+                self.deviceScheduler.close()
+                self.deviceScheduler.unload()
+            if self.replicaPool is not None:
+                self.replicaPool.stop()
+
+    def calibrationSamples(self) -> list | None:
+        """
+        A few frames from the input for int8 calibration, cropped like the frames that will be rendered
+        """
+        if self.precision != "int8" or not self.inputFile or self.calibrationFrames < 1:
+            return None
+        frames = list(sampleVideoFrames(self.inputFile, self.calibrationFrames))
+        if self.crop is not None:
+            x, y, width, height = self.crop
+            frames = [frame[y : y + height, x : x + width] for frame in frames]
+        return frames
+
+    def createReplicaPool(self) -> ReplicaPool:
+        """
+        Starts several cpu model replicas in their own processes, each with a share of the torch threads
+        """
+        from .spandrel import ModelLoader
+
+        self.upscaleTimes = ModelLoader().load_from_file(self.upscaleModel).scale
+        budget = (
+            self.threadBudget
+            if self.threadBudget is not None
+            else ThreadBudget(cpuInference=True)
+        )
+        # next to a gpu the torch share only launches kernels, the replicas get the worker threads instead
+        totalThreads = (
+            budget.workerThreads
+            if self.replicasUseWorkerThreads() and not budget.cpuInference
+            else budget.torchThreads
+        )
+        cpus = budget.orderedCPUs() if self.pinThreads else None
+        if self.tilesize == "auto":
+            # probed once here with every thread, instead of in every replica at once
+            self.tilesize = self.autoTileSize("cpu")
+        if self.precision == "int8":
+            # quantize once here, the replicas load the cached int8 model instead of all calibrating at once
+            UpscalePytorch(
+                self.upscaleModel,
+                device="cpu",
+                precision=self.precision,
+                quantize=self.quantize,
+                calibrationFrames=self.calibrationSamples(),
+                width=self.width,
+                height=self.height,
+                tilesize=self.tilesize,
+                tile_pad=self.overlap,
+                shapeBuckets=self.shapeBuckets,
+            )
+        settings = {
+            "backend": self.backend,
+            "precision": self.precision,
+            "quantize": self.quantize,
+            "tilesize": self.tilesize,
+            "tileBatch": self.tileBatch,
+            "tile_pad": self.overlap,
+            "outputWidth": self.outputResolution[0],
+            "outputHeight": self.outputResolution[1],
+            "shapeBuckets": self.shapeBuckets,
+        }
+        if self.cpuReplicas == "auto":
+            replicas = probeReplicaCount(
+                self.upscaleModel,
+                self.width,
+                self.height,
+                self.upscaleTimes,
+                totalThreads=totalThreads,
+                settings=settings,
+                cpus=cpus,
+            )
+        else:
+            replicas = min(self.cpuReplicas, totalThreads)
+        threadsPerReplica = max(1, totalThreads // replicas)
+        replicaPool = ReplicaPool(
+            self.upscaleModel,
+            self.width,
+            self.height,
+            self.upscaleTimes,
+            replicas=replicas,
+            threadsPerReplica=threadsPerReplica,
+            settings=settings,
+            cpuSets=cpuSetsFor(cpus, replicas, threadsPerReplica) if cpus else None,
+        )
+        replicaPool.start()
+        printAndLog(
+            f"Using {replicas} cpu replicas with {threadsPerReplica} threads each"
+        )
+        return replicaPool
+
+    def autoTileSize(self, device) -> int:
+        """
+        Resolves --tilesize auto for the upscale model on device
+        """
+        from .TorchDevice import resolveDevice, resolvePrecision
+        from .TileTuner import autoTileSize
+
+        device = resolveDevice(device)
+        return autoTileSize(
+            self.upscaleModel,
+            device,
+            *resolvePrecision(self.precision, device),
+            self.width,
+            self.height,
+            self.overlap,
+        )
+
+    def setupReplicaPool(self):
+        self.replicaPool = self.createReplicaPool()
+        # frames go to the replicas as bytes, and come back as arrays
+        self.upscale = self.replicaPool.render
+        self.upscaleTensor = self.replicaPool.render
+        self.hotUnload = self.replicaPool.pause
+        self.hotReload = self.replicaPool.resume
+
+    def setupDeviceScheduler(self):
+        """
+        Upscales on every device in self.devices at once, frames are spread by how fast each device turns out to be.
+        cpu uses the replica pool if cpu replicas are enabled, and the model in this process otherwise.
+        """
+        executors = []
+        for device in self.devices:
+            if device == "cpu" and self.cpuReplicas:
+                # stopped through unload once the render is done
+                replicaPool = self.createReplicaPool()
+                executors.append(
+                    DeviceExecutor(
+                        name="cpu",
+                        function=replicaPool.render,
+                        concurrency=2 * replicaPool.replicas,
+                        unload=replicaPool.pause,
+                        reload=replicaPool.resume,
+                    )
+                )
+                continue
+            upscalePytorch = UpscalePytorch(
+                self.upscaleModel,
+                device=device,
+                precision=self.precision,
+                quantize=self.quantize,
+                calibrationFrames=(
+                    self.calibrationSamples() if device == "cpu" else None
+                ),
+                width=self.width,
+                height=self.height,
+                # tensorrt engines only run on gpus
+                backend=(
+                    "pytorch"
+                    if device == "cpu" and self.backend == "tensorrt"
+                    else self.backend
+                ),
+                tilesize=self.tilesize,
+                tileBatch=self.tileBatch,
+                tile_pad=self.overlap,
+                outputWidth=self.outputResolution[0],
+                outputHeight=self.outputResolution[1],
+                shapeBuckets=self.shapeBuckets,
+                trt_optimization_level=self.trt_optimization_level,
+            )
+            self.upscaleTimes = upscalePytorch.getScale()
+            executors.append(
+                DeviceExecutor(
+                    name=device,
+                    function=upscalePytorch.renderFrame,
+                    # a second frame can upload and download while the first one is being upscaled
+                    concurrency=2 if device != "cpu" else 1,
+                    unload=upscalePytorch.hotUnload,
+                    reload=upscalePytorch.hotReload,
+                )
+            )
+        self.deviceScheduler = DeviceScheduler(executors)
+        self.upscale = self.deviceScheduler.render
+        self.upscaleTensor = self.deviceScheduler.render
+        self.hotUnload = self.deviceScheduler.unload
+        self.hotReload = self.deviceScheduler.reload
 
     def setupUpscale(self):
         """
@@ -246,22 +858,87 @@ class Render(FFMpegRender):
         Mapss the self.undoSetup to the tensor_to_frame function, which undoes the prep done in the FFMpeg thread. Used for SCDetect
         """
         printAndLog("Setting up Upscale")
-        if self.backend == "pytorch" or self.backend == "tensorrt":
+        if self.tilesize == "auto" and self.backend not in TORCH_BACKENDS:
+            log(
+                "Automatic tile sizes are only supported by the pytorch, pytorch-compile and tensorrt backends, rendering whole frames"
+            )
+            self.tilesize = 0
+        if (
+            self.tilesize == "auto"
+            and len(self.devices) <= 1
+            and not (self.cpuReplicas and self.usesCPUInference())
+        ):
+            # probed here instead of in UpscalePytorch, frame batching and tile reuse depend on the size that's used
+            self.tilesize = self.autoTileSize(self.device)
+        if self.tileReuse and (
+            len(self.devices) > 1
+            or self.backend not in TORCH_BACKENDS
+            or not self.tilesize
+            or (self.cpuReplicas and self.usesCPUInference())
+        ):
+            log(
+                "Tile reuse is only used by the pytorch, pytorch-compile and tensorrt backends with tiling on a single device"
+            )
+            self.tileReuse = False
+        # every pytorch path (single device, replicas, scheduler) resizes to upscale_output_resolution itself
+        self.resizedInBackend = self.backend in TORCH_BACKENDS
+        if len(self.devices) > 1:
+            if self.backend not in TORCH_BACKENDS:
+                raise ValueError(
+                    "Multiple devices are only supported by the pytorch, pytorch-compile and tensorrt backends"
+                )
+            self.setupDeviceScheduler()
+            return
+        if self.cpuReplicas and self.usesCPUInference():
+            self.setupReplicaPool()
+            return
+        if self.cpuReplicas:
+            log(
+                "CPU replicas are only used by the pytorch and pytorch-compile backends on the cpu"
+            )
+        if self.upscaleBatch > 1:
+            if self.backend != "pytorch":
+                log("Frame batching is only supported by the pytorch backend, using 1")
+                self.upscaleBatch = 1
+            elif self.tilesize:
+                log("Frame batching is not used with tiling, tiles are batched instead")
+                self.upscaleBatch = 1
+        if self.backend in TORCH_BACKENDS:
             upscalePytorch = UpscalePytorch(
                 self.upscaleModel,
                 device=self.device,
                 precision=self.precision,
+                quantize=self.quantize,
+                calibrationFrames=(
+                    self.calibrationSamples() if self.usesCPUInference() else None
+                ),
                 width=self.width,
                 height=self.height,
                 backend=self.backend,
                 tilesize=self.tilesize,
+                tileBatch=self.tileBatch,
+                tileReuse=self.tileReuse,
+                tileReuseThreshold=self.tileReuseThreshold,
+                tile_pad=self.overlap,
+                outputWidth=self.outputResolution[0],
+                outputHeight=self.outputResolution[1],
+                bufferCount=self.framesInFlight(),
+                shapeBuckets=self.shapeBuckets,
                 trt_optimization_level=self.trt_optimization_level,
             )
             self.upscaleTimes = upscalePytorch.getScale()
             self.frameSetupFunction = upscalePytorch.bytesToFrame
             self.upscale = upscalePytorch.renderToNPArray
+            # split up so that the render stages can overlap upload, inference and download
+            self.upscaleSetupFunction = upscalePytorch.bytesToFrame
+            self.upscaleTensor = upscalePytorch.renderTensor
+            self.upscaleTensorBatch = upscalePytorch.renderTensorBatch
+            self.denormalize = upscalePytorch.tensorToNPArray
             self.hotUnload = upscalePytorch.hotUnload
             self.hotReload = upscalePytorch.hotReload
+            # the tuned tile size can turn tiling off
+            if upscalePytorch.tileReuse:
+                self.tileReuseReport = upscalePytorch.tileReuseReport
 
         if self.backend == "ncnn":
             path, last_folder = os.path.split(self.upscaleModel)
@@ -277,21 +954,59 @@ class Render(FFMpegRender):
                 width=self.width,
                 height=self.height,
                 tilesize=self.tilesize,
+                tilePad=self.overlap,
             )
             self.frameSetupFunction = self.returnFrame
             self.upscale = upscaleNCNN.Upscale
+            self.upscaleTensor = upscaleNCNN.Upscale
             self.hotUnload = upscaleNCNN.hotUnload
             self.hotReload = upscaleNCNN.hotReload
-        if self.backend == "directml":
+        if self.backend == "directml" or self.backend == "onnx":
             upscaleONNX = UpscaleONNX(
                 modelPath=self.upscaleModel,
                 precision=self.precision,
                 width=self.width,
                 height=self.height,
+                providers=(
+                    parseProviders("DmlExecutionProvider")
+                    if self.backend == "directml"
+                    else parseProviders(self.onnxProviders)
+                ),
+                intraOpThreads=self.inferenceThreads(self.onnxIntraThreads),
+                interOpThreads=self.onnxInterThreads,
+                bufferCount=self.framesInFlight(),
+                shapeBuckets=self.shapeBuckets,
             )
             self.upscaleTimes = upscaleONNX.getScale()
             self.frameSetupFunction = upscaleONNX.bytesToFrame
-            self.upscale = upscaleONNX.renderTensor
+            self.upscale = upscaleONNX.renderFrame
+            self.upscaleSetupFunction = upscaleONNX.bytesToFrame
+            self.upscaleTensor = upscaleONNX.renderTensor
+            self.hotUnload = upscaleONNX.hotUnload
+            self.hotReload = upscaleONNX.hotReload
+        if self.backend == "openvino":
+            if self.tilesize:
+                log(
+                    "Tiling is not supported by the openvino backend, rendering whole frames"
+                )
+            upscaleOpenVINO = UpscaleOpenVINO(
+                modelPath=self.upscaleModel,
+                precision=self.precision,
+                width=self.width,
+                height=self.height,
+                inferRequests=self.openvinoRequests,
+                threads=self.inferenceThreads(self.openvinoThreads),
+                shapeBuckets=self.shapeBuckets,
+            )
+            self.upscaleTimes = upscaleOpenVINO.getScale()
+            # one upscale worker per infer request keeps them all busy
+            self.upscaleWorkers = upscaleOpenVINO.inferRequests
+            self.frameSetupFunction = upscaleOpenVINO.bytesToFrame
+            self.upscale = upscaleOpenVINO.renderFrame
+            self.upscaleSetupFunction = upscaleOpenVINO.bytesToFrame
+            self.upscaleTensor = upscaleOpenVINO.renderTensor
+            self.hotUnload = upscaleOpenVINO.hotUnload
+            self.hotReload = upscaleOpenVINO.hotReload
 
     def setupInterpolate(self):
         log("Setting up Interpolation")
@@ -324,7 +1039,7 @@ class Render(FFMpegRender):
             self.hotUnload = interpolateRifeNCNN.hotUnload
             self.doEncodingOnFrame = False
 
-        if self.backend == "pytorch" or self.backend == "tensorrt":
+        if self.backend in TORCH_BACKENDS:
             interpolateRifePytorch = InterpolateRifeTorch(
                 modelPath=self.interpolateModel,
                 ceilInterpolateFactor=self.ceilInterpolateFactor,
@@ -333,9 +1048,11 @@ class Render(FFMpegRender):
                 device=self.device,
                 dtype=self.precision,
                 backend=self.backend,
+                shapeBuckets=self.shapeBuckets,
                 trt_optimization_level=self.trt_optimization_level,
             )
             self.frameSetupFunction = interpolateRifePytorch.frame_to_tensor
+            self.frame0SetupFunction = interpolateRifePytorch.frame0_to_tensor
             self.undoSetup = interpolateRifePytorch.uncacheFrame
             self.interpolate = interpolateRifePytorch.process
             self.hotUnload = interpolateRifePytorch.hotUnload
@@ -343,3 +1060,22 @@ class Render(FFMpegRender):
             self.encodeFrame = interpolateRifePytorch.encode_Frame
             self.copyFrame = interpolateRifePytorch.copyTensor
             self.doEncodingOnFrame = not (interpolateRifePytorch.rife46)
+
+        if self.backend == "openvino":
+            interpolateRifeOpenVINO = InterpolateRifeOpenVINO(
+                modelPath=self.interpolateModel,
+                ceilInterpolateFactor=self.ceilInterpolateFactor,
+                width=self.width,
+                height=self.height,
+                precision=self.precision,
+                threads=self.inferenceThreads(self.openvinoThreads),
+            )
+            self.frameSetupFunction = interpolateRifeOpenVINO.normFrame
+            self.frame0SetupFunction = interpolateRifeOpenVINO.normFrame0
+            self.undoSetup = interpolateRifeOpenVINO.uncacheFrame
+            self.interpolate = interpolateRifeOpenVINO.process
+            self.hotUnload = interpolateRifeOpenVINO.hotUnload
+            self.hotReload = interpolateRifeOpenVINO.hotReload
+            self.copyFrame = interpolateRifeOpenVINO.copyFrame
+            # the encoder is part of the openvino graph
+            self.doEncodingOnFrame = False
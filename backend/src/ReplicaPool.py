@@ -0,0 +1,364 @@
+import os
+import time
+import queue
+import traceback
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event, Lock, Condition
+
+import numpy as np
+
+from .SharedMemoryRing import SharedMemoryRing
+from .Util import log, printAndLog
+
+# sent by a replica once its model is loaded
+REPLICA_READY = -1
+
+
+def replicaWorker(
+    modelPath: str,
+    settings: dict,
+    threads: int,
+    cpus: list,
+    taskQueue,
+    resultQueue,
+    inputInfo: tuple,
+    outputInfo: tuple,
+    matmulPrecision: str,
+):
+    """
+    Runs in its own process, holds one copy of the model and upscales whatever frame is next in the shared task queue
+    """
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    import torch
+
+    # spawned processes start with the default, the parent may have changed it (InterpolateTorch does on import)
+    torch.set_float32_matmul_precision(matmulPrecision)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    from .UpscaleTorch import UpscalePytorch
+
+    inputRing = SharedMemoryRing.attach(inputInfo)
+    outputRing = SharedMemoryRing.attach(outputInfo)
+    try:
+        upscale = UpscalePytorch(modelPath, device="cpu", **settings)
+        resultQueue.put((REPLICA_READY, None, None))
+        while True:
+            task = taskQueue.get()
+            if task is None:
+                break
+            index, slot = task
+            try:
+                view = inputRing.slotView(slot)
+                frame = upscale.bytesToFrame(view)
+                view.release()
+                inputRing.releaseFree(slot)
+                output = upscale.renderToNPArray(frame)
+                outputSlot = outputRing.acquireFree()
+                outputRing.writeSlot(outputSlot, output)
+                resultQueue.put((index, outputSlot, None))
+            except Exception:
+                resultQueue.put((index, None, traceback.format_exc()))
+    except Exception:
+        resultQueue.put((REPLICA_READY, None, traceback.format_exc()))
+    finally:
+        inputRing.close()
+        outputRing.close()
+
+
+class PendingFrame:
+    __slots__ = ("event", "output", "error")
+
+    def __init__(self):
+        self.event = Event()
+        self.output = None
+        self.error = None
+
+
+class ReplicaPool:
+    """
+    Upscales on the cpu with several processes, each holding its own copy of the model and a share of the threads.
+    Small conv models stop scaling with intra-op threads long before a big cpu runs out of cores, separate replicas keep scaling.
+    Frames go through shared memory, and replicas take them from one shared queue, so a replica that is ahead just takes the next frame.
+    render() blocks until its own frame is done, call it from several threads (the upscale stage workers) to keep every replica busy,
+    the stage graph puts the frames back in order.
+
+    Args:
+        modelPath (str): Path to the upscale model.
+        width (int): Width of the input frames.
+        height (int): Height of the input frames.
+        scale (int): Upscale factor of the model.
+        replicas (int): Number of processes.
+        threadsPerReplica (int): Torch threads in every process.
+        settings (dict, optional): Extra UpscalePytorch arguments (precision, tiling, output size).
+        cpuSets (list[list[int]], optional): cpus to pin every replica to.
+    """
+
+    def __init__(
+        self,
+        modelPath: str,
+        width: int,
+        height: int,
+        scale: int,
+        replicas: int,
+        threadsPerReplica: int,
+        settings: dict = None,
+        cpuSets: list = None,
+    ):
+        self.modelPath = modelPath
+        self.width = width
+        self.height = height
+        self.scale = scale
+        self.replicas = max(1, replicas)
+        self.threadsPerReplica = max(1, threadsPerReplica)
+        self.settings = dict(settings) if settings is not None else {}
+        self.settings.update({"width": width, "height": height})
+        # the replicas resize to the output size themselves if one is set
+        self.outputWidth = self.settings.get("outputWidth") or width * scale
+        self.outputHeight = self.settings.get("outputHeight") or height * scale
+        self.cpuSets = cpuSets
+        self.processes = []
+        self.inputRing = None
+        self.outputRing = None
+        self.started = False
+        # frames inside render(), pause() waits for them before stopping the replicas
+        self.inFlight = 0
+        self.paused = False
+        self.pauseCondition = Condition()
+
+    def start(self):
+        if self.started:
+            return
+        import torch
+
+        context = mp.get_context("spawn")
+        # 2 frames per replica, one being worked on and one waiting
+        self.inputRing = SharedMemoryRing(
+            self.width * self.height * 3, slotCount=2 * self.replicas, context=context
+        )
+        self.outputRing = SharedMemoryRing(
+            self.outputWidth * self.outputHeight * 3,
+            slotCount=2 * self.replicas,
+            context=context,
+        )
+        self.taskQueue = context.Queue()
+        self.resultQueue = context.Queue()
+        self.pending = {}
+        self.nextIndex = 0
+        self.lock = Lock()
+        self.error = None
+        self.stopping = False
+        self.processes = [
+            context.Process(
+                target=replicaWorker,
+                args=(
+                    self.modelPath,
+                    self.settings,
+                    self.threadsPerReplica,
+                    self.cpuSets[replicaNum] if self.cpuSets else None,
+                    self.taskQueue,
+                    self.resultQueue,
+                    self.inputRing.connectionInfo(),
+                    self.outputRing.connectionInfo(),
+                    torch.get_float32_matmul_precision(),
+                ),
+                daemon=True,
+            )
+            for replicaNum in range(self.replicas)
+        ]
+        for process in self.processes:
+            process.start()
+        for _ in self.processes:
+            index, slot, error = self.resultQueue.get()
+            if error is not None:
+                self.stop()
+                raise RuntimeError(f"Replica failed to load the model:\n{error}")
+        self.collectorThread = Thread(target=self.collectResults, daemon=True)
+        self.collectorThread.start()
+        self.started = True
+        log(
+            f"Started {self.replicas} cpu replicas with {self.threadsPerReplica} threads each"
+        )
+
+    def collectResults(self):
+        while True:
+            try:
+                index, slot, error = self.resultQueue.get(timeout=1)
+            except queue.Empty:
+                if self.stopping:
+                    return
+                if all(process.is_alive() for process in self.processes):
+                    continue
+                self.failPending("A cpu replica exited unexpectedly")
+                return
+            with self.lock:
+                waiter = self.pending.pop(index)
+            if error is not None:
+                waiter.error = error
+            else:
+                view = self.outputRing.slotView(slot)
+                waiter.output = (
+                    np.frombuffer(view, dtype=np.uint8)
+                    .reshape(self.outputHeight, self.outputWidth, 3)
+                    .copy()
+                )
+                view.release()
+                self.outputRing.releaseFree(slot)
+            waiter.event.set()
+
+    def failPending(self, error: str):
+        with self.lock:
+            self.error = error
+            for waiter in self.pending.values():
+                waiter.error = error
+                waiter.event.set()
+            self.pending.clear()
+
+    def render(self, frame) -> np.ndarray:
+        """
+        Upscales one frame (bytes or uint8 array), blocks until it is done, or until resume() while paused
+        """
+        with self.pauseCondition:
+            while self.paused:
+                self.pauseCondition.wait()
+            self.inFlight += 1
+        try:
+            return self.renderFrame(frame)
+        finally:
+            with self.pauseCondition:
+                self.inFlight -= 1
+                self.pauseCondition.notify_all()
+
+    def renderFrame(self, frame) -> np.ndarray:
+        while True:
+            if self.error is not None:
+                raise RuntimeError(self.error)
+            try:
+                # dead replicas never free their slots
+                slot = self.inputRing.acquireFree(timeout=1)
+                break
+            except queue.Empty:
+                pass
+        self.inputRing.writeSlot(slot, frame)
+        waiter = PendingFrame()
+        with self.lock:
+            # checked under the lock, failPending only sees frames added before it
+            if self.error is not None:
+                self.inputRing.releaseFree(slot)
+                raise RuntimeError(self.error)
+            index = self.nextIndex
+            self.nextIndex += 1
+            self.pending[index] = waiter
+        self.taskQueue.put((index, slot))
+        waiter.event.wait()
+        if waiter.error is not None:
+            raise RuntimeError(f"CPU replica failed:\n{waiter.error}")
+        return waiter.output
+
+    def pause(self):
+        """
+        Stops taking new frames, waits for the frames being upscaled, then shuts the replicas down to free their memory
+        """
+        with self.pauseCondition:
+            self.paused = True
+            while self.inFlight > 0:
+                self.pauseCondition.wait()
+        self.stop()
+
+    def resume(self):
+        """
+        Undoes pause, frames that came in while paused go to the restarted replicas
+        """
+        with self.pauseCondition:
+            if not self.paused:
+                return
+            self.start()
+            self.paused = False
+            self.pauseCondition.notify_all()
+
+    def stop(self):
+        """
+        Shuts the replicas down, start() brings them back.
+        Frames still in render() fail, pause() waits for them first.
+        """
+        self.stopping = True
+        for _ in self.processes:
+            self.taskQueue.put(None)
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        if self.started:
+            # not woken through resultQueue, a killed replica can leave the queue's write lock held
+            self.collectorThread.join()
+        self.processes = []
+        if self.inputRing is not None:
+            self.inputRing.close()
+            self.outputRing.close()
+            self.inputRing = None
+            self.outputRing = None
+        self.started = False
+
+    def measureThroughput(self, frame, frames: int) -> float:
+        """
+        Frames per second with every replica busy, after one warm up frame per replica
+        """
+        with ThreadPoolExecutor(max_workers=2 * self.replicas) as executor:
+            list(executor.map(self.render, [frame] * self.replicas))
+            start = time.perf_counter()
+            list(executor.map(self.render, [frame] * frames))
+        return frames / (time.perf_counter() - start)
+
+
+def cpuSetsFor(cpus: list[int], replicas: int, threadsPerReplica: int) -> list:
+    return [
+        cpus[replicaNum * threadsPerReplica : (replicaNum + 1) * threadsPerReplica]
+        for replicaNum in range(replicas)
+    ]
+
+
+def probeReplicaCount(
+    modelPath: str,
+    width: int,
+    height: int,
+    scale: int,
+    totalThreads: int,
+    settings: dict = None,
+    cpus: list[int] = None,
+) -> int:
+    """
+    Runs a few frames through pools of 1, 2, 4... replicas, and returns the count with the highest throughput.
+    Stops early once adding replicas makes things slower.
+    """
+    frame = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+    bestReplicas, bestFPS = 1, 0.0
+    replicas = 1
+    while replicas <= totalThreads:
+        threadsPerReplica = totalThreads // replicas
+        pool = ReplicaPool(
+            modelPath,
+            width,
+            height,
+            scale,
+            replicas=replicas,
+            threadsPerReplica=threadsPerReplica,
+            settings=settings,
+            cpuSets=cpuSetsFor(cpus, replicas, threadsPerReplica) if cpus else None,
+        )
+        pool.start()
+        try:
+            fps = pool.measureThroughput(frame, frames=2 * replicas)
+        finally:
+            pool.stop()
+        log(f"Replica probe: {replicas} replicas, {round(fps, 2)} fps")
+        if fps > bestFPS:
+            bestReplicas, bestFPS = replicas, fps
+        elif fps < bestFPS * 0.95:
+            break
+        replicas *= 2
+    printAndLog(f"Using {bestReplicas} cpu replicas ({round(bestFPS, 2)} fps in probe)")
+    return bestReplicas
@@ -0,0 +1,157 @@
+import math
+
+import numpy as np
+
+from .Util import log
+
+# common video widths and heights, each side of a frame is rounded up to the next one of these
+BUCKET_SIZES = (
+    240,
+    360,
+    480,
+    540,
+    576,
+    720,
+    800,
+    1080,
+    1280,
+    1440,
+    1600,
+    1920,
+    2160,
+    2560,
+    2880,
+    3200,
+    3840,
+    4096,
+    4320,
+    5120,
+    7680,
+)
+
+PAD_MODES = ("replicate", "reflect")
+
+
+def reflected(side: int, pad: int) -> slice:
+    """
+    The pad pixels before the last one, backwards, what reflect padding copies after the edge
+    """
+    stop = side - 2 - pad
+    return slice(side - 2, stop if stop >= 0 else None, -1)
+
+
+class ShapeBuckets:
+    """
+    Rounds frame sizes up to a small set of shapes, so compiled models (tensorrt engines, torch.compile graphs, onnx and openvino sessions) built for one video are reused by videos of similar sizes.
+    Frames are padded up to the bucket and the outputs cropped back.
+    A bucket is only used if the padding is at most maxWaste of the padded area, otherwise the frame keeps its own size.
+
+    Args:
+        maxWaste (float, optional): Largest part of the padded frame that can be padding, 0-1. Defaults to 0.25.
+        padMode (str, optional): How the padding is filled, replicate or reflect. Defaults to "replicate".
+        sizes (tuple, optional): Sizes each side is rounded up to. Defaults to BUCKET_SIZES.
+    """
+
+    def __init__(
+        self,
+        maxWaste: float = 0.25,
+        padMode: str = "replicate",
+        sizes: tuple = BUCKET_SIZES,
+    ):
+        if padMode not in PAD_MODES:
+            raise ValueError(f"Pad mode must be one of {PAD_MODES}")
+        self.maxWaste = maxWaste
+        self.padMode = padMode
+        self.sizes = tuple(sorted(sizes))
+
+    def roundSide(self, side: int, modulo: int) -> int:
+        aligned = math.ceil(side / modulo) * modulo
+        for size in self.sizes:
+            if size >= side:
+                return max(math.ceil(size / modulo) * modulo, aligned)
+        return aligned
+
+    def bucket(self, width: int, height: int, modulo: int = 1) -> tuple[int, int]:
+        """
+        The (width, height) frames of width x height are padded to, both multiples of modulo
+        """
+        alignedWidth = math.ceil(width / modulo) * modulo
+        alignedHeight = math.ceil(height / modulo) * modulo
+        bucketWidth = self.roundSide(width, modulo)
+        bucketHeight = self.roundSide(height, modulo)
+        waste = 1 - (width * height) / (bucketWidth * bucketHeight)
+        if waste > self.maxWaste:
+            log(
+                f"No shape bucket for {width}x{height} ({waste:.0%} padding), using {alignedWidth}x{alignedHeight}"
+            )
+            return alignedWidth, alignedHeight
+        log(f"Shape bucket for {width}x{height}: {bucketWidth}x{bucketHeight}")
+        return bucketWidth, bucketHeight
+
+    def modeFor(self, width: int, height: int, paddedWidth: int, paddedHeight: int):
+        # reflect can't pad more than the frame is wide
+        if self.padMode == "reflect" and (
+            paddedWidth - width >= width or paddedHeight - height >= height
+        ):
+            return "replicate"
+        return self.padMode
+
+    def padTensor(self, image, paddedWidth: int, paddedHeight: int):
+        """
+        Pads an nchw tensor on the right and bottom
+        """
+        import torch.nn.functional as F
+
+        height, width = image.shape[-2:]
+        if (width, height) == (paddedWidth, paddedHeight):
+            return image
+        return F.pad(
+            image,
+            (0, paddedWidth - width, 0, paddedHeight - height),
+            mode=self.modeFor(width, height, paddedWidth, paddedHeight),
+        )
+
+    def fillPadding(self, buffer: np.ndarray, width: int, height: int):
+        """
+        Fills the padding of an nchw array in place, the frame is in the top left width x height
+        """
+        paddedHeight, paddedWidth = buffer.shape[-2:]
+        mode = self.modeFor(width, height, paddedWidth, paddedHeight)
+        padWidth = paddedWidth - width
+        padHeight = paddedHeight - height
+        if padWidth:
+            if mode == "reflect":
+                buffer[..., :height, width:] = buffer[
+                    ..., :height, reflected(width, padWidth)
+                ]
+            else:
+                buffer[..., :height, width:] = buffer[..., :height, width - 1 : width]
+        if padHeight:
+            if mode == "reflect":
+                buffer[..., height:, :] = buffer[..., reflected(height, padHeight), :]
+            else:
+                buffer[..., height:, :] = buffer[..., height - 1 : height, :]
+
+    def fillPaddingTensor(self, image, width: int, height: int):
+        """
+        fillPadding for nchw tensors, the frame is in the top left width x height.
+        Replicate copies in place, reflect needs a flipped copy of the edge as torch can't slice backwards.
+        """
+        paddedHeight, paddedWidth = image.shape[-2:]
+        mode = self.modeFor(width, height, paddedWidth, paddedHeight)
+        padWidth = paddedWidth - width
+        padHeight = paddedHeight - height
+        if padWidth:
+            if mode == "reflect":
+                image[..., :height, width:] = image[
+                    ..., :height, width - 1 - padWidth : width - 1
+                ].flip(-1)
+            else:
+                image[..., :height, width:] = image[..., :height, width - 1 : width]
+        if padHeight:
+            if mode == "reflect":
+                image[..., height:, :] = image[
+                    ..., height - 1 - padHeight : height - 1, :
+                ].flip(-2)
+            else:
+                image[..., height:, :] = image[..., height - 1 : height, :]
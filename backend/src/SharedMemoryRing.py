@@ -0,0 +1,174 @@
+import subprocess
+import sys
+import queue
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+# put in the filled queue instead of a slot index once there are no more frames
+END_OF_FRAMES = -1
+
+
+class SharedMemoryRing:
+    """
+    A fixed number of frame sized slots in one shared memory block, used to move frames between processes without pickling them.
+    Ownership of a slot is handed over by passing its index through two queues:
+        freeSlots: slots the producer can write to
+        filledSlots: slots holding a frame for the consumer, the consumer puts the index back in freeSlots once it is done with it
+
+    Args:
+        slotSize (int): Size of a slot in bytes, the size of one frame.
+        slotCount (int): Number of slots, the max frames in flight between the two processes.
+        context (multiprocessing context, optional): Context used to create the queues. Defaults to spawn.
+    """
+
+    def __init__(self, slotSize: int, slotCount: int = 8, context=None):
+        if context is None:
+            context = mp.get_context("spawn")
+        self.slotSize = slotSize
+        self.slotCount = slotCount
+        self.shm = shared_memory.SharedMemory(create=True, size=slotSize * slotCount)
+        self.freeSlots = context.Queue()
+        self.filledSlots = context.Queue()
+        for slot in range(slotCount):
+            self.freeSlots.put(slot)
+        self.owner = True
+
+    def connectionInfo(self) -> tuple:
+        """
+        Everything another process needs to attach to this ring, picklable
+        """
+        return (
+            self.shm.name,
+            self.slotSize,
+            self.slotCount,
+            self.freeSlots,
+            self.filledSlots,
+        )
+
+    @classmethod
+    def attach(cls, connectionInfo: tuple):
+        name, slotSize, slotCount, freeSlots, filledSlots = connectionInfo
+        ring = cls.__new__(cls)
+        ring.slotSize = slotSize
+        ring.slotCount = slotCount
+        # spawned processes share the resource tracker of the creating process, which unlinks the block in close()
+        ring.shm = shared_memory.SharedMemory(name=name)
+        ring.freeSlots = freeSlots
+        ring.filledSlots = filledSlots
+        ring.owner = False
+        return ring
+
+    def slotView(self, slot: int) -> memoryview:
+        start = slot * self.slotSize
+        return self.shm.buf[start : start + self.slotSize]
+
+    def writeSlot(self, slot: int, frame):
+        """
+        Copies a frame (bytes or uint8 array) into a slot
+        """
+        np.copyto(
+            np.frombuffer(self.slotView(slot), dtype=np.uint8),
+            np.frombuffer(frame, dtype=np.uint8),
+        )
+
+    def acquireFree(self, timeout: float = None) -> int:
+        """
+        Raises queue.Empty if no slot was freed within timeout
+        """
+        return self.freeSlots.get(timeout=timeout)
+
+    def releaseFree(self, slot: int):
+        self.freeSlots.put(slot)
+
+    def publish(self, slot: int):
+        self.filledSlots.put(slot)
+
+    def finish(self):
+        self.filledSlots.put(END_OF_FRAMES)
+
+    def takeFilled(self, producer=None) -> int | None:
+        """
+        Returns the next filled slot, or None once the producer is done.
+        Raises if producer (the process filling the ring) died without finishing it, instead of waiting forever
+        """
+        while True:
+            # checked before waiting, a producer that finished and exited right after still has its slots read
+            alive = producer is None or producer.is_alive()
+            try:
+                slot = self.filledSlots.get(timeout=1)
+                break
+            except queue.Empty:
+                if not alive:
+                    raise RuntimeError(
+                        f"{producer.name} stopped before sending all frames (exit code {producer.exitcode})"
+                    )
+        if slot == END_OF_FRAMES:
+            return None
+        return slot
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def decodeWorker(command: list, connectionInfo: tuple):
+    """
+    Runs in its own process, reads raw frames from ffmpeg straight into the ring
+    """
+    ring = SharedMemoryRing.attach(connectionInfo)
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            slot = ring.acquireFree()
+            view = ring.slotView(slot)
+            bytesRead = 0
+            while bytesRead < ring.slotSize:
+                n = process.stdout.readinto(view[bytesRead:])
+                if not n:
+                    break
+                bytesRead += n
+            view.release()
+            if bytesRead < ring.slotSize:
+                ring.releaseFree(slot)
+                break
+            ring.publish(slot)
+    finally:
+        ring.finish()
+        process.stdout.close()
+        process.terminate()
+        ring.close()
+
+
+def encodeWorker(command: list, connectionInfo: tuple, logFile: str):
+    """
+    Runs in its own process, writes frames from the ring into ffmpeg
+    """
+    ring = SharedMemoryRing.attach(connectionInfo)
+    with open(logFile, "w") as f:
+        with subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stderr=f,
+            stdout=f,
+        ) as process:
+            while True:
+                # the render process can be killed without finishing the ring
+                slot = ring.takeFilled(mp.parent_process())
+                if slot is None:
+                    break
+                view = ring.slotView(slot)
+                process.stdin.write(view)
+                view.release()
+                ring.releaseFree(slot)
+            process.stdin.close()
+            process.wait()
+    ring.close()
+    # the render checks the exit code, ffmpeg can still fail while finishing the file
+    if process.returncode:
+        sys.exit(process.returncode)
@@ -0,0 +1,261 @@
+import queue
+import time
+from threading import Thread, Lock, Condition
+from time import sleep
+
+from .Util import log, warnAndLog
+
+
+class ReorderBuffer:
+    """
+    Releases items in the order of their sequence index, no matter the order they were added in.
+    Used to restore frame order after work is spread over multiple workers.
+    """
+
+    def __init__(self, startIndex: int = 0):
+        self.nextIndex = startIndex
+        self.pending = {}
+        self.lock = Lock()
+
+    def add(self, index: int, item) -> list:
+        """
+        Adds an item, returns the items that are now ready to be released in order
+        """
+        with self.lock:
+            self.pending[index] = item
+            ready = []
+            while self.nextIndex in self.pending:
+                ready.append(self.pending.pop(self.nextIndex))
+                self.nextIndex += 1
+            return ready
+
+    def __len__(self):
+        return len(self.pending)
+
+
+class Stage:
+    """
+    A step of the render pipeline.
+
+    Args:
+        name (str): Name used for the timing report and --stage_workers.
+        function (callable): Takes one item and returns a list of items to pass on (can be empty, or more than one).
+        workers (int, optional): Number of threads running this stage. Defaults to 1.
+        stateful (bool, optional): The function depends on the previous item (scene detect, interpolation), limits the stage to 1 worker. Defaults to False.
+        batchSize (int, optional): If more than 1, the function takes a list of up to batchSize items that were already waiting,
+            and returns a list with the outputs of each of them. Defaults to 1.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        function,
+        workers: int = 1,
+        stateful: bool = False,
+        batchSize: int = 1,
+    ):
+        if stateful and workers > 1:
+            warnAndLog(
+                f"Stage {name} depends on frame order, using 1 worker instead of {workers}"
+            )
+            workers = 1
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.stateful = stateful
+        self.batchSize = max(1, batchSize)
+        self.busyTime = 0.0
+        self.itemsProcessed = 0
+        self.statsLock = Lock()
+
+    def addTime(self, seconds: float, items: int = 1):
+        with self.statsLock:
+            self.busyTime += seconds
+            self.itemsProcessed += items
+
+
+class StageGraph:
+    """
+    Runs a chain of stages, each on its own worker threads, connected by bounded queues.
+    Every stage passes its items on in the order they came in, even with multiple workers.
+    A stage never holds more than workers * batchSize items at once, the ones waiting to be passed on in order included,
+    so a slow item can't let the other workers run ahead through preallocated frame buffers.
+
+    Args:
+        stages (list[Stage]): The stages, in order.
+        inputQueue (queue.Queue): Queue to take items from, None marks the end.
+        outputQueue (queue.Queue): Queue to put the results in. The end marker is not forwarded.
+        queueSize (int, optional): Size of the queues between stages. Defaults to 8.
+        isPaused (callable, optional): Reading from inputQueue waits while this returns True.
+        inputFunction (callable, optional): Applied to every item taken from inputQueue.
+        outputFunction (callable, optional): Applied to every item before it is put in outputQueue.
+    """
+
+    def __init__(
+        self,
+        stages: list[Stage],
+        inputQueue: queue.Queue,
+        outputQueue: queue.Queue,
+        queueSize: int = 8,
+        isPaused=None,
+        inputFunction=None,
+        outputFunction=None,
+    ):
+        self.stages = stages
+        self.inputQueue = inputQueue
+        self.outputQueue = outputQueue
+        self.isPaused = isPaused if isPaused is not None else lambda: False
+        self.inputFunction = inputFunction
+        self.outputFunction = outputFunction
+        # queues[i] feeds stages[i], there is no queue after the last stage as it writes to outputQueue
+        self.queues = [queue.Queue(maxsize=queueSize) for _ in stages]
+        self.error = None
+
+    def readInput(self):
+        index = 0
+        while True:
+            if self.isPaused():
+                sleep(1)
+                continue
+            item = self.inputQueue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                # keep draining so the reader never blocks on a full queue
+                continue
+            if self.inputFunction is not None:
+                item = self.inputFunction(item)
+            self.sendTo(0, index, item)
+            index += 1
+        self.sendTo(0, None, None)
+
+    def sendTo(self, stageNum: int, index, item):
+        if stageNum < len(self.stages):
+            self.queues[stageNum].put((index, item))
+        elif index is not None:
+            if self.outputFunction is not None:
+                item = self.outputFunction(item)
+            self.outputQueue.put(item)
+
+    def takeBatch(self, inQueue: queue.Queue, batchSize: int) -> tuple[list, bool]:
+        """
+        Waits for one item, then takes up to batchSize - 1 more that are already waiting.
+        Returns the (index, item) pairs and whether the end marker was reached.
+        """
+        index, item = inQueue.get()
+        if index is None:
+            return [], True
+        batch = [(index, item)]
+        while len(batch) < batchSize:
+            try:
+                index, item = inQueue.get_nowait()
+            except queue.Empty:
+                break
+            if index is None:
+                # leave the end marker for the next call
+                inQueue.put((None, None))
+                break
+            batch.append((index, item))
+        return batch, False
+
+    def runStage(self, stageNum: int, reorderBuffer: ReorderBuffer, state: dict):
+        stage = self.stages[stageNum]
+        inQueue = self.queues[stageNum]
+        window = stage.workers * stage.batchSize
+        while True:
+            with state["lock"]:
+                # room is made before taking items, the item at nextIndex is always being worked on so this can't wait forever
+                while (
+                    state["taken"] + stage.batchSize > reorderBuffer.nextIndex + window
+                ):
+                    state["lock"].wait()
+                state["taken"] += stage.batchSize
+            batch, ended = self.takeBatch(inQueue, stage.batchSize)
+            with state["lock"]:
+                state["taken"] -= stage.batchSize - len(batch)
+                state["lock"].notify_all()
+            if ended:
+                # let the other workers of this stage see the end marker too
+                inQueue.put((None, None))
+                break
+            results = [[] for _ in batch]
+            if self.error is None:
+                try:
+                    start = time.perf_counter()
+                    if stage.batchSize > 1:
+                        results = stage.function([item for index, item in batch])
+                    else:
+                        results = [stage.function(batch[0][1])]
+                    stage.addTime(time.perf_counter() - start, len(batch))
+                except Exception as e:
+                    log(f"ERROR: stage {stage.name} failed: {e}")
+                    self.error = e
+                    results = [[] for _ in batch]
+            # the lock keeps released items in order while they are put in the next queue
+            with state["lock"]:
+                for (index, item), outputs in zip(batch, results):
+                    for ready in reorderBuffer.add(index, outputs):
+                        for output in ready:
+                            self.sendTo(stageNum + 1, state["nextIndex"], output)
+                            state["nextIndex"] += 1
+                state["lock"].notify_all()
+
+        with state["lock"]:
+            state["finished"] += 1
+            if state["finished"] == stage.workers:
+                self.sendTo(stageNum + 1, None, None)
+
+    def run(self):
+        """
+        Blocks until every item has been processed, raises the first error a stage ran into.
+        """
+        threads = [Thread(target=self.readInput)]
+        for stageNum, stage in enumerate(self.stages):
+            reorderBuffer = ReorderBuffer()
+            state = {"lock": Condition(), "nextIndex": 0, "finished": 0, "taken": 0}
+            for _ in range(stage.workers):
+                threads.append(
+                    Thread(
+                        target=self.runStage,
+                        args=(stageNum, reorderBuffer, state),
+                        name=f"{stage.name}-worker",
+                    )
+                )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def timingReport(self) -> str:
+        lines = ["Stage timings:"]
+        for stage in self.stages:
+            if stage.itemsProcessed == 0:
+                lines.append(f"  {stage.name} (workers={stage.workers}): no frames")
+                continue
+            perItem = stage.busyTime / stage.itemsProcessed * 1000
+            batch = f", batch={stage.batchSize}" if stage.batchSize > 1 else ""
+            lines.append(
+                f"  {stage.name} (workers={stage.workers}{batch}): {stage.itemsProcessed} frames, "
+                + f"{round(stage.busyTime, 2)}s busy, {round(perItem, 2)}ms/frame"
+            )
+        return "\n".join(lines)
+
+
+def parseStageWorkers(stageWorkers: str) -> dict:
+    """
+    Parses the --stage_workers argument, ex: "scenedetect=1,denormalize=2"
+    """
+    workers = {}
+    if not stageWorkers:
+        return workers
+    for entry in stageWorkers.split(","):
+        try:
+            name, count = entry.split("=")
+            workers[name.strip().lower()] = int(count)
+        except ValueError:
+            raise ValueError(
+                f"Invalid stage worker setting {entry}, please use something like denormalize=2"
+            )
+    return workers
@@ -0,0 +1,236 @@
+import os
+import glob
+import math
+
+from .Util import log, printAndLog
+
+
+def parseCPUList(cpuList: str) -> list[int]:
+    """
+    Parses the linux cpu list format, ex: "0-3,8-11"
+    """
+    cpus = []
+    for part in cpuList.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def readFile(path: str) -> str | None:
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+class CPUTopology:
+    """
+    The cpus this process is allowed to run on, and how they are laid out.
+
+    Attributes:
+        cpus (list[int]): Logical cpus in the affinity mask of this process.
+        coreGroups (list[list[int]]): cpus grouped by physical core (SMT siblings share a group).
+        numaNodes (list[list[int]]): cpus grouped by numa node.
+        cgroupQuota (float | None): cpu limit from the cgroup, in cores.
+    """
+
+    def __init__(self):
+        try:
+            self.cpus = sorted(os.sched_getaffinity(0))
+        except AttributeError:  # not available on windows/macos
+            self.cpus = list(range(os.cpu_count() or 1))
+        self.coreGroups = self.readCoreGroups()
+        self.numaNodes = self.readNumaNodes()
+        self.cgroupQuota = self.readCgroupQuota()
+
+    def readCoreGroups(self) -> list[list[int]]:
+        groups = {}
+        for cpu in self.cpus:
+            siblings = readFile(
+                f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list"
+            )
+            key = tuple(parseCPUList(siblings)) if siblings else (cpu,)
+            groups.setdefault(key, []).append(cpu)
+        return list(groups.values())
+
+    def readNumaNodes(self) -> list[list[int]]:
+        nodes = []
+        for nodePath in sorted(glob.glob("/sys/devices/system/node/node[0-9]*")):
+            cpuList = readFile(os.path.join(nodePath, "cpulist"))
+            if cpuList:
+                nodeCPUs = [cpu for cpu in parseCPUList(cpuList) if cpu in self.cpus]
+                if nodeCPUs:
+                    nodes.append(nodeCPUs)
+        return nodes if nodes else [list(self.cpus)]
+
+    def readCgroupQuota(self) -> float | None:
+        # cgroup v2
+        cpuMax = readFile("/sys/fs/cgroup/cpu.max")
+        if cpuMax:
+            quota, period = cpuMax.split()
+            if quota != "max":
+                return int(quota) / int(period)
+            return None
+        # cgroup v1
+        quota = readFile("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+        period = readFile("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if quota and period and int(quota) > 0:
+            return int(quota) / int(period)
+        return None
+
+    @property
+    def physicalCores(self) -> int:
+        return len(self.coreGroups)
+
+    @property
+    def usableCores(self) -> int:
+        """
+        Logical cpus that can actually be kept busy, after the cgroup limit
+        """
+        usable = len(self.cpus)
+        if self.cgroupQuota is not None:
+            usable = min(usable, max(1, math.ceil(self.cgroupQuota)))
+        return usable
+
+    def __str__(self):
+        quota = (
+            f"{round(self.cgroupQuota, 2)} cores"
+            if self.cgroupQuota is not None
+            else "none"
+        )
+        return (
+            f"{len(self.cpus)} logical cpus, {self.physicalCores} physical cores, "
+            + f"{len(self.numaNodes)} numa nodes, cgroup quota: {quota}"
+        )
+
+
+class ThreadBudget:
+    """
+    Splits the cpu between torch, the ffmpeg decoder and encoder, opencv and worker pools, so they don't all start a thread per core.
+
+    Args:
+        totalThreads (int, optional): Override for the number of threads to hand out, 0 reads it from the cpu topology. Defaults to 0.
+        cpuInference (bool, optional): The models run on the cpu, so torch gets most of the budget. Defaults to False.
+        sceneDetect (bool, optional): Scene detection is enabled, which uses opencv. Defaults to False.
+        benchmark (bool, optional): Output is not encoded, so the encoder only needs 1 thread. Defaults to False.
+        topology (CPUTopology, optional): Defaults to the topology of this machine.
+    """
+
+    def __init__(
+        self,
+        totalThreads: int = 0,
+        cpuInference: bool = False,
+        sceneDetect: bool = False,
+        benchmark: bool = False,
+        topology: CPUTopology = None,
+    ):
+        self.topology = topology if topology is not None else CPUTopology()
+        self.total = totalThreads if totalThreads > 0 else self.topology.usableCores
+        self.cpuInference = cpuInference
+        self.opencvThreads = 1 if sceneDetect else 0
+        if cpuInference:
+            # inference is the bottleneck, the encoder only has to keep up with it
+            self.decodeThreads = max(1, self.total // 16)
+            self.encodeThreads = 1 if benchmark else max(1, self.total // 8)
+        else:
+            # the gpu does the heavy lifting, so the encoder is usually what holds things up
+            self.decodeThreads = max(1, self.total // 8)
+            self.encodeThreads = 1 if benchmark else max(1, self.total // 2)
+        remaining = max(
+            1,
+            self.total - self.decodeThreads - self.encodeThreads - self.opencvThreads,
+        )
+        if cpuInference:
+            # hyperthreads don't help convolutions, stay on one thread per physical core
+            smtRatio = len(self.topology.cpus) / max(1, self.topology.physicalCores)
+            self.torchThreads = max(1, int(remaining / smtRatio))
+        else:
+            # only has to launch kernels and do small cpu side ops
+            self.torchThreads = max(1, min(4, remaining))
+        self.torchInteropThreads = 1
+        # left over for worker pools, the normalize and denormalize render stages, or cpu model replicas next to a gpu
+        self.workerThreads = max(1, remaining - self.torchThreads)
+
+    def apply(self):
+        """
+        Sets the thread counts of the libraries loaded in this process, ffmpeg gets its count through the command line
+        """
+        import cv2
+
+        cv2.setNumThreads(max(1, self.opencvThreads))
+        try:
+            import torch
+
+            torch.set_num_threads(self.torchThreads)
+            try:
+                torch.set_num_interop_threads(self.torchInteropThreads)
+            except RuntimeError:
+                # can only be set before the first parallel work in torch
+                log("Unable to set torch inter-op threads, already in use")
+        except ImportError:
+            pass
+
+    def orderedCPUs(self) -> list[int]:
+        """
+        The cpus in the order they should be handed out.
+        One cpu per physical core first, and a numa node is filled before using the next.
+        """
+        ordered = []
+        for node in self.topology.numaNodes:
+            nodeGroups = [
+                group for group in self.topology.coreGroups if group[0] in node
+            ]
+            # one cpu from every core, then the siblings
+            for siblingNum in range(max(len(g) for g in nodeGroups)):
+                for group in nodeGroups:
+                    if siblingNum < len(group):
+                        ordered.append(group[siblingNum])
+        return ordered
+
+    def pin(self):
+        """
+        Pins this process (and every ffmpeg process started from it) to budget-many cpus.
+        """
+        if not hasattr(os, "sched_setaffinity"):
+            log("Thread pinning is only supported on linux")
+            return []
+        cpus = self.orderedCPUs()[: self.total]
+        os.sched_setaffinity(0, cpus)
+        return cpus
+
+    def report(self) -> str:
+        return (
+            f"CPU topology: {self.topology}\n"
+            + f"Thread budget: {self.total} "
+            + f"(torch: {self.torchThreads}, ffmpeg decode: {self.decodeThreads}, "
+            + f"ffmpeg encode: {self.encodeThreads}, opencv: {self.opencvThreads}, "
+            + f"workers: {self.workerThreads})"
+        )
+
+
+def setupThreadBudget(
+    totalThreads: int = 0,
+    cpuInference: bool = False,
+    sceneDetect: bool = False,
+    benchmark: bool = False,
+    pinThreads: bool = False,
+) -> ThreadBudget:
+    budget = ThreadBudget(
+        totalThreads=totalThreads,
+        cpuInference=cpuInference,
+        sceneDetect=sceneDetect,
+        benchmark=benchmark,
+    )
+    budget.apply()
+    printAndLog(budget.report())
+    if pinThreads:
+        cpus = budget.pin()
+        if cpus:
+            printAndLog(f"Pinned to cpus: {cpus}")
+    return budget
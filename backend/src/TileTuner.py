@@ -0,0 +1,252 @@
+import os
+import json
+import math
+import time
+from threading import Lock
+
+import torch
+
+from .Tiling import tilePositions
+from .TorchDevice import autocastContext, emptyCache, prepareModel
+from .Util import log, printAndLog, availableMemory, modelsDirectory
+
+# tile sizes that are tried, including the overlap, the whole frame is always tried as well
+TILE_SIZES = (128, 192, 256, 384, 512, 768, 1024)
+
+cacheLock = Lock()
+
+
+def tileCachePath() -> str:
+    return os.path.join(modelsDirectory(), "tile_sizes.json")
+
+
+def paddingModulo(scale: int) -> int:
+    """
+    What the model input is padded to a multiple of, 1x and 2x models downscale internally
+    """
+    match scale:
+        case 1:
+            return 4
+        case 2:
+            return 2
+        case _:
+            return 1
+
+
+def deviceName(device: torch.device) -> str:
+    if device.type == "cuda":
+        return torch.cuda.get_device_name(device)
+    # cpu timings depend on the threads torch gets
+    return f"cpu-{torch.get_num_threads()}threads"
+
+
+def tileCacheKey(
+    modelPath: str,
+    device: torch.device,
+    dtype: torch.dtype,
+    width: int,
+    height: int,
+    tilePad: int,
+) -> str:
+    return (
+        f"{os.path.basename(modelPath)}"
+        + f"_{deviceName(device)}"
+        + f"_{str(dtype).split('.')[-1]}"
+        + f"_{width}x{height}"
+        + f"_pad-{tilePad}"
+    )
+
+
+def loadTileCache() -> dict:
+    try:
+        with open(tileCachePath(), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def saveTileSize(key: str, tilesize: int, frameTimes: dict):
+    with cacheLock:
+        cache = loadTileCache()
+        cache[key] = {"tilesize": tilesize, "frameTimes": frameTimes}
+        try:
+            os.makedirs(modelsDirectory(), exist_ok=True)
+            tempPath = f"{tileCachePath()}.{os.getpid()}.tmp"
+            with open(tempPath, "w") as f:
+                json.dump(cache, f, indent=4)
+            os.replace(tempPath, tileCachePath())
+        except OSError as e:
+            log(f"Unable to save the tile size: {e}")
+
+
+def estimatedBytes(width: int, height: int, scale: int, dtype: torch.dtype) -> int:
+    # same rough bound as UpscalePytorch.getTileBatchSize, ~64 feature channels with a few alive at once
+    elementSize = torch.tensor([], dtype=dtype).element_size()
+    return width * height * elementSize * (256 + 3 * scale * scale)
+
+
+def tileCandidates(
+    width: int, height: int, scale: int, tilePad: int, sizeRequirements
+) -> list[tuple[int, int, int]]:
+    """
+    (tilesize, input width, input height) of every size worth trying, largest first.
+    Tiles are rounded up to what the model takes, and have to be smaller than the frame on both sides, with room for more than the overlap.
+    0 is the whole frame, only tried if the model takes the frame as it is.
+    """
+    modulo = paddingModulo(scale)
+    multiple = math.lcm(sizeRequirements.multiple_of, modulo)
+    candidates = []
+    frameWidth = math.ceil(width / modulo) * modulo
+    frameHeight = math.ceil(height / modulo) * modulo
+    if sizeRequirements.check(frameWidth, frameHeight):
+        candidates.append((0, frameWidth, frameHeight))
+    for size in sorted(set(TILE_SIZES), reverse=True):
+        padded = max(math.ceil(size / multiple) * multiple, sizeRequirements.minimum)
+        if padded >= min(width, height) or padded < 4 * tilePad:
+            continue
+        tilesize = padded - 2 * tilePad
+        if all(tilesize != candidate[0] for candidate in candidates):
+            candidates.append((tilesize, padded, padded))
+    return candidates
+
+
+def tileCount(width: int, height: int, window: int, overlap: int) -> int:
+    return len(tilePositions(width, window, overlap)) * len(
+        tilePositions(height, window, overlap)
+    )
+
+
+def synchronizeDevice(device: torch.device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+@torch.inference_mode()
+def timeModel(
+    model: torch.nn.Module,
+    device: torch.device,
+    dtype: torch.dtype,
+    autocastDtype: torch.dtype | None,
+    width: int,
+    height: int,
+) -> float:
+    """
+    Seconds for one input of width x height, after a warm up run
+    """
+    image = torch.rand(1, 3, height, width, device=device).to(dtype)
+    if device.type == "cpu":
+        image = image.contiguous(memory_format=torch.channels_last)
+    with autocastContext(device, autocastDtype):
+        start = time.perf_counter()
+        model(image)
+        synchronizeDevice(device)
+        # slow sizes aren't worth timing again
+        runs = 1 if time.perf_counter() - start > 2 else 3
+        start = time.perf_counter()
+        for _ in range(runs):
+            model(image)
+        synchronizeDevice(device)
+    return (time.perf_counter() - start) / runs
+
+
+def loadProbeModel(modelPath: str, device: torch.device, dtype: torch.dtype):
+    from .spandrel import ModelLoader, ImageModelDescriptor
+
+    descriptor = ModelLoader().load_from_file(modelPath)
+    assert isinstance(descriptor, ImageModelDescriptor)
+    model = descriptor.model.eval().to(device=device, dtype=dtype)
+    return prepareModel(model, device), descriptor.scale, descriptor.size_requirements
+
+
+def probeTileSize(
+    model: torch.nn.Module,
+    scale: int,
+    sizeRequirements,
+    device: torch.device,
+    dtype: torch.dtype,
+    autocastDtype: torch.dtype | None,
+    width: int,
+    height: int,
+    tilePad: int,
+) -> tuple[int, dict]:
+    """
+    Times one tile of every candidate size, and returns the size with the fastest whole frame (time per tile x tiles per frame), along with the frame times.
+    Sizes over half the free memory are skipped, and sizes that run out of memory anyway.
+    Stops early once smaller tiles get slower.
+    """
+    budget = availableMemory(device) // 2
+    bestTilesize, bestTime = None, math.inf
+    frameTimes = {}
+    for tilesize, tileWidth, tileHeight in tileCandidates(
+        width, height, scale, tilePad, sizeRequirements
+    ):
+        if estimatedBytes(tileWidth, tileHeight, scale, dtype) > budget:
+            log(f"Tile probe: {tileWidth}x{tileHeight} is over the memory budget")
+            continue
+        try:
+            tileTime = timeModel(
+                model, device, dtype, autocastDtype, tileWidth, tileHeight
+            )
+        except (torch.cuda.OutOfMemoryError, RuntimeError) as e:
+            log(f"Tile probe: {tileWidth}x{tileHeight} failed: {e}")
+            emptyCache(device)
+            continue
+        frameTime = (
+            tileTime
+            if tilesize == 0
+            else tileTime * tileCount(width, height, tileWidth, 2 * tilePad)
+        )
+        frameTimes[str(tilesize)] = frameTime
+        log(
+            f"Tile probe: {tileWidth}x{tileHeight} tiles, {round(frameTime * 1000, 1)}ms per frame"
+        )
+        if frameTime < bestTime:
+            bestTilesize, bestTime = tilesize, frameTime
+        elif frameTime > bestTime * 1.05 and tilesize != 0:
+            break
+    emptyCache(device)
+    if bestTilesize is None:
+        raise RuntimeError(
+            f"No tile size fits in memory for {width}x{height}, try a smaller --tilesize"
+        )
+    return bestTilesize, frameTimes
+
+
+def autoTileSize(
+    modelPath: str,
+    device: torch.device,
+    dtype: torch.dtype,
+    autocastDtype: torch.dtype | None,
+    width: int,
+    height: int,
+    tilePad: int,
+) -> int:
+    """
+    The fastest tile size for the model on the device, 0 for whole frames.
+    The probe runs the eager model (tensorrt and torch.compile follow the same trends) and is cached per model, device, precision and resolution.
+    """
+    key = tileCacheKey(modelPath, device, dtype, width, height, tilePad)
+    cached = loadTileCache().get(key)
+    if cached is not None:
+        log(f"Using the cached tile size {cached['tilesize']} for {key}")
+        return cached["tilesize"]
+    printAndLog("Probing tile sizes, this only happens once per model and resolution")
+    model, scale, sizeRequirements = loadProbeModel(modelPath, device, dtype)
+    tilesize, frameTimes = probeTileSize(
+        model,
+        scale,
+        sizeRequirements,
+        device,
+        dtype,
+        autocastDtype,
+        width,
+        height,
+        tilePad,
+    )
+    del model
+    emptyCache(device)
+    saveTileSize(key, tilesize, frameTimes)
+    printAndLog(
+        f"Using a tile size of {tilesize if tilesize else 'the whole frame'} ({round(frameTimes[str(tilesize)] * 1000, 1)}ms per frame in probe)"
+    )
+    return tilesize
@@ -0,0 +1,116 @@
+import numpy as np
+
+
+def tilePositions(length: int, window: int, overlap: int) -> list[int]:
+    """
+    Start positions of fixed size windows covering 0..length, neighbours overlap by at least overlap.
+    The last window is shifted back inside the image instead of running over the edge, so every window has the same size.
+    """
+    if window >= length:
+        return [0]
+    stride = max(1, window - overlap)
+    positions = list(range(0, length - window, stride))
+    positions.append(length - window)
+    return positions
+
+
+def featherRamp(length: int) -> np.ndarray:
+    """
+    Rising weights over an overlap of length pixels.
+    The outer quarter stays at 0, as the border of a tile is where models produce the most artifacts, the middle half ramps up linearly.
+    """
+    margin = length // 4
+    rampLength = length - 2 * margin
+    return np.clip(
+        (np.arange(length, dtype=np.float32) - margin + 0.5) / rampLength, 0.0, 1.0
+    )
+
+
+def featherWeights(
+    positions: list[int], window: int, length: int, scale: int
+) -> list[np.ndarray]:
+    """
+    Per window blending weights along one axis, at output resolution.
+    Weights ramp up over the part a window shares with its neighbours, and are normalized so every output pixel adds up to 1.
+    """
+    window = min(window, length)
+    outWindow = window * scale
+    weights = []
+    for i, start in enumerate(positions):
+        weight = np.ones(outWindow, dtype=np.float32)
+        if i > 0:
+            left = (positions[i - 1] + window - start) * scale
+            if left > 0:
+                weight[:left] = featherRamp(left)
+        if i < len(positions) - 1:
+            right = (start + window - positions[i + 1]) * scale
+            if right > 0:
+                weight[outWindow - right :] = np.minimum(
+                    weight[outWindow - right :], featherRamp(right)[::-1]
+                )
+        weights.append(weight)
+
+    total = np.zeros(length * scale, dtype=np.float32)
+    for start, weight in zip(positions, weights):
+        total[start * scale : start * scale + outWindow] += weight
+    return [
+        weight / total[start * scale : start * scale + outWindow]
+        for start, weight in zip(positions, weights)
+    ]
+
+
+class TileLayout:
+    """
+    Splits a frame into overlapping tiles that all have the same shape, so compiled models and engines only ever see one input size.
+    If the frame is smaller than a tile along an axis, there is a single tile along it that has to be padded up to the tile size.
+
+    Args:
+        width (int): Width of the frame.
+        height (int): Height of the frame.
+        tileWidth (int): Width of every tile, including the overlap.
+        tileHeight (int): Height of every tile, including the overlap.
+        overlap (int): Minimum overlap between neighbouring tiles, blended with feathered weights. 0 gives hard seams.
+        scale (int): Upscale factor of the model.
+
+    Attributes:
+        tiles (list[tuple[int, int, int, int]]): (x, y, column, row) of every tile, in row major order.
+        columnWeights/rowWeights: normalized blending weights at output resolution per column/row, the weight of a tile is rowWeight x columnWeight.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        tileWidth: int,
+        tileHeight: int,
+        overlap: int,
+        scale: int,
+    ):
+        self.width = width
+        self.height = height
+        self.tileWidth = tileWidth
+        self.tileHeight = tileHeight
+        # a window has to move forward by at least half of itself
+        self.overlap = max(0, min(overlap, tileWidth // 2, tileHeight // 2))
+        self.scale = scale
+        self.columns = tilePositions(width, tileWidth, self.overlap)
+        self.rows = tilePositions(height, tileHeight, self.overlap)
+        self.columnWeights = featherWeights(self.columns, tileWidth, width, scale)
+        self.rowWeights = featherWeights(self.rows, tileHeight, height, scale)
+        self.tiles = [
+            (x, y, column, row)
+            for row, y in enumerate(self.rows)
+            for column, x in enumerate(self.columns)
+        ]
+        # only happens when the frame is smaller than a tile
+        self.padRight = max(0, tileWidth - width)
+        self.padBottom = max(0, tileHeight - height)
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def tileSize(self) -> tuple[int, int]:
+        """
+        (width, height) of the part of a tile that lies inside the frame
+        """
+        return min(self.tileWidth, self.width), min(self.tileHeight, self.height)
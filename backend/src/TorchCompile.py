@@ -0,0 +1,165 @@
+import os
+from contextlib import nullcontext
+from queue import Queue
+from threading import Thread, Lock
+
+import torch
+
+from .EngineCache import EngineCache
+from .TorchDevice import createStream, streamContext, synchronize
+from .Util import log, printAndLog, warnAndLog, modelsDirectory
+
+
+def compileCacheDirectory() -> str:
+    return os.path.join(modelsDirectory(), "torch_compile")
+
+
+# inductor reads this when it first compiles, so kernels and fx graphs from earlier runs are found again
+os.environ.setdefault(
+    "TORCHINDUCTOR_CACHE_DIR", os.path.join(compileCacheDirectory(), "inductor")
+)
+
+# only one model compiles at a time, compiling is already multithreaded and the cache artifacts are process wide
+compileLock = Lock()
+
+
+def inputKey(args: tuple) -> tuple:
+    """
+    What the compiled graph guards on for the inputs, calls with a different key would recompile
+    """
+    return tuple(
+        (tuple(arg.shape), arg.stride(), arg.dtype, arg.device)
+        for arg in args
+        if isinstance(arg, torch.Tensor)
+    )
+
+
+class BackgroundCompile:
+    """
+    Runs a model eagerly while torch.compile builds it in a background thread, then swaps the compiled model in.
+    Every new set of input shapes is compiled and warmed up in the background first, calls only go to the compiled model for shapes that are done, so nothing compiles while frames are waiting.
+    Compiled artifacts are saved for each model and shape, if they were saved by an earlier run, the first shape is compiled before the first frame instead (quick with the cache), so the render starts compiled.
+
+    Args:
+        model (torch.nn.Module): The eager model.
+        cacheName (str): Name of the saved artifacts, should include the model, the shape and the dtype.
+        device (torch.device): Device the model is on.
+        context (callable, optional): Returns the context the model is called in (autocast), the warm up has to run in the same one. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        model: torch.nn.Module,
+        cacheName: str,
+        device: torch.device,
+        context=None,
+    ):
+        self.eager = model
+        self.device = device
+        self.context = context if context is not None else nullcontext
+        self.cacheName = cacheName
+        self.cachePath = os.path.join(
+            compileCacheDirectory(), f"{cacheName}_torch-{torch.__version__}.bin"
+        )
+        self.compiled = torch.compile(model, backend="inductor", dynamic=False)
+        # replaced, never modified, so the render threads always see a whole set
+        self.ready = frozenset()
+        self.queued = set()
+        self.failed = False
+        self.queue = Queue()
+        self.startCompiled = self.loadArtifacts()
+        Thread(target=self.compileThread, daemon=True).start()
+
+    def loadArtifacts(self) -> bool:
+        if not os.path.isfile(self.cachePath) or not hasattr(
+            torch.compiler, "load_cache_artifacts"
+        ):
+            return False
+        try:
+            with open(self.cachePath, "rb") as f:
+                torch.compiler.load_cache_artifacts(f.read())
+            log(f"Loaded torch.compile artifacts from {self.cachePath}")
+            self.recordUse()
+            return True
+        except Exception as e:
+            log(f"Unable to load torch.compile artifacts: {e}")
+            return False
+
+    def saveArtifacts(self):
+        if not hasattr(torch.compiler, "save_cache_artifacts"):
+            return
+        try:
+            artifacts = torch.compiler.save_cache_artifacts()
+            if artifacts is None:
+                return
+            os.makedirs(compileCacheDirectory(), exist_ok=True)
+            with open(self.cachePath, "wb") as f:
+                f.write(artifacts[0])
+            log(f"Saved torch.compile artifacts to {self.cachePath}")
+            self.recordUse()
+        except Exception as e:
+            log(f"Unable to save torch.compile artifacts: {e}")
+
+    def recordUse(self):
+        EngineCache().use(
+            self.cachePath,
+            "torch_compile",
+            {"model": self.cacheName, "torch": torch.__version__},
+        )
+
+    @torch.inference_mode()
+    def warmUp(self, args: tuple):
+        """
+        Compiles for the shapes of args, runs on its own stream so it doesn't hold up the eager frames
+        """
+        stream = createStream(self.device)
+        with compileLock, streamContext(stream), self.context():
+            self.compiled(*args)
+            self.compiled(*args)
+        synchronize(stream)
+        self.saveArtifacts()
+
+    def compileThread(self):
+        while True:
+            key, args = self.queue.get()
+            try:
+                self.warmUp(args)
+            except Exception as e:
+                warnAndLog(f"torch.compile failed, staying in eager mode: {e}")
+                self.failed = True
+                return
+            self.ready = self.ready | {key}
+            printAndLog(
+                f"Switched to the compiled model for {[shape for shape, *_ in key]}"
+            )
+
+    def __call__(self, *args):
+        if self.failed:
+            return self.eager(*args)
+        key = inputKey(args)
+        if key in self.ready:
+            return self.compiled(*args)
+        if key not in self.queued:
+            self.queued.add(key)
+            if self.device.type == "cuda":
+                # once per shape, the inputs have to be ready before the warm up stream reads them
+                torch.cuda.current_stream(self.device).synchronize()
+            if self.startCompiled:
+                # cached, compiling here only takes a moment
+                self.startCompiled = False
+                try:
+                    self.warmUp(args)
+                    self.ready = self.ready | {key}
+                    return self.compiled(*args)
+                except Exception as e:
+                    warnAndLog(f"torch.compile failed, staying in eager mode: {e}")
+                    self.failed = True
+                    return self.eager(*args)
+            # copies, the caller may reuse its tensors before the compile gets to them
+            copies = tuple(
+                arg.clone() if isinstance(arg, torch.Tensor) else arg for arg in args
+            )
+            if self.device.type == "cuda":
+                torch.cuda.current_stream(self.device).synchronize()
+            self.queue.put((key, copies))
+        return self.eager(*args)
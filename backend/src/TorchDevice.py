@@ -0,0 +1,88 @@
+import gc
+from contextlib import nullcontext
+
+import torch
+
+from .Util import log, warnAndLog, check_cpu_bfloat16_support, check_bfloat16_support
+
+
+def resolveDevice(device="default") -> torch.device:
+    """
+    Turns the device setting into a torch device, default picks the first gpu and falls back to the cpu
+    """
+    if device == "default":
+        if torch.cuda.is_available():
+            return torch.device(
+                "cuda", 0
+            )  # 0 is the device index, may have to change later
+        return torch.device("cpu")
+    return torch.device(device)
+
+
+def createStream(device: torch.device):
+    """
+    Returns a cuda stream, or None on devices without streams
+    """
+    if device.type == "cuda":
+        return torch.cuda.Stream(device)
+    return None
+
+
+def streamContext(stream):
+    return torch.cuda.stream(stream) if stream is not None else nullcontext()
+
+
+def synchronize(stream):
+    if stream is not None:
+        stream.synchronize()
+
+
+def resolvePrecision(
+    precision: str, device: torch.device
+) -> tuple[torch.dtype, torch.dtype | None]:
+    """
+    Returns the dtype the model and tensors are stored in, and the dtype to autocast to (None for no autocast).
+    On the cpu the model stays in float32 and bfloat16 is done through autocast, as most cpu kernels only have float32 and bfloat16 versions.
+    int8 upscale models are quantized separately (see Quantize.py) and take float32 in and out, anything else runs in float.
+    """
+    if precision == "int8":
+        precision = "float32" if device.type != "cuda" else "auto"
+    if device.type != "cuda":
+        if precision == "float16":
+            warnAndLog("Float16 is not supported on the cpu, using float32")
+        if precision == "bfloat16" or (
+            precision == "auto" and check_cpu_bfloat16_support()
+        ):
+            log("Using bfloat16 autocast on the cpu")
+            return torch.float32, torch.bfloat16
+        return torch.float32, None
+    if precision == "auto":
+        return (torch.float16 if check_bfloat16_support() else torch.float32), None
+    if precision == "float16":
+        return torch.float16, None
+    if precision == "bfloat16":
+        return torch.bfloat16, None
+    return torch.float32, None
+
+
+def autocastContext(device: torch.device, dtype: torch.dtype | None):
+    if dtype is None:
+        return nullcontext()
+    return torch.autocast(device_type=device.type, dtype=dtype)
+
+
+def prepareModel(model: torch.nn.Module, device: torch.device) -> torch.nn.Module:
+    """
+    Convolutions on the cpu are faster with channels last, frames coming from hwc buffers are already laid out like that
+    """
+    if device.type == "cpu":
+        model = model.to(memory_format=torch.channels_last)
+    return model
+
+
+def emptyCache(device: torch.device):
+    gc.collect()
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+        torch.cuda.reset_max_memory_allocated()
+        torch.cuda.reset_max_memory_cached()
@@ -1,7 +1,7 @@
 import numpy as np
 import os
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
-import math
 
 try:
     from upscale_ncnn_py import UPSCALE
@@ -74,6 +74,7 @@ class UpscaleNCNN:
         height: int = 1080,
         tilesize: int = 0,
         tilePad=10,
+        tileWorkers: int = 2,
     ):
         # only import if necessary
         self.pad_w = tilePad
@@ -96,13 +97,45 @@ class UpscaleNCNN:
         self.tile_pad = tilePad
         self.mean_vals = []
         self.norm_vals = [1 / 255.0, 1 / 255.0, 1 / 255.0]
+        self.tileWorkers = max(1, tileWorkers)
+        if tilesize != 0 and method == "ncnn_vulkan":
+            self.tiles = self.tileGrid()
+            self.tilePool = ThreadPoolExecutor(max_workers=self.tileWorkers)
         self._load()
 
+    def tileGrid(self) -> list[tuple]:
+        """
+        (x0, y0, x1, y1) of every tile, and the same with tilePad pixels of context added, clipped to the frame
+        """
+        tiles = []
+        for y0 in range(0, self.height, self.tilesize):
+            for x0 in range(0, self.width, self.tilesize):
+                x1 = min(x0 + self.tilesize, self.width)
+                y1 = min(y0 + self.tilesize, self.height)
+                tiles.append(
+                    (
+                        x0,
+                        y0,
+                        x1,
+                        y1,
+                        max(x0 - self.tilePad, 0),
+                        max(y0 - self.tilePad, 0),
+                        min(x1 + self.tilePad, self.width),
+                        min(y1 + self.tilePad, self.height),
+                    )
+                )
+        return tiles
+
     def _load(self):
         if method == "ncnn_vulkan":
             self.net = ncnn.Net()
-            # Use vulkan compute
-            self.net.opt.use_vulkan_compute = True
+            # Use vulkan compute, cpu only builds of ncnn and machines without vulkan run on the cpu
+            self.net.opt.use_vulkan_compute = ncnn.get_gpu_count() > 0
+            if self.tilesize != 0 and not self.net.opt.use_vulkan_compute:
+                # tiles run in parallel, each with a share of the cores
+                self.net.opt.num_threads = max(
+                    1, (os.cpu_count() or 1) // self.tileWorkers
+                )
 
             # Load model param and bin
             self.net.load_param(self.modelPath + ".param")
@@ -167,74 +200,48 @@ class UpscaleNCNN:
         elif method == "upscale_ncnn_py":
             return self.net.process_bytes(imageChunk, self.width, self.height, 3)
 
-    def renderTiledImage(self, img: np.ndarray):
-        raise NotImplementedError(
-            "Tile rendering not implemented for default ncnn fallback, please install vcredlist from https://learn.microsoft.com/en-us/cpp/windows/latest-supported-vc-redist?view=msvc-170"
+    def renderTile(self, img: np.ndarray, output: np.ndarray, tile: tuple):
+        """
+        Upscales a tile with tilePad pixels of context around it (less at the frame edges), and writes the part without the context into output
+        """
+        x0, y0, x1, y1, padX0, padY0, padX1, padY1 = tile
+        # extractors cache every blob they computed, so a reused one would return the last tile, they're cheap to make
+        extractor = self.net.create_extractor()
+        mat = ncnn.Mat.from_pixels_roi(
+            img,
+            ncnn.Mat.PixelType.PIXEL_BGR,
+            self.width,
+            self.height,
+            padX0,
+            padY0,
+            padX1 - padX0,
+            padY1 - padY0,
+        )
+        self.NormalizeImage(mat=mat, norm_vals=self.norm_vals)
+        extractor.input("data", mat)
+        ret, mat = extractor.extract("output")
+        scale = self.scale
+        tileOutput = np.asarray(mat)[
+            :,
+            (y0 - padY0) * scale : (y1 - padY0) * scale,
+            (x0 - padX0) * scale : (x1 - padX0) * scale,
+        ]
+        # same conversion as procNCNNVk, the assignment truncates to uint8
+        output[y0 * scale : y1 * scale, x0 * scale : x1 * scale] = self.ClampNPArray(
+            tileOutput.transpose(1, 2, 0) * 255
         )
-        """It will first crop input images to tiles, and then process each tile.
-        Finally, all the processed tiles are merged into one images.
 
-        Modified from: https://github.com/ata4/esrgan-launcher
+    def renderTiledImage(self, img: np.ndarray) -> np.ndarray:
+        """
+        Upscales the frame in tiles of tilesize, each with tilePad pixels of context from its neighbours that is cropped off again.
+        Tiles are rendered in parallel, and written straight into the output frame.
         """
-        img = img.reshape(3, self.height, self.width)
-        channel, height, width = img.shape
-        output_height = height * self.scale
-        output_width = width * self.scale
-        output_shape = (channel, output_height, output_width)
-
-        # start with black image
-        self.output = np.zeros(output_shape, dtype=img.dtype)
-        tiles_x = math.ceil(width / self.tile_size)
-        tiles_y = math.ceil(height / self.tile_size)
-
-        # loop over all tiles
-        for y in range(tiles_y):
-            for x in range(tiles_x):
-                # extract tile from input image
-                ofs_x = x * self.tile_size
-                ofs_y = y * self.tile_size
-                # input tile area on total image
-                input_start_x = ofs_x
-                input_end_x = min(ofs_x + self.tile_size, width)
-                input_start_y = ofs_y
-                input_end_y = min(ofs_y + self.tile_size, height)
-
-                # input tile area on total image with padding
-                input_start_x_pad = max(input_start_x - self.tile_pad, 0)
-                input_end_x_pad = min(input_end_x + self.tile_pad, width)
-                input_start_y_pad = max(input_start_y - self.tile_pad, 0)
-                input_end_y_pad = min(input_end_y + self.tile_pad, height)
-
-                # input tile dimensions
-                input_tile_width = input_end_x - input_start_x
-                input_tile_height = input_end_y - input_start_y
-                tile_idx = y * tiles_x + x + 1
-                input_tile = img[
-                    :,
-                    input_start_y_pad:input_end_y_pad,
-                    input_start_x_pad:input_end_x_pad,
-                ]
-
-                # upscale tile
-                output_tile = self.procNCNNVk(input_tile).transpose(2, 0, 1)
-                # output tile area on total image
-                output_start_x = input_start_x * self.scale
-                output_end_x = input_end_x * self.scale
-                output_start_y = input_start_y * self.scale
-                output_end_y = input_end_y * self.scale
-
-                # output tile area without padding
-                output_start_x_tile = (input_start_x - input_start_x_pad) * self.scale
-                output_end_x_tile = output_start_x_tile + input_tile_width * self.scale
-                output_start_y_tile = (input_start_y - input_start_y_pad) * self.scale
-                output_end_y_tile = output_start_y_tile + input_tile_height * self.scale
-
-                # put tile into output image
-                self.output[
-                    :, output_start_y:output_end_y, output_start_x:output_end_x
-                ] = output_tile[
-                    :,
-                    output_start_y_tile:output_end_y_tile,
-                    output_start_x_tile:output_end_x_tile,
-                ]
-        return self.output
+        output = np.empty(
+            (self.height * self.scale, self.width * self.scale, 3), dtype=np.uint8
+        )
+        list(
+            self.tilePool.map(
+                lambda tile: self.renderTile(img, output, tile), self.tiles
+            )
+        )
+        return output
@@ -1,20 +1,48 @@
-import onnx
+import numpy as np
 import onnxruntime as ort
 from onnxruntime import InferenceSession
-from onnxconverter_common import float16
-import os
-import numpy as np
-from .Util import checkForDirectMLHalfPrecisionSupport
+from threading import Lock
+from time import sleep
+from .Util import checkForDirectMLHalfPrecisionSupport, log, printAndLog
 
+# element types onnx reports for model inputs
+ONNX_TYPES = {"tensor(float)": np.float32, "tensor(float16)": np.float16}
 
-def getONNXScale(modelPath: str = "") -> int:
-    paramName = os.path.basename(modelPath).lower()
-    for i in range(100):
-        if f"{i}x" in paramName or f"x{i}" in paramName:
-            return i
+
+def parseProviders(providers: str, deviceID: int = 0) -> list:
+    """
+    Turns a comma separated list of execution providers into what onnxruntime takes, ex: CUDAExecutionProvider,CPUExecutionProvider
+    """
+    parsed = []
+    for provider in providers.split(","):
+        provider = provider.strip()
+        if not provider:
+            continue
+        if provider in ("DmlExecutionProvider", "CUDAExecutionProvider"):
+            parsed.append((provider, {"device_id": str(deviceID)}))
+        else:
+            parsed.append(provider)
+    return parsed
 
 
 class UpscaleONNX:
+    """
+    Upscales with onnxruntime on any execution provider, the cpu one by default.
+    Frames go through preallocated buffers bound to the session with io binding, so a frame doesn't allocate anything but the returned array.
+
+    Args:
+        modelPath (str): Path to the .onnx model.
+        deviceID (int, optional): Device for gpu providers. Defaults to 0.
+        precision (str, optional): auto/float16/float32, float16 converts a float32 model. Defaults to "float32".
+        width (int, optional): Width of the input frames. Defaults to 1920.
+        height (int, optional): Height of the input frames. Defaults to 1080.
+        providers (list, optional): Execution providers in order of preference. Defaults to ["CPUExecutionProvider"].
+        intraOpThreads (int, optional): Threads used inside an op, 0 lets onnxruntime decide. Defaults to 0.
+        interOpThreads (int, optional): Threads used to run independent ops at once, 0 lets onnxruntime decide. Defaults to 0.
+        bufferCount (int, optional): Input buffers, has to cover every frame waiting between bytesToFrame and renderTensor. Defaults to 4.
+        shapeBuckets (ShapeBuckets, optional): Pads frames up to a bucket size, or up to the model's size if it only takes one, and crops the output. Defaults to None.
+    """
+
     def __init__(
         self,
         modelPath,
@@ -22,72 +50,195 @@ class UpscaleONNX:
         precision: str = "float32",
         width: int = 1920,
         height: int = 1080,
+        providers: list = None,
+        intraOpThreads: int = 0,
+        interOpThreads: int = 0,
+        bufferCount: int = 4,
+        shapeBuckets=None,
     ):
         self.width = width
         self.height = height
         self.modelPath = modelPath
         self.deviceID = deviceID
-        self.i0 = None
+        self.providers = (
+            providers if providers is not None else ["CPUExecutionProvider"]
+        )
+        self.intraOpThreads = intraOpThreads
+        self.interOpThreads = interOpThreads
+        self.bufferCount = bufferCount
+        self.shapeBuckets = shapeBuckets
         self.precision = self.handlePrecision(precision)
-        self.model = self.loadModel()
-        self.inferenceSession = self.loadInferenceSession()
+        self.lock = Lock()
+        self.bufferLock = Lock()
+        self._load()
 
-    def getScale(self) -> int:
-        self.scale = getONNXScale(self.modelPath)
-        return self.scale
+    def providerNames(self) -> list[str]:
+        return [
+            provider[0] if isinstance(provider, tuple) else provider
+            for provider in self.providers
+        ]
 
     def handlePrecision(self, precision):
         if precision == "auto":
-            return np.float16 if checkForDirectMLHalfPrecisionSupport() else np.float32
+            if "DmlExecutionProvider" in self.providerNames():
+                return (
+                    np.float16 if checkForDirectMLHalfPrecisionSupport() else np.float32
+                )
+            return np.float32
         if precision == "float16":
             return np.float16
-        if precision == "float32":
-            return np.float32
+        return np.float32
+
+    def _load(self):
+        self.inferenceSession = self.loadInferenceSession()
+        modelInput = self.inferenceSession.get_inputs()[0]
+        self.inputName = modelInput.name
+        self.outputName = self.inferenceSession.get_outputs()[0].name
+        # a float32 model stays float32 unless float16 was asked for, so go by what the session actually takes
+        self.dtype = ONNX_TYPES.get(modelInput.type, np.float32)
+        self.inputWidth, self.inputHeight = self.readInputSize()
+        self.scale = self.readScale()
+        self.inputBuffers = [
+            np.zeros((1, 3, self.inputHeight, self.inputWidth), dtype=self.dtype)
+            for _ in range(self.bufferCount)
+        ]
+        self.nextBuffer = 0
+        self.outputBuffer = np.zeros(
+            (1, 3, self.inputHeight * self.scale, self.inputWidth * self.scale),
+            dtype=self.dtype,
+        )
+        self.ioBinding = self.inferenceSession.io_binding()
+        self.ioBinding.bind_ortvalue_output(
+            self.outputName, ort.OrtValue.ortvalue_from_numpy(self.outputBuffer)
+        )
+
+    def readInputSize(self) -> tuple[int, int]:
+        """
+        The size frames are padded to, the model's own if it has a static shape, otherwise the shape bucket
+        """
+        inputShape = self.inferenceSession.get_inputs()[0].shape
+        if isinstance(inputShape[2], int) and isinstance(inputShape[3], int):
+            modelHeight, modelWidth = inputShape[2:]
+            fits = modelWidth >= self.width and modelHeight >= self.height
+            if (modelWidth, modelHeight) != (self.width, self.height) and (
+                self.shapeBuckets is None or not fits
+            ):
+                raise ValueError(
+                    f"The model only takes {modelWidth}x{modelHeight} frames, the video is {self.width}x{self.height}"
+                )
+            return modelWidth, modelHeight
+        if self.shapeBuckets is not None:
+            return self.shapeBuckets.bucket(self.width, self.height)
+        return self.width, self.height
+
+    def readScale(self) -> int:
+        """
+        Scale from the graph's output shape, or from one inference if the shapes are dynamic
+        """
+        outputShape = self.inferenceSession.get_outputs()[0].shape
+        if isinstance(outputShape[2], int):
+            scale = outputShape[2] // self.inputHeight
+        else:
+            probe = np.zeros(
+                (1, 3, self.inputHeight, self.inputWidth), dtype=self.dtype
+            )
+            output = self.inferenceSession.run(
+                [self.outputName], {self.inputName: probe}
+            )[0]
+            scale = output.shape[2] // self.inputHeight
+        log(f"ONNX model scale: {scale}")
+        return scale
+
+    def getScale(self) -> int:
+        return self.scale
 
-    def bytesToFrame(self, image: bytes) -> tuple:
-        image = np.frombuffer(image, dtype=np.uint8).reshape(1080, 1920, 3)
-        image = np.transpose(image, (2, 0, 1))
-        image = np.expand_dims(image, axis=0)
-        image = image.astype(self.precision)
-        image = image.__mul__(1.0 / 255.0)
-        return np.ascontiguousarray(image)
-
-    def renderTensor(self, image_as_np_array: np.ndarray) -> np.ndarray:
-        onnx_input = {self.inferenceSession.get_inputs()[0].name: image_as_np_array}
-        onnx_output = self.inferenceSession.run(None, onnx_input)[0]
-        return self.frameToBytes(onnx_output)
-
-    def frameToBytes(self, image: np.ndarray) -> bytes:
-        image = (
-            image.clip(0, 1)
-            .squeeze()
-            .transpose(1, 2, 0)
-            .__mul__(255.0)
-            .astype(np.uint8)
+    def bytesToFrame(self, image: bytes) -> np.ndarray:
+        """
+        Normalizes a frame into the next input buffer
+        """
+        frame = np.frombuffer(image, dtype=np.uint8).reshape(self.height, self.width, 3)
+        with self.bufferLock:
+            # paused, the buffers come back with hotReload
+            while self.inputBuffers is None:
+                sleep(1)
+            buffer = self.inputBuffers[self.nextBuffer]
+            self.nextBuffer = (self.nextBuffer + 1) % self.bufferCount
+        np.multiply(
+            frame.transpose(2, 0, 1),
+            self.dtype(1 / 255),
+            out=buffer[0, :, : self.height, : self.width],
+            casting="unsafe",
         )
-        return np.ascontiguousarray(image).tobytes()
+        if (self.inputWidth, self.inputHeight) != (self.width, self.height):
+            self.shapeBuckets.fillPadding(buffer, self.width, self.height)
+        return buffer
+
+    def renderTensor(self, image: np.ndarray) -> np.ndarray:
+        with self.lock:
+            # paused, _load binds the output last, so the session is complete once it's set
+            while self.ioBinding is None:
+                sleep(1)
+            self.ioBinding.bind_ortvalue_input(
+                self.inputName, ort.OrtValue.ortvalue_from_numpy(image)
+            )
+            self.inferenceSession.run_with_iobinding(self.ioBinding)
+            return self.frameToBytes(self.outputBuffer)
+
+    def frameToBytes(self, image: np.ndarray) -> np.ndarray:
+        """
+        Converts the output in place, only the returned uint8 frame is new
+        """
+        image = image[0, :, : self.height * self.scale, : self.width * self.scale]
+        np.clip(image, 0, 1, out=image)
+        np.multiply(image, 255, out=image)
+        return np.ascontiguousarray(image.transpose(1, 2, 0), dtype=np.uint8)
+
+    def renderFrame(self, frame) -> np.ndarray:
+        return self.renderTensor(self.bytesToFrame(frame))
 
     def loadModel(self):
+        import onnx
+
         model = onnx.load(self.modelPath)
         if self.precision == np.float16:
+            from onnxconverter_common import float16
+
             model = float16.convert_float_to_float16(model)
         return model
 
     def loadInferenceSession(self) -> InferenceSession:
-        directml_backend = [
-            ("DmlExecutionProvider", {"device_id": f"{  self.deviceID }"})
-        ]
-
         session_options = ort.SessionOptions()
         session_options.graph_optimization_level = (
             ort.GraphOptimizationLevel.ORT_ENABLE_ALL
         )
+        if self.intraOpThreads > 0:
+            session_options.intra_op_num_threads = self.intraOpThreads
+        if self.interOpThreads > 0:
+            session_options.inter_op_num_threads = self.interOpThreads
+            if self.interOpThreads > 1:
+                session_options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        if self.precision == np.float16:
+            model = self.loadModel().SerializeToString()
+        else:
+            # no need to load the model in python if it isn't converted
+            model = self.modelPath
         inference_session = InferenceSession(
-            self.model.SerializeToString(), session_options, providers=directml_backend
+            model, session_options, providers=self.providers
+        )
+        printAndLog(
+            f"Using ONNX Runtime providers: {inference_session.get_providers()}"
         )
-
         return inference_session
 
+    def hotUnload(self):
+        """
+        Waits for the frame being rendered, frames after it wait in renderTensor until hotReload
+        """
+        with self.lock, self.bufferLock:
+            self.inferenceSession = None
+            self.ioBinding = None
+            self.inputBuffers = None
+            self.outputBuffer = None
 
-if __name__ == "__main__":
-    UpscaleONNX("2x_ModernSpanimationV1.pth_op17_torch.float32.onnx").setProvider()
+    def hotReload(self):
+        self._load()
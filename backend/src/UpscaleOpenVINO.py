@@ -0,0 +1,223 @@
+import os
+from queue import Queue
+
+import numpy as np
+import openvino as ov
+
+from .EngineCache import EngineCache
+from .Util import log, printAndLog, modelsDirectory
+
+# what --precision maps to for the cpu plugin, auto lets openvino pick (bf16 on xeons with amx)
+PRECISION_HINTS = {"float32": "f32", "float16": "f16"}
+
+
+def openvinoCacheDirectory() -> str:
+    return os.path.join(modelsDirectory(), "openvino")
+
+
+def convertedModelPath(modelPath: str, width: int, height: int) -> str:
+    """
+    Where the converted model is kept, keyed on the model file's contents and the input shape
+    """
+    from .ExportONNX import fileHash
+
+    name = os.path.splitext(os.path.basename(modelPath))[0]
+    return os.path.join(
+        openvinoCacheDirectory(),
+        f"{name}_{width}x{height}_{fileHash(modelPath)[:16]}_ov-{ov.get_version().split('-')[0]}.xml",
+    )
+
+
+def readOrConvertModel(modelPath: str, width: int, height: int, convert) -> ov.Model:
+    """
+    Reads .onnx models directly, anything else goes through convert() once and is cached as openvino IR.
+    convert returns the pytorch module and an example input for it.
+    """
+    core = ov.Core()
+    if modelPath.endswith(".onnx"):
+        return core.read_model(modelPath)
+    cachePath = convertedModelPath(modelPath, width, height)
+    cacheKey = {
+        "model": os.path.basename(modelPath),
+        "shape": f"{width}x{height}",
+        "openvino": ov.get_version().split("-")[0],
+    }
+    if os.path.isfile(cachePath):
+        log(f"Loading converted openvino model from {cachePath}")
+        EngineCache().use(cachePath, "openvino", cacheKey)
+        return core.read_model(cachePath)
+    printAndLog(
+        "Converting the model to openvino, this only happens once per model and size"
+    )
+    module, exampleInput = convert()
+    model = ov.convert_model(module, example_input=exampleInput)
+    os.makedirs(openvinoCacheDirectory(), exist_ok=True)
+    # weights stay float32, the precision hint decides what the cpu actually computes in
+    ov.save_model(model, cachePath, compress_to_fp16=False)
+    EngineCache().use(cachePath, "openvino", cacheKey)
+    return model
+
+
+def compileModel(
+    model: ov.Model, precision: str, threads: int = 0, device: str = "CPU"
+) -> ov.CompiledModel:
+    """
+    Compiles for throughput, so several infer requests can run at once on different cores.
+    Compiled blobs are cached by openvino, next to the converted models, for every model, shape and precision.
+    """
+    core = ov.Core()
+    core.set_property({"CACHE_DIR": openvinoCacheDirectory()})
+    config = {"PERFORMANCE_HINT": "THROUGHPUT"}
+    if precision in PRECISION_HINTS:
+        config["INFERENCE_PRECISION_HINT"] = PRECISION_HINTS[precision]
+    elif precision != "auto":
+        log(f"Precision {precision} is not supported by openvino, using auto")
+    if threads > 0:
+        config["INFERENCE_NUM_THREADS"] = threads
+    compiled = core.compile_model(model, device, config)
+    log(
+        f"OpenVINO compiled for {device}, optimal infer requests: {compiled.get_property('OPTIMAL_NUMBER_OF_INFER_REQUESTS')}"
+    )
+    return compiled
+
+
+class UpscaleOpenVINO:
+    """
+    Upscales with openvino, made for cpus without a gpu.
+    Several infer requests run at once, each upscale worker takes a free one, so the render should use as many upscale workers as inferRequests.
+    Every request has its own preallocated input, frames are converted straight into it once the worker has a request.
+
+    Args:
+        modelPath (str): spandrel .pth/.safetensors model, or an .onnx model.
+        precision (str, optional): auto/float16/float32. Defaults to "auto".
+        width (int, optional): Width of the input frames. Defaults to 1920.
+        height (int, optional): Height of the input frames. Defaults to 1080.
+        inferRequests (int, optional): Frames in flight, 0 uses what openvino thinks is optimal for the cpu. Defaults to 0.
+        threads (int, optional): Inference threads, 0 lets openvino decide. Defaults to 0.
+        shapeBuckets (ShapeBuckets, optional): Pads frames up to a bucket size, or up to the model's size if it only takes one, and crops the output. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        modelPath: str,
+        precision: str = "auto",
+        width: int = 1920,
+        height: int = 1080,
+        inferRequests: int = 0,
+        threads: int = 0,
+        shapeBuckets=None,
+    ):
+        self.modelPath = modelPath
+        self.precision = precision
+        self.width = width
+        self.height = height
+        self.threads = threads
+        self.shapeBuckets = shapeBuckets
+        self.inputWidth, self.inputHeight = (
+            shapeBuckets.bucket(width, height)
+            if shapeBuckets is not None
+            else (width, height)
+        )
+        self.requestedInferRequests = inferRequests
+        # kept across reloads, so frames waiting for a request during a pause get one of the reloaded ones.
+        # holds (request, input buffer) pairs
+        self.freeRequests = Queue()
+        self._load()
+
+    def convert(self):
+        import torch
+        from .spandrel import ModelLoader, ImageModelDescriptor
+
+        model = ModelLoader().load_from_file(self.modelPath)
+        assert isinstance(model, ImageModelDescriptor)
+        return model.model.eval().float(), torch.rand(
+            1, 3, self.inputHeight, self.inputWidth
+        )
+
+    def _load(self):
+        model = readOrConvertModel(
+            self.modelPath, self.inputWidth, self.inputHeight, self.convert
+        )
+        inputShape = model.inputs[0].get_partial_shape()
+        if inputShape.is_dynamic:
+            model.reshape([1, 3, self.inputHeight, self.inputWidth])
+        else:
+            modelHeight, modelWidth = inputShape.to_shape()[2:]
+            fits = modelWidth >= self.width and modelHeight >= self.height
+            if (modelWidth, modelHeight) != (self.width, self.height) and (
+                self.shapeBuckets is None or not fits
+            ):
+                raise ValueError(
+                    f"The model only takes {modelWidth}x{modelHeight} frames, the video is {self.width}x{self.height}"
+                )
+            self.inputWidth, self.inputHeight = modelWidth, modelHeight
+        self.compiledModel = compileModel(model, self.precision, self.threads)
+        self.scale = self.compiledModel.outputs[0].get_shape()[2] // self.inputHeight
+        log(f"OpenVINO model scale: {self.scale}")
+        self.inferRequests = (
+            self.requestedInferRequests
+            or self.compiledModel.get_property("OPTIMAL_NUMBER_OF_INFER_REQUESTS")
+        )
+        for _ in range(self.inferRequests):
+            request = self.compiledModel.create_infer_request()
+            inputBuffer = np.zeros(
+                (1, 3, self.inputHeight, self.inputWidth), dtype=np.float32
+            )
+            request.set_input_tensor(ov.Tensor(inputBuffer, shared_memory=True))
+            self.freeRequests.put((request, inputBuffer))
+
+    def getScale(self) -> int:
+        return self.scale
+
+    def bytesToFrame(self, image: bytes) -> np.ndarray:
+        """
+        Only views the bytes as an hwc array, renderTensor converts it into the input of the request it gets
+        """
+        return np.frombuffer(image, dtype=np.uint8).reshape(self.height, self.width, 3)
+
+    def writeInput(self, frame: np.ndarray, inputBuffer: np.ndarray):
+        np.multiply(
+            frame.transpose(2, 0, 1),
+            np.float32(1 / 255),
+            out=inputBuffer[0, :, : self.height, : self.width],
+        )
+        if (self.inputWidth, self.inputHeight) != (self.width, self.height):
+            self.shapeBuckets.fillPadding(inputBuffer, self.width, self.height)
+
+    def renderTensor(self, image: np.ndarray) -> np.ndarray:
+        request, inputBuffer = self.freeRequests.get()
+        try:
+            self.writeInput(image, inputBuffer)
+            request.start_async()
+            request.wait()
+            return self.frameToBytes(request.get_output_tensor().data)
+        finally:
+            self.freeRequests.put((request, inputBuffer))
+
+    def frameToBytes(self, image: np.ndarray) -> np.ndarray:
+        """
+        image is the request's own output, so it's converted into a new array before the request is reused
+        """
+        output = np.clip(
+            image[
+                0, :, : self.height * self.scale, : self.width * self.scale
+            ].transpose(1, 2, 0),
+            0,
+            1,
+        )
+        np.multiply(output, 255, out=output)
+        return output.astype(np.uint8)
+
+    def renderFrame(self, frame) -> np.ndarray:
+        return self.renderTensor(self.bytesToFrame(frame))
+
+    def hotUnload(self):
+        """
+        Takes back every infer request, which waits for the frames being rendered, frames after that wait for a request until hotReload
+        """
+        for _ in range(self.inferRequests):
+            self.freeRequests.get()
+        self.compiledModel = None
+
+    def hotReload(self):
+        self._load()
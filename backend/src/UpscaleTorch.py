@@ -7,10 +7,35 @@ import torch as torch
 import torch.nn.functional as F
 from time import sleep
 
+from .Tiling import TileLayout
+from .TileTuner import autoTileSize, paddingModulo
+from .Quantize import loadQuantizedModel
+from .EngineCache import EngineCache
+from .TorchCompile import BackgroundCompile
+from .FrameBuffers import (
+    TensorRing,
+    TransferRing,
+    recordReady,
+    waitReady,
+    normalizeFrame,
+    denormalizeFrame,
+)
+from .TorchDevice import (
+    resolveDevice,
+    resolvePrecision,
+    createStream,
+    streamContext,
+    synchronize,
+    autocastContext,
+    prepareModel,
+    emptyCache,
+)
 from src.Util import (
     currentDirectory,
     printAndLog,
-    check_bfloat16_support,
+    log,
+    warnAndLog,
+    availableMemory,
 )
 
 # tiling code permidently borrowed from https://github.com/chaiNNer-org/spandrel/issues/113#issuecomment-1907209731
@@ -22,13 +47,24 @@ class UpscalePytorch:
     Args:
         modelPath (str): The path to the model file.
         device (str, optional): The device to use for inference. Defaults to "default".
-        tile_pad (int, optional): The padding size for tiles. Defaults to 10.
-        precision (str, optional): The precision mode for the model. Defaults to "auto".
+        tile_pad (int, optional): The padding size for tiles, neighbouring tiles overlap by twice this and are blended. Defaults to 10.
+        tilesize (int | str, optional): Size of the tiles frames are upscaled in, 0 upscales whole frames, auto picks the fastest size that fits in memory with a short probe. Defaults to 0.
+        tileBatch (int, optional): The number of tiles run through the model at once, 0 sizes it from the free memory. Defaults to 0.
+        tileReuse (bool, optional): Only rerender tiles whose input (including the overlap) changed since they were last rendered, frames have to come in order. Defaults to False.
+        tileReuseThreshold (float, optional): Max difference (0-255) of a tile fingerprint for the tile to be reused, 0 only reuses tiles with the exact same input. Defaults to 0.
+        bufferCount (int, optional): The number of preallocated output frames, has to cover every frame waiting between render stages. Defaults to 4.
+        pipelineDepth (int, optional): The number of pinned staging buffers per direction, frames that can be uploading or downloading at once. Defaults to 3.
+        precision (str, optional): The precision mode for the model, int8 quantizes the model (cpu only). Defaults to "auto".
+        quantize (str, optional): How int8 models are quantized, static (calibrated, quantizes convolutions) or dynamic (linear layers only). Defaults to "static".
+        calibrationFrames (list[np.ndarray], optional): rgb frames from the video to calibrate static quantization with. Defaults to None.
         width (int, optional): The width of the input image. Defaults to 1920.
         height (int, optional): The height of the input image. Defaults to 1080.
-        backend (str, optional): The backend for inference. Defaults to "pytorch".
+        outputWidth (int, optional): Width the upscaled frames are resized to on the device before they are downloaded. Defaults to width * scale.
+        outputHeight (int, optional): Height the upscaled frames are resized to on the device before they are downloaded. Defaults to height * scale.
+        backend (str, optional): The backend for inference, pytorch-compile runs eagerly until torch.compile is done in the background. Defaults to "pytorch".
         trt_workspace_size (int, optional): The workspace size for TensorRT. Defaults to 0.
         trt_cache_dir (str, optional): The cache directory for TensorRT. Defaults to modelsDirectory().
+        shapeBuckets (ShapeBuckets, optional): Pads whole frames up to a bucket size, so engines and compiled models are shared between similar resolutions. Defaults to None.
 
     Attributes:
         tile_pad (int): The padding size for tiles.
@@ -40,7 +76,6 @@ class UpscalePytorch:
         scale (float): The scale factor of the model.
 
     Methods:
-        handlePrecision(precision): Handles the precision mode for the model.
         loadModel(modelPath, dtype, device): Loads the model from file.
         bytesToFrame(frame): Converts bytes to a torch tensor.
         tensorToNPArray(image): Converts a torch tensor to a NumPy array.
@@ -58,10 +93,20 @@ class UpscalePytorch:
         device="default",
         tile_pad: int = 10,
         precision: str = "auto",
+        quantize: str = "static",
+        calibrationFrames: list = None,
         width: int = 1920,
         height: int = 1080,
-        tilesize: int = 0,
+        outputWidth: int = None,
+        outputHeight: int = None,
+        tilesize: int | str = 0,
+        tileBatch: int = 0,
+        tileReuse: bool = False,
+        tileReuseThreshold: float = 0.0,
+        bufferCount: int = 4,
+        pipelineDepth: int = 3,
         backend: str = "pytorch",
+        shapeBuckets=None,
         # trt options
         trt_workspace_size: int = 0,
         trt_cache_dir: str = None,
@@ -69,25 +114,42 @@ class UpscalePytorch:
         trt_max_aux_streams: int | None = None,
         trt_debug: bool = False,
     ):
-        if device == "default":
-            if torch.cuda.is_available():
-                device = torch.device(
-                    "cuda", 0
-                )  # 0 is the device index, may have to change later
-            else:
-                device = torch.device("cpu")
-        else:
-            decice = torch.device(device)
+        device = resolveDevice(device)
         printAndLog("Using device: " + str(device))
         self.tile_pad = tile_pad
-        self.dtype = self.handlePrecision(precision)
         self.device = device
+        self.dtype, self.autocastDtype = resolvePrecision(precision, device)
+        self.int8 = precision == "int8" and device.type == "cpu"
+        if precision == "int8" and not self.int8:
+            warnAndLog("int8 is only supported on the cpu, using auto precision")
+        self.quantize = quantize
+        self.calibrationFrames = calibrationFrames
         self.videoWidth = width
         self.videoHeight = height
+        self.requestedOutputSize = (outputWidth, outputHeight)
+        if tilesize == "auto":
+            tilesize = autoTileSize(
+                modelPath,
+                device,
+                self.dtype,
+                self.autocastDtype,
+                width,
+                height,
+                tile_pad,
+            )
         self.tilesize = tilesize
         self.tile = [self.tilesize, self.tilesize]
+        self.tileBatch = tileBatch
+        self.tileBatchSize = None  # set on the first tiled frame
+        self.tileReuse = tileReuse and tilesize > 0
+        self.tileReuseThreshold = tileReuseThreshold
+        self.tilesRendered = 0
+        self.tilesReused = 0
+        self.bufferCount = bufferCount
+        self.pipelineDepth = pipelineDepth
         self.modelPath = modelPath
         self.backend = backend
+        self.shapeBuckets = shapeBuckets
         if trt_cache_dir is None:
             trt_cache_dir = os.path.dirname(
                 modelPath
@@ -98,25 +160,24 @@ class UpscalePytorch:
         self.trt_aux_streams = trt_max_aux_streams
         self.trt_debug = trt_debug
 
-        # streams
-        self.stream = torch.cuda.Stream()
-        self.prepareStream = torch.cuda.Stream()
+        # streams, None on the cpu
+        self.stream = createStream(self.device)
+        self.prepareStream = createStream(self.device)
+        self.outputStream = createStream(self.device)
         self._load()
 
     @torch.inference_mode()
     def _load(self):
-        with torch.cuda.stream(self.prepareStream):
+        with streamContext(self.prepareStream):
             model = self.loadModel(
                 modelPath=self.modelPath, device=self.device, dtype=self.dtype
             )
 
-            match self.scale:
-                case 1:
-                    modulo = 4
-                case 2:
-                    modulo = 2
-                case _:
-                    modulo = 1
+            modulo = paddingModulo(self.scale)
+            self.outputWidth = self.requestedOutputSize[0] or self.videoWidth * self.scale
+            self.outputHeight = (
+                self.requestedOutputSize[1] or self.videoHeight * self.scale
+            )
             if all(t > 0 for t in self.tile):
                 self.pad_w = (
                     math.ceil(
@@ -130,10 +191,93 @@ class UpscalePytorch:
                     )
                     * modulo
                 )
+                # neighbouring tiles share 2 * tile_pad pixels, which are blended together
+                self.tileLayout = TileLayout(
+                    width=self.videoWidth,
+                    height=self.videoHeight,
+                    tileWidth=self.pad_w,
+                    tileHeight=self.pad_h,
+                    overlap=2 * self.tile_pad,
+                    scale=self.scale,
+                )
+                self.columnWeights = [
+                    torch.from_numpy(weight).to(device=self.device, dtype=self.dtype)
+                    for weight in self.tileLayout.columnWeights
+                ]
+                self.rowWeights = [
+                    torch.from_numpy(weight)
+                    .to(device=self.device, dtype=self.dtype)
+                    .unsqueeze(-1)
+                    for weight in self.tileLayout.rowWeights
+                ]
+                self.tileOutputs = TensorRing(
+                    count=self.bufferCount,
+                    shape=(
+                        1,
+                        3,
+                        self.videoHeight * self.scale,
+                        self.videoWidth * self.scale,
+                    ),
+                    dtype=self.dtype,
+                    device=self.device,
+                )
+                if self.tileReuse:
+                    tileWidth, tileHeight = self.tileLayout.tileSize()
+                    # weighted output of every tile, and what its input looked like when it was rendered
+                    self.tileCache = torch.zeros(
+                        (
+                            len(self.tileLayout),
+                            3,
+                            tileHeight * self.scale,
+                            tileWidth * self.scale,
+                        ),
+                        dtype=self.dtype,
+                        device=self.device,
+                    )
+                    self.tileReference = None
+            elif self.shapeBuckets is not None:
+                self.pad_w, self.pad_h = self.shapeBuckets.bucket(
+                    self.videoWidth, self.videoHeight, modulo
+                )
             else:
                 self.pad_w = self.videoWidth
                 self.pad_h = self.videoHeight
 
+            self.inputTransfers = TransferRing(
+                count=self.pipelineDepth,
+                shape=(self.videoHeight, self.videoWidth, 3),
+                device=self.device,
+            )
+            # normalized frames, padded up to the bucket for whole frames, laid out like the hwc frames they come from
+            inputWidth, inputHeight = (
+                (self.videoWidth, self.videoHeight)
+                if self.tilesize
+                else (self.pad_w, self.pad_h)
+            )
+            self.inputFrames = TensorRing(
+                count=self.bufferCount,
+                shape=(1, 3, inputHeight, inputWidth),
+                dtype=self.dtype,
+                device=self.device,
+                memory_format=torch.channels_last,
+            )
+            self.outputTransfers = TransferRing(
+                count=self.pipelineDepth,
+                shape=(self.outputHeight, self.outputWidth, 3),
+                device=self.device,
+            )
+
+            if self.int8:
+                model = loadQuantizedModel(
+                    model,
+                    self.modelPath,
+                    self.pad_w,
+                    self.pad_h,
+                    mode=self.quantize,
+                    calibrationFrames=self.calibrationFrames,
+                    cacheDir=self.trt_cache_dir,
+                )
+
             if self.backend == "tensorrt":
                 from .TensorRTHandler import TorchTensorRTHandler
 
@@ -176,26 +320,45 @@ class UpscalePytorch:
 
                 printAndLog(f"Loading TensorRT engine from {trt_engine_path}")
                 model = trtHandler.load_engine(trt_engine_path=trt_engine_path)
+                EngineCache().use(
+                    trt_engine_path,
+                    "tensorrt",
+                    {
+                        "model": os.path.basename(self.modelPath),
+                        "shape": f"{self.pad_w}x{self.pad_h}",
+                        "precision": str(self.dtype).split(".")[-1],
+                        "device": torch.cuda.get_device_name(self.device),
+                        "tensorrt": trtHandler.tensorrt_version,
+                        "torch_tensorrt": trtHandler.torch_tensorrt_version,
+                    },
+                )
 
-            self.model = model
-        self.prepareStream.synchronize()
+            if self.backend == "pytorch-compile":
+                if self.int8:
+                    log("int8 models are traced already, not compiling")
+                else:
+                    model = BackgroundCompile(
+                        model,
+                        cacheName=f"{os.path.basename(self.modelPath)}_{self.pad_w}x{self.pad_h}_{str(self.dtype).split('.')[-1]}_{self.device.type}",
+                        device=self.device,
+                        context=lambda: autocastContext(
+                            self.device, self.autocastDtype
+                        ),
+                    )
 
-    @torch.inference_mode()
-    def handlePrecision(self, precision):
-        if precision == "auto":
-            return torch.float16 if check_bfloat16_support() else torch.float32
-        if precision == "float32":
-            return torch.float32
-        if precision == "float16":
-            return torch.float16
+            self.model = model
+        synchronize(self.prepareStream)
 
     @torch.inference_mode()
     def hotUnload(self):
         self.model = None
-        gc.collect()
-        torch.cuda.empty_cache()
-        torch.cuda.reset_max_memory_allocated()
-        torch.cuda.reset_max_memory_cached()
+        self.tileOutputs = None
+        self.tileCache = None
+        self.tileReference = None
+        self.inputTransfers = None
+        self.outputTransfers = None
+        self.inputFrames = None
+        emptyCache(self.device)
 
     @torch.inference_mode()
     def hotReload(self):
@@ -217,133 +380,288 @@ class UpscalePytorch:
         model.eval().to(self.device)
         if self.dtype == torch.float16:
             model.half()
-        return model
+        elif self.dtype == torch.bfloat16:
+            model.bfloat16()
+        return prepareModel(model, self.device)
 
     @torch.inference_mode()
     def bytesToFrame(self, frame):
-        with torch.cuda.stream(self.prepareStream):
-            output = (
-                torch.frombuffer(frame, dtype=torch.uint8)
-                .to(self.device, dtype=self.dtype, non_blocking=True)
-                .reshape(self.videoHeight, self.videoWidth, 3)
-                .permute(2, 0, 1)
-                .unsqueeze(0)
-                .mul_(1 / 255)
-            )
-        self.prepareStream.synchronize()
+        """
+        Starts uploading a frame, the returned tensor is ready once its event is reached on prepareStream
+        """
+        slot = self.inputTransfers.acquire()
+        self.inputTransfers.host(slot).view(-1).copy_(
+            torch.frombuffer(frame, dtype=torch.uint8)
+        )
+        output = self.inputFrames.next()
+        with streamContext(self.prepareStream):
+            # renderTensor marks when the last frame in this buffer was done being read
+            waitReady(output, self.prepareStream)
+            staged = self.inputTransfers.toDevice(slot)
+            normalizeFrame(staged, output[:, :, : self.videoHeight, : self.videoWidth])
+            if output.shape[-2:] != (self.videoHeight, self.videoWidth):
+                self.shapeBuckets.fillPaddingTensor(
+                    output, self.videoWidth, self.videoHeight
+                )
+            self.inputTransfers.release(slot, self.prepareStream)
+            recordReady(output, self.prepareStream)
         return output
 
     @torch.inference_mode()
     def renderImage(self, image: torch.Tensor) -> torch.Tensor:
-        upscaledImage = self.model(image)
+        with autocastContext(self.device, self.autocastDtype):
+            upscaledImage = self.model(image)
         return upscaledImage
 
+    def renderBucketed(self, image: torch.Tensor) -> torch.Tensor:
+        """
+        Renders whole frames, padded up to the shape bucket and cropped back if there is one
+        """
+        if (self.pad_w, self.pad_h) == (self.videoWidth, self.videoHeight):
+            return self.renderImage(image)
+        output = self.renderImage(
+            self.shapeBuckets.padTensor(image, self.pad_w, self.pad_h)
+        )
+        return output[
+            :, :, : self.videoHeight * self.scale, : self.videoWidth * self.scale
+        ]
+
     @torch.inference_mode()
-    def renderToNPArray(self, image: torch.Tensor) -> torch.Tensor:
-        with torch.cuda.stream(self.stream):
-            while self.model is None:
-                sleep(1)
+    def renderTensor(self, image: torch.Tensor) -> torch.Tensor:
+        """
+        Upscales a frame from bytesToFrame, the output stays on the device.
+        Only queues the work, the output is ready once its event is reached on self.stream.
+        """
+        while self.model is None:
+            sleep(1)
+        with streamContext(self.stream):
+            waitReady(image, self.stream)
             if self.tilesize == 0:
-                output = self.renderImage(image)
+                output = self.renderBucketed(image)
             else:
                 output = self.renderTiledImage(image)
-            output = (
-                output.clamp(0.0, 1.0)
-                .squeeze(0)
-                .permute(1, 2, 0)
-                .mul(255)
-                .float()
-                .byte()
-                .contiguous()
-                .cpu()
-                .numpy()
+            # the input buffer can be written again once the model is done with it
+            recordReady(image, self.stream)
+            output = self.resizeOutput(output)
+            recordReady(output, self.stream)
+        return output
+
+    @torch.inference_mode()
+    def renderTensorBatch(self, images: list[torch.Tensor]) -> list[torch.Tensor]:
+        """
+        Upscales several frames from bytesToFrame in one forward pass, returns one output per frame.
+        Only for full frames, tiled frames already batch their tiles.
+        """
+        if len(images) == 1 or self.tilesize != 0:
+            return [self.renderTensor(image) for image in images]
+        while self.model is None:
+            sleep(1)
+        with streamContext(self.stream):
+            for image in images:
+                waitReady(image, self.stream)
+            outputs = list(
+                self.resizeOutput(self.renderBucketed(torch.cat(images))).split(1)
+            )
+            for image in images:
+                recordReady(image, self.stream)
+            for output in outputs:
+                recordReady(output, self.stream)
+        return outputs
+
+    def resizeOutput(self, image: torch.Tensor) -> torch.Tensor:
+        """
+        Resizes upscaled frames to the output size while they are still on the device, so the download, pipe and encoder only see the smaller frame.
+        Whole factor downscales use area averaging, anything else antialiased bicubic.
+        """
+        height, width = image.shape[-2:]
+        if (height, width) == (self.outputHeight, self.outputWidth):
+            return image
+        image = image.to(self.dtype)
+        if height % self.outputHeight == 0 and width % self.outputWidth == 0:
+            return F.interpolate(
+                image, size=(self.outputHeight, self.outputWidth), mode="area"
             )
-        self.stream.synchronize()
+        return F.interpolate(
+            image,
+            size=(self.outputHeight, self.outputWidth),
+            mode="bicubic",
+            antialias=True,
+            align_corners=False,
+        )
+
+    @torch.inference_mode()
+    def tensorToNPArray(self, image: torch.Tensor) -> np.ndarray:
+        """
+        Downloads an upscaled frame through a pinned buffer, only waits for this frame's copy
+        """
+        slot = self.outputTransfers.acquire()
+        with streamContext(self.outputStream):
+            waitReady(image, self.outputStream)
+            # converted on the device in the slot's own buffers, then downloaded
+            denormalizeFrame(
+                image,
+                self.outputTransfers.workBuffer(slot, image.dtype),
+                self.outputTransfers.device(slot),
+            )
+            self.outputTransfers.toHost(slot)
+            self.outputTransfers.record(slot, self.outputStream)
+        self.outputTransfers.wait(slot)
+        # the pinned buffer is reused a few frames later, the write queue can hold on to frames longer than that
+        output = self.outputTransfers.host(slot).numpy().copy()
+        self.outputTransfers.release(slot)
         return output
 
+    @torch.inference_mode()
+    def renderToNPArray(self, image: torch.Tensor) -> np.ndarray:
+        return self.tensorToNPArray(self.renderTensor(image))
+
+    @torch.inference_mode()
+    def renderFrame(self, frame) -> np.ndarray:
+        """
+        Upscales raw frame bytes all the way to an array
+        """
+        return self.renderToNPArray(self.bytesToFrame(frame))
+
     def getScale(self):
         return self.scale
 
+    def getTileBatchSize(self, numTiles: int) -> int:
+        """
+        Number of tiles to run through the model at once, sized from the free memory if tileBatch is 0
+        """
+        if self.backend == "tensorrt":
+            # engines are built for a batch of 1
+            return 1
+        if self.tileBatch > 0:
+            return min(self.tileBatch, numTiles)
+        elementSize = torch.tensor([], dtype=self.dtype).element_size()
+        # rough upper bound for the activations of typical sr models (~64 feature channels, a few alive at once)
+        bytesPerTile = (
+            self.pad_w * self.pad_h * elementSize * (256 + 3 * self.scale * self.scale)
+        )
+        budget = availableMemory(self.device) // 2
+        batchSize = max(1, min(budget // bytesPerTile, 16, numTiles))
+        log(f"Using a tile batch size of {batchSize}")
+        return batchSize
+
     @torch.inference_mode()
+    def tileFingerprint(self, tiles: torch.Tensor) -> torch.Tensor:
+        """
+        What a tile is compared by, the exact input at a threshold of 0, otherwise the average of every 4x4 block (0-255)
+        """
+        if self.tileReuseThreshold == 0:
+            return tiles.clone()
+        return F.avg_pool2d(tiles.float(), kernel_size=4, ceil_mode=True) * 255
+
+    def changedTiles(self, tiles: torch.Tensor, batches: list[list[int]]) -> list[int]:
+        """
+        Indices of the tiles that have to be rendered again, and updates the reference of those.
+        Whole batches are rendered again, so every tile goes through the model in the same batch as without reuse,
+        models don't always give the exact same output for a tile in a batch of another size or makeup.
+        """
+        fingerprint = self.tileFingerprint(tiles)
+        if self.tileReference is None:
+            self.tileReference = fingerprint
+            return list(range(len(tiles)))
+        if self.tileReuseThreshold == 0:
+            changed = (fingerprint != self.tileReference).flatten(1).any(dim=1)
+        else:
+            changed = (fingerprint - self.tileReference).abs().flatten(1).amax(
+                dim=1
+            ) > self.tileReuseThreshold
+        changed = changed.tolist()
+        toRender = [
+            index
+            for batch in batches
+            if any(changed[index] for index in batch)
+            for index in batch
+        ]
+        # the reference only moves for rerendered tiles, so slow changes can't add up unnoticed
+        self.tileReference[toRender] = fingerprint[toRender]
+        return toRender
+
+    def tileReuseReport(self) -> str:
+        total = self.tilesRendered + self.tilesReused
+        if total == 0:
+            return "Tile reuse: no tiles rendered"
+        percent = round(self.tilesReused / total * 100, 1)
+        return f"Tile reuse: reused {self.tilesReused} of {total} tiles ({percent}%)"
+
     def renderTiledImage(
         self,
         img: torch.Tensor,
     ) -> torch.Tensor:
+        """
+        Upscales the frame in fixed size overlapping tiles, and blends the overlaps together with feathered weights.
+        With tile reuse, only the batches with a tile whose input changed go through the model, the weighted outputs of the rest come from the cache.
+        The batches and the order tiles are added up in are the same either way, so at a threshold of 0 the output is the same as rendering every tile.
+        """
         scale = self.scale
-        tile = self.tile
-        tile_pad = self.tile_pad
-
-        batch, channel, height, width = img.shape
-        output_shape = (batch, channel, height * scale, width * scale)
-
-        # start with black image
-        output = img.new_zeros(output_shape)
-
-        tiles_x = math.ceil(width / tile[0])
-        tiles_y = math.ceil(height / tile[1])
-
-        # loop over all tiles
-        for y in range(tiles_y):
-            for x in range(tiles_x):
-                # extract tile from input image
-                ofs_x = x * tile[0]
-                ofs_y = y * tile[1]
-
-                # input tile area on total image
-                input_start_x = ofs_x
-                input_end_x = min(ofs_x + tile[0], width)
-                input_start_y = ofs_y
-                input_end_y = min(ofs_y + tile[1], height)
-
-                # input tile area on total image with padding
-                input_start_x_pad = max(input_start_x - tile_pad, 0)
-                input_end_x_pad = min(input_end_x + tile_pad, width)
-                input_start_y_pad = max(input_start_y - tile_pad, 0)
-                input_end_y_pad = min(input_end_y + tile_pad, height)
-
-                # input tile dimensions
-                input_tile_width = input_end_x - input_start_x
-                input_tile_height = input_end_y - input_start_y
-
-                input_tile = img[
-                    :,
-                    :,
-                    input_start_y_pad:input_end_y_pad,
-                    input_start_x_pad:input_end_x_pad,
-                ]
+        layout = self.tileLayout
+        tileWidth, tileHeight = layout.tileSize()
 
-                h, w = input_tile.shape[2:]
-                input_tile = F.pad(
-                    input_tile, (0, self.pad_w - w, 0, self.pad_h - h), "replicate"
-                )
+        if layout.padRight or layout.padBottom:
+            # the frame is smaller than a tile, pad it up so the tile shape never changes
+            img = F.pad(img, (0, layout.padRight, 0, layout.padBottom), "replicate")
 
-                # process tile
-                output_tile = self.model(
-                    input_tile.to(device=self.device, dtype=self.dtype)
-                )
+        output = self.tileOutputs.next()
+        output.zero_()
 
-                output_tile = output_tile[:, :, : h * scale, : w * scale]
+        if self.tileBatchSize is None:
+            self.tileBatchSize = self.getTileBatchSize(len(layout))
+
+        def cutTiles(indices):
+            return torch.cat(
+                [
+                    img[:, :, y : y + self.pad_h, x : x + self.pad_w]
+                    for x, y, column, row in (layout.tiles[i] for i in indices)
+                ]
+            )
 
-                # output tile area on total image
-                output_start_x = input_start_x * scale
-                output_end_x = input_end_x * scale
-                output_start_y = input_start_y * scale
-                output_end_y = input_end_y * scale
+        batches = [
+            list(range(batchStart, min(batchStart + self.tileBatchSize, len(layout))))
+            for batchStart in range(0, len(layout), self.tileBatchSize)
+        ]
+        if self.tileReuse:
+            # the tile includes its overlap, so a change that reaches into a neighbour rerenders the neighbour too
+            allTiles = cutTiles(range(len(layout)))
+            toRender = set(self.changedTiles(allTiles, batches))
+            batches = [batch for batch in batches if batch[0] in toRender]
+            self.tilesRendered += len(toRender)
+            self.tilesReused += len(layout) - len(toRender)
+
+        for batchIndices in batches:
+            inputTiles = (
+                allTiles[batchIndices] if self.tileReuse else cutTiles(batchIndices)
+            )
+            # process tiles
+            outputTiles = self.renderImage(
+                inputTiles.to(device=self.device, dtype=self.dtype)
+            )
 
-                # output tile area without padding
-                output_start_x_tile = (input_start_x - input_start_x_pad) * scale
-                output_end_x_tile = output_start_x_tile + input_tile_width * scale
-                output_start_y_tile = (input_start_y - input_start_y_pad) * scale
-                output_end_y_tile = output_start_y_tile + input_tile_height * scale
+            for outputTile, index in zip(outputTiles.split(1, dim=0), batchIndices):
+                x, y, column, row = layout.tiles[index]
+                outputTile = outputTile[
+                    :, :, : tileHeight * scale, : tileWidth * scale
+                ]
+                outputTile.mul_(self.rowWeights[row]).mul_(self.columnWeights[column])
+                if self.tileReuse:
+                    self.tileCache[index].copy_(outputTile[0])
+                    continue
+                output[
+                    :,
+                    :,
+                    y * scale : (y + tileHeight) * scale,
+                    x * scale : (x + tileWidth) * scale,
+                ].add_(outputTile)
 
-                # put tile into output image
+        if self.tileReuse:
+            for index, (x, y, column, row) in enumerate(layout.tiles):
                 output[
-                    :, :, output_start_y:output_end_y, output_start_x:output_end_x
-                ] = output_tile[
                     :,
                     :,
-                    output_start_y_tile:output_end_y_tile,
-                    output_start_x_tile:output_end_x_tile,
-                ]
+                    y * scale : (y + tileHeight) * scale,
+                    x * scale : (x + tileWidth) * scale,
+                ].add_(self.tileCache[index])
 
         return output
@@ -1,4 +1,5 @@
 import os
+import multiprocessing
 import warnings
 import numpy as np
 import cv2
@@ -22,8 +23,10 @@ if isFlatpak():
         )
 else:
     cwd = os.getcwd()
-with open(os.path.join(cwd, "backend_log.txt"), "w") as f:
-    pass
+# worker processes import this too, only the main process should clear the log
+if multiprocessing.current_process().name == "MainProcess":
+    with open(os.path.join(cwd, "backend_log.txt"), "w") as f:
+        pass
 
 
 def removeFile(file):
@@ -83,6 +86,23 @@ def bytesToImg(
     return frame
 
 
+def sampleVideoFrames(inputFile: str, samples: int, start=0.1, end=0.9):
+    """
+    Yields up to samples rgb frames spread evenly between start and end (fractions of the video).
+    The start and end are skipped by default, fades and black title cards are common there.
+    """
+    cap = cv2.VideoCapture(inputFile)
+    totalFrames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    try:
+        for position in np.linspace(start, end, samples):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(position * totalFrames))
+            ret, frame = cap.read()
+            if ret:
+                yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    finally:
+        cap.release()
+
+
 def ffmpegPath() -> str:
     return str(os.path.join(currentDirectory(), "bin", "ffmpeg"))
 
@@ -138,17 +158,47 @@ def checkForGMFSS() -> bool:
     return True
 
 
+def availableMemory(device) -> int:
+    """
+    Free memory in bytes on a torch device, for cpu devices this is the available system memory
+    """
+    import torch
+
+    if torch.device(device).type == "cuda":
+        free, total = torch.cuda.mem_get_info(device)
+        return free
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        # not available on windows, assume a conservative 4gb
+        return 4 * 1024**3
+
+
 def check_bfloat16_support() -> bool:
     """
-    Function that checks if the torch backend supports bfloat16
+    Function that checks if the torch backend supports half precision on the gpu
     """
     import torch
 
+    if not torch.cuda.is_available():
+        return False
     try:
         x = torch.tensor([1.0], dtype=torch.float16).cuda()
         return True
-    except RuntimeError:
+    except (RuntimeError, AssertionError):
+        return False
+
+
+def check_cpu_bfloat16_support() -> bool:
+    """
+    Function that checks if the cpu has native bfloat16 instructions, without them bfloat16 is slower than float32
+    """
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            flags = f.read()
+    except OSError:
         return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
 
 
 def checkForDirectMLHalfPrecisionSupport() -> bool:
@@ -235,6 +285,38 @@ def checkForDirectML() -> bool:
         return False
 
 
+def checkForONNXRuntime() -> bool:
+    """
+    Function that checks if onnxruntime is available, the cpu execution provider always is
+    """
+    try:
+        import onnxruntime as ort
+
+        log(f"ONNX Runtime providers: {ort.get_available_providers()}")
+        return True
+    except ImportError as e:
+        log(str(e))
+        return False
+
+
+def checkForOpenVINO() -> bool:
+    """
+    Function that checks if openvino is available, and has a cpu to run on
+    """
+    try:
+        import openvino as ov
+
+        devices = ov.Core().available_devices
+        log(f"OpenVINO devices: {devices}")
+        return "CPU" in devices
+    except ImportError as e:
+        log(str(e))
+        return False
+    except Exception as e:
+        log(str(e))
+        return False
+
+
 def checkForNCNN() -> bool:
     """
     function that checks if the pytorch backend is available
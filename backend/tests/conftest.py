@@ -0,0 +1,53 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# the backend is run from its own directory, src is imported as a top level package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def randomFrames(count: int, width: int, height: int, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    return [
+        rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(count)
+    ]
+
+
+@pytest.fixture(scope="session")
+def compactModelPath(tmp_path_factory) -> str:
+    """
+    A small 2x Compact model with random weights, loaded through spandrel like a downloaded one
+    """
+    torch = pytest.importorskip("torch")
+    # spandrel imports torchvision for some archs
+    pytest.importorskip("torchvision")
+    from src.spandrel.architectures.Compact.__arch.SRVGG import SRVGGNetCompact
+
+    torch.manual_seed(0)
+    model = SRVGGNetCompact(
+        num_in_ch=3, num_out_ch=3, num_feat=16, num_conv=4, upscale=2
+    )
+    path = tmp_path_factory.mktemp("models") / "compact-x2.pth"
+    torch.save(model.state_dict(), path)
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def rifeModelPath(tmp_path_factory) -> str:
+    """
+    A rife 4.13 model with random weights, saved like the released .pkl files
+    """
+    torch = pytest.importorskip("torch")
+    from src.InterpolateArchs.RIFE.rife413IFNET import IFNet, Head
+
+    torch.manual_seed(0)
+    net = IFNet(
+        scale=1, ensemble=False, dtype=torch.float32, device="cpu", width=64, height=64
+    )
+    stateDict = {"module." + k: v for k, v in net.state_dict().items()}
+    stateDict.update({"module.encode." + k: v for k, v in Head().state_dict().items()})
+    path = tmp_path_factory.mktemp("models") / "rife413.pkl"
+    torch.save(stateDict, path)
+    return str(path)
@@ -0,0 +1,156 @@
+import time
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from src.InterpolateTorch import InterpolateRifeTorch
+from src.UpscaleTorch import UpscalePytorch
+
+from conftest import randomFrames
+
+WIDTH = 96
+HEIGHT = 64
+
+
+def maxDifference(a: np.ndarray, b: np.ndarray) -> int:
+    return int(np.abs(a.astype(np.int16) - b.astype(np.int16)).max())
+
+
+@torch.inference_mode()
+def referenceUpscale(modelPath: str, frame: np.ndarray) -> np.ndarray:
+    """
+    The model run on a plain contiguous float32 tensor, none of the buffers, layouts or padding of the backend
+    """
+    from src.spandrel import ModelLoader
+
+    model = ModelLoader().load_from_file(modelPath).model.eval().float()
+    image = torch.from_numpy(frame).permute(2, 0, 1).unsqueeze(0).float() / 255
+    output = model(image).clamp(0, 1) * 255
+    return output[0].permute(1, 2, 0).byte().numpy()
+
+
+def test_upscale_matches_reference(compactModelPath):
+    frames = randomFrames(3, WIDTH, HEIGHT)
+    upscale = UpscalePytorch(
+        compactModelPath,
+        device="cpu",
+        precision="float32",
+        width=WIDTH,
+        height=HEIGHT,
+    )
+    for frame in frames:
+        output = upscale.renderFrame(frame.tobytes())
+        assert output.shape == (HEIGHT * 2, WIDTH * 2, 3)
+        assert maxDifference(output, referenceUpscale(compactModelPath, frame)) <= 1
+
+
+def test_upscale_tiled_matches_whole_frame(compactModelPath):
+    frame = randomFrames(1, WIDTH, HEIGHT)[0]
+    whole = UpscalePytorch(
+        compactModelPath, device="cpu", precision="float32", width=WIDTH, height=HEIGHT
+    )
+    tiled = UpscalePytorch(
+        compactModelPath,
+        device="cpu",
+        precision="float32",
+        width=WIDTH,
+        height=HEIGHT,
+        tilesize=32,
+        tile_pad=8,
+    )
+    assert (
+        maxDifference(
+            tiled.renderFrame(frame.tobytes()), whole.renderFrame(frame.tobytes())
+        )
+        <= 1
+    )
+
+
+def test_upscale_bfloat16_autocast(compactModelPath):
+    frame = randomFrames(1, WIDTH, HEIGHT)[0]
+    upscale = UpscalePytorch(
+        compactModelPath,
+        device="cpu",
+        precision="bfloat16",
+        width=WIDTH,
+        height=HEIGHT,
+    )
+    # the model stays float32, bfloat16 only comes from autocast
+    assert upscale.dtype == torch.float32
+    assert upscale.autocastDtype == torch.bfloat16
+    output = upscale.renderFrame(frame.tobytes())
+    reference = referenceUpscale(compactModelPath, frame)
+    assert np.abs(output.astype(np.int16) - reference).mean() < 2
+
+
+@torch.inference_mode()
+def referenceInterpolate(
+    interpolate: InterpolateRifeTorch, frame0: np.ndarray, frame1: np.ndarray
+) -> np.ndarray:
+    """
+    The backend's flownet called on freshly made contiguous tensors, zero padded to the padded size
+    """
+
+    def toTensor(frame):
+        image = torch.zeros(1, 3, interpolate.ph, interpolate.pw)
+        image[:, :, :HEIGHT, :WIDTH] = (
+            torch.from_numpy(frame).permute(2, 0, 1).float() / 255
+        )
+        return image
+
+    img0, img1 = toTensor(frame0), toTensor(frame1)
+    output = interpolate.flownet(
+        img0,
+        img1,
+        interpolate.timestepDict[0.5],
+        interpolate.tenFlow_div,
+        interpolate.backwarp_tenGrid,
+        interpolate.encode(img0),
+        interpolate.encode(img1),
+    )
+    # rife crops, and returns hwc 0-255 itself
+    return output.byte().numpy()
+
+
+def test_interpolate_matches_reference(rifeModelPath):
+    frames = randomFrames(4, WIDTH, HEIGHT)
+    interpolate = InterpolateRifeTorch(
+        rifeModelPath, width=WIDTH, height=HEIGHT, device="cpu", dtype="float32"
+    )
+    assert interpolate.stream is None
+    img0 = interpolate.frame0_to_tensor(frames[0].tobytes())
+    f0encode = interpolate.encode_Frame(img0)
+    for previous, frame in zip(frames, frames[1:]):
+        img1 = interpolate.frame_to_tensor(frame.tobytes())
+        f1encode = interpolate.encode_Frame(img1)
+        output = interpolate.process(img0, img1, 0.5, f0encode, f1encode)
+        assert output.shape == (HEIGHT, WIDTH, 3)
+        assert (
+            maxDifference(output, referenceInterpolate(interpolate, previous, frame))
+            <= 1
+        )
+        interpolate.copyTensor(img0, img1)
+        interpolate.copyTensor(f0encode, f1encode)
+
+
+def test_cpu_upscale_benchmark(compactModelPath):
+    """
+    Not a performance gate, a few frames timed after a warm up so regressions show up in the output (pytest -s)
+    """
+    width, height, frameCount = 256, 256, 8
+    frames = [frame.tobytes() for frame in randomFrames(frameCount, width, height)]
+    upscale = UpscalePytorch(
+        compactModelPath, device="cpu", precision="float32", width=width, height=height
+    )
+    upscale.renderFrame(frames[0])
+    start = time.perf_counter()
+    for frame in frames:
+        upscale.renderFrame(frame)
+    milliseconds = (time.perf_counter() - start) * 1000 / frameCount
+    print(
+        f"\ncpu upscale {width}x{height}: {milliseconds:.1f}ms/frame with {torch.get_num_threads()} threads"
+    )
+    # loose enough for any machine, catches the cpu path falling back to something pathological
+    assert milliseconds < 5000
@@ -0,0 +1,165 @@
+import time
+
+import numpy as np
+import pytest
+
+from src.DeviceScheduler import DeviceScheduler, DeviceExecutor, parseDevices
+from src.ReplicaPool import PendingFrame
+
+from conftest import randomFrames
+
+
+def sleepingDevice(name: str, seconds: float, concurrency: int = 1) -> DeviceExecutor:
+    """
+    A cpu stand-in for a device that takes seconds per frame, and tags its output so the test can see where frames went
+    """
+
+    def function(frame):
+        time.sleep(seconds)
+        return (name, frame * 2)
+
+    return DeviceExecutor(name=name, function=function, concurrency=concurrency)
+
+
+def test_imap_keeps_order_and_outputs():
+    scheduler = DeviceScheduler(
+        [sleepingDevice("fast", 0.001), sleepingDevice("slow", 0.01)]
+    )
+    try:
+        outputs = [output for _, output in scheduler.imap(range(100))]
+    finally:
+        scheduler.close()
+    assert outputs == [frame * 2 for frame in range(100)]
+
+
+def test_faster_device_gets_more_frames():
+    fast = sleepingDevice("fast", 0.002)
+    slow = sleepingDevice("slow", 0.02)
+    scheduler = DeviceScheduler([fast, slow])
+    try:
+        devices = [name for name, _ in scheduler.imap(range(120))]
+    finally:
+        scheduler.close()
+    assert fast.framesDone + slow.framesDone == 120
+    assert devices.count("fast") == fast.framesDone
+    # 10x faster, it should end up with most of the frames, but the slow device still helps
+    assert fast.framesDone > 3 * slow.framesDone
+    assert slow.framesDone > 0
+    assert fast.latency < slow.latency
+
+
+def test_concurrency_counts_as_throughput():
+    # the same latency, but two frames at once
+    wide = sleepingDevice("wide", 0.01, concurrency=2)
+    narrow = sleepingDevice("narrow", 0.01)
+    scheduler = DeviceScheduler([wide, narrow])
+    try:
+        list(scheduler.imap(range(90)))
+    finally:
+        scheduler.close()
+    assert wide.framesDone > narrow.framesDone
+
+
+def test_idle_device_steals_queued_frames():
+    slow = sleepingDevice("slow", 0.05)
+    fast = sleepingDevice("fast", 0.001)
+    scheduler = DeviceScheduler([slow, fast])
+    try:
+        # everything queued on the slow device, the fast one only gets frames by stealing them
+        waiters = [PendingFrame() for _ in range(10)]
+        with scheduler.condition:
+            for frame, waiter in enumerate(waiters):
+                slow.queue.append((frame, waiter))
+            scheduler.condition.notify_all()
+        outputs = [scheduler.result(waiter) for waiter in waiters]
+    finally:
+        scheduler.close()
+    assert [output for _, output in outputs] == [frame * 2 for frame in range(10)]
+    assert fast.framesDone > slow.framesDone
+
+
+def test_errors_are_raised():
+    def broken(frame):
+        if frame == 5:
+            raise ValueError("bad frame")
+        return frame
+
+    scheduler = DeviceScheduler([DeviceExecutor("broken", broken)])
+    try:
+        assert scheduler.render(4) == 4
+        with pytest.raises(RuntimeError, match="bad frame"):
+            scheduler.render(5)
+        with pytest.raises(RuntimeError, match="broken failed"):
+            list(scheduler.imap(range(10)))
+        # the device keeps working after a failed frame
+        assert scheduler.render(6) == 6
+    finally:
+        scheduler.close()
+
+
+def test_unload_and_reload_reach_every_device():
+    calls = []
+    executors = [
+        DeviceExecutor(
+            name,
+            lambda frame: frame,
+            unload=lambda name=name: calls.append(("unload", name)),
+            reload=lambda name=name: calls.append(("reload", name)),
+        )
+        for name in ("cuda:0", "cpu")
+    ]
+    scheduler = DeviceScheduler(executors)
+    try:
+        scheduler.unload()
+        scheduler.reload()
+        assert scheduler.render(3) == 3
+    finally:
+        scheduler.close()
+    assert calls == [
+        ("unload", "cuda:0"),
+        ("unload", "cpu"),
+        ("reload", "cuda:0"),
+        ("reload", "cpu"),
+    ]
+
+
+def test_parse_devices():
+    assert parseDevices("") == []
+    assert parseDevices("cuda:0, CUDA:1,cpu") == ["cuda:0", "cuda:1", "cpu"]
+    for devices in ("cuda", "cuda:x", "gpu:0", "cpu,mps"):
+        with pytest.raises(ValueError):
+            parseDevices(devices)
+
+
+def test_two_cpu_upscalers_match_one(compactModelPath):
+    """
+    Two real cpu executors standing in for two devices, every frame has to match what a single upscaler gives
+    """
+    pytest.importorskip("torch")
+    from src.UpscaleTorch import UpscalePytorch
+
+    width, height = 64, 48
+    frames = randomFrames(12, width, height)
+
+    def upscaler():
+        return UpscalePytorch(
+            compactModelPath,
+            device="cpu",
+            precision="float32",
+            width=width,
+            height=height,
+        )
+
+    single = upscaler()
+    expected = [single.renderFrame(frame.tobytes()) for frame in frames]
+    executors = [
+        DeviceExecutor(name, upscaler().renderFrame) for name in ("cpu-a", "cpu-b")
+    ]
+    scheduler = DeviceScheduler(executors)
+    try:
+        outputs = list(scheduler.imap(frame.tobytes() for frame in frames))
+    finally:
+        scheduler.close()
+    assert sum(executor.framesDone for executor in executors) == len(frames)
+    for output, reference in zip(outputs, expected):
+        assert np.array_equal(output, reference)
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+ncnn = pytest.importorskip("ncnn")
+
+import src.UpscaleNCNN
+from src.UpscaleNCNN import UpscaleNCNN
+
+from conftest import randomFrames
+
+# odd sizes so the last row and column of tiles are partial
+WIDTH = 203
+HEIGHT = 117
+
+# two 3x3 convolutions, every output pixel sees 2 input pixels around it, so a tilePad of 2 or more is exact
+PARAM = """7767517
+4 4
+Input            data   0 1 data
+Convolution      conv1  1 1 data c1 0=12 1=3 4=1 5=1 6=324 9=1
+Convolution      conv2  1 1 c1 c2 0=12 1=3 4=1 5=1 6=1296
+PixelShuffle     ps     1 1 c2 output 0=2
+"""
+
+
+@pytest.fixture(scope="module")
+def modelPath(tmp_path_factory) -> str:
+    """
+    A small 2x ncnn model with random weights
+    """
+    rng = np.random.default_rng(0)
+    weights = []
+    for count in (324, 1296):
+        # a zero flag means raw float32 weights, the bias follows without a flag
+        weights.append(np.zeros(1, dtype=np.uint32).tobytes())
+        weights.append(rng.normal(0, 0.2, count).astype(np.float32).tobytes())
+        weights.append(rng.normal(0, 0.05, 12).astype(np.float32).tobytes())
+    path = tmp_path_factory.mktemp("ncnn") / "test-x2"
+    path.with_suffix(".param").write_text(PARAM)
+    path.with_suffix(".bin").write_bytes(b"".join(weights))
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def ncnnVulkan(monkeypatch):
+    # tiling is only done here on the ncnn fallback, not by upscale_ncnn_py
+    monkeypatch.setattr(src.UpscaleNCNN, "method", "ncnn_vulkan")
+    monkeypatch.setattr(src.UpscaleNCNN, "ncnn", ncnn, raising=False)
+
+
+def upscaler(modelPath: str, tilesize: int = 0, tilePad: int = 10) -> UpscaleNCNN:
+    return UpscaleNCNN(
+        modelPath,
+        num_threads=1,
+        scale=2,
+        width=WIDTH,
+        height=HEIGHT,
+        tilesize=tilesize,
+        tilePad=tilePad,
+    )
+
+
+def maxDifference(a: np.ndarray, b: np.ndarray) -> int:
+    return int(np.abs(a.astype(np.int16) - b.astype(np.int16)).max())
+
+
+@pytest.mark.parametrize(
+    "tilesize,tilePad", [(64, 4), (50, 2), (32, 10), (100, 3), (300, 4)]
+)
+def test_tiled_matches_untiled(modelPath, tilesize, tilePad):
+    frame = randomFrames(1, WIDTH, HEIGHT)[0].tobytes()
+    whole = upscaler(modelPath).Upscale(frame)
+    tiled = upscaler(modelPath, tilesize, tilePad).Upscale(frame)
+    assert tiled.shape == whole.shape == (HEIGHT * 2, WIDTH * 2, 3)
+    assert maxDifference(tiled, whole) <= 1
+
+
+def test_tiles_follow_each_frame(modelPath):
+    """
+    Every frame has to come out as its own, a cached extractor would keep returning the first one
+    """
+    frames = [frame.tobytes() for frame in randomFrames(3, WIDTH, HEIGHT)]
+    whole = upscaler(modelPath)
+    tiled = upscaler(modelPath, tilesize=64, tilePad=4)
+    outputs = [tiled.Upscale(frame) for frame in frames]
+    for frame, output in zip(frames, outputs):
+        assert maxDifference(output, whole.Upscale(frame)) <= 1
+    assert maxDifference(outputs[0], outputs[1]) > 1
+
+
+def test_reused_extractor_is_stale(modelPath):
+    """
+    Why renderTile makes an extractor per tile, one that is reused returns the blob it computed first
+    """
+    net = upscaler(modelPath).net
+    first, second = randomFrames(2, WIDTH, HEIGHT)
+    extractor = net.create_extractor()
+    outputs = []
+    for frame in (first, second):
+        mat = ncnn.Mat.from_pixels(frame, ncnn.Mat.PixelType.PIXEL_BGR, WIDTH, HEIGHT)
+        extractor.input("data", mat)
+        ret, output = extractor.extract("output")
+        outputs.append(np.array(output))
+    assert np.array_equal(outputs[0], outputs[1])
+
+
+def test_tiled_after_reload(modelPath):
+    frame = randomFrames(1, WIDTH, HEIGHT)[0].tobytes()
+    tiled = upscaler(modelPath, tilesize=64, tilePad=4)
+    before = tiled.Upscale(frame)
+    tiled.hotUnload()
+    tiled.hotReload()
+    assert np.array_equal(tiled.Upscale(frame), before)
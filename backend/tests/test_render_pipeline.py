@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from src.Pipeline import RenderPipeline
+from src.UpscaleTorch import UpscalePytorch
+
+from conftest import randomFrames
+
+WIDTH = 64
+HEIGHT = 48
+
+
+@pytest.fixture(scope="module")
+def frames() -> list:
+    return randomFrames(24, WIDTH, HEIGHT)
+
+
+@pytest.fixture(scope="module")
+def expected(compactModelPath, frames) -> list:
+    upscale = UpscalePytorch(
+        compactModelPath, device="cpu", width=WIDTH, height=HEIGHT, precision="float32"
+    )
+    return [upscale.renderFrame(frame.tobytes()) for frame in frames]
+
+
+def makePipeline(modelPath: str, **kwargs) -> RenderPipeline:
+    return RenderPipeline(
+        width=WIDTH,
+        height=HEIGHT,
+        device="cpu",
+        precision="float32",
+        upscaleModel=modelPath,
+        **kwargs,
+    )
+
+
+def assertFramesEqual(outputs: list, expected: list):
+    assert len(outputs) == len(expected)
+    for output, reference in zip(outputs, expected):
+        assert output.shape == (HEIGHT * 2, WIDTH * 2, 3)
+        assert np.array_equal(output, reference)
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        {},
+        # workers finish out of order, the stage graph has to put the frames back in order
+        {"stageWorkers": {"normalize": 3, "upscale": 3, "denormalize": 3}},
+        {"cpu_replicas": 2, "stageWorkers": {"upscale": 4}},
+    ],
+    ids=["default", "stage-workers", "cpu-replicas"],
+)
+def test_process_matches_upscale(compactModelPath, frames, expected, settings):
+    with makePipeline(compactModelPath, **settings) as pipeline:
+        assertFramesEqual(list(pipeline.process(frames)), expected)
+        # every call is a new clip, the pipeline is reused as is
+        assertFramesEqual(list(pipeline.process(frames[:5])), expected[:5])
+
+
+def test_wrong_frame_shape_is_raised(compactModelPath, frames, expected):
+    badFrames = frames[:3] + [np.zeros((HEIGHT, WIDTH + 1, 3), dtype=np.uint8)]
+    with makePipeline(compactModelPath) as pipeline:
+        with pytest.raises(ValueError, match="Expected a frame of shape"):
+            list(pipeline.process(badFrames))
+        assertFramesEqual(list(pipeline.process(frames)), expected)
+
+
+def test_stopping_early_then_processing_again(compactModelPath, frames, expected):
+    with makePipeline(
+        compactModelPath, stageWorkers={"upscale": 2}, queueSize=2
+    ) as pipeline:
+        for frameNum, _ in enumerate(pipeline.process(frames)):
+            if frameNum == 2:
+                break
+        assertFramesEqual(list(pipeline.process(frames)), expected)
+
+
+def test_process_before_start_raises(compactModelPath, frames):
+    pipeline = makePipeline(compactModelPath)
+    with pytest.raises(RuntimeError, match="has to be called before process"):
+        next(pipeline.process(frames))
@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from src.ReplicaPool import ReplicaPool
+from src.UpscaleTorch import UpscalePytorch
+
+from conftest import randomFrames
+
+WIDTH = 64
+HEIGHT = 48
+SETTINGS = {"precision": "float32"}
+
+
+def startPool(modelPath: str, replicas: int = 2) -> ReplicaPool:
+    pool = ReplicaPool(
+        modelPath,
+        WIDTH,
+        HEIGHT,
+        scale=2,
+        replicas=replicas,
+        threadsPerReplica=1,
+        settings=SETTINGS,
+    )
+    pool.start()
+    return pool
+
+
+@pytest.fixture(scope="module")
+def frames() -> list:
+    return [frame.tobytes() for frame in randomFrames(16, WIDTH, HEIGHT)]
+
+
+@pytest.fixture(scope="module")
+def expected(compactModelPath, frames) -> list:
+    upscale = UpscalePytorch(
+        compactModelPath, device="cpu", width=WIDTH, height=HEIGHT, **SETTINGS
+    )
+    return [upscale.renderFrame(frame) for frame in frames]
+
+
+def test_replicas_match_one_model(compactModelPath, frames, expected):
+    pool = startPool(compactModelPath)
+    try:
+        # the upscale stage calls render from several threads, whichever replica is free takes the next frame
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            outputs = list(executor.map(pool.render, frames))
+    finally:
+        pool.stop()
+    for output, reference in zip(outputs, expected):
+        assert np.array_equal(output, reference)
+
+
+def test_pause_waits_for_frames_in_flight(compactModelPath, frames, expected):
+    pool = startPool(compactModelPath)
+    try:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = [executor.submit(pool.render, frame) for frame in frames]
+            # paused with frames still being upscaled, and frames that come in while paused wait for resume
+            pause = Thread(target=pool.pause)
+            pause.start()
+            pause.join()
+            assert not pool.started
+            pool.resume()
+            outputs = [result.result(timeout=60) for result in results]
+    finally:
+        pool.stop()
+    for output, reference in zip(outputs, expected):
+        assert np.array_equal(output, reference)
+
+
+def test_dead_replicas_fail_the_frames(compactModelPath, frames):
+    pool = startPool(compactModelPath)
+    try:
+        for process in pool.processes:
+            process.kill()
+        # more frames than input slots, none of them can wait forever
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = [executor.submit(pool.render, frame) for frame in frames]
+            for result in results:
+                with pytest.raises(RuntimeError, match="exited unexpectedly"):
+                    result.result(timeout=60)
+    finally:
+        pool.stop()
+
+
+def test_model_load_error_is_raised(tmp_path):
+    brokenModel = tmp_path / "broken.pth"
+    brokenModel.write_bytes(b"not a model")
+    pool = ReplicaPool(
+        str(brokenModel), WIDTH, HEIGHT, scale=2, replicas=1, threadsPerReplica=1
+    )
+    with pytest.raises(RuntimeError, match="failed to load the model"):
+        pool.start()
+
+
+def test_replicas_use_the_parents_matmul_precision(compactModelPath, frames):
+    # InterpolateTorch lowers it on import, the replicas have to render like the model in this process
+    previous = torch.get_float32_matmul_precision()
+    torch.set_float32_matmul_precision("medium")
+    try:
+        upscale = UpscalePytorch(
+            compactModelPath, device="cpu", width=WIDTH, height=HEIGHT, **SETTINGS
+        )
+        expected = [upscale.renderFrame(frame) for frame in frames[:4]]
+        pool = startPool(compactModelPath, replicas=1)
+        try:
+            outputs = [pool.render(frame) for frame in frames[:4]]
+        finally:
+            pool.stop()
+    finally:
+        torch.set_float32_matmul_precision(previous)
+    for output, reference in zip(outputs, expected):
+        assert np.array_equal(output, reference)
@@ -0,0 +1,50 @@
+import multiprocessing as mp
+import os
+import time
+
+import pytest
+
+from src.SharedMemoryRing import SharedMemoryRing
+
+
+def producer(connectionInfo: tuple, frames: int, finish: bool):
+    ring = SharedMemoryRing.attach(connectionInfo)
+    for i in range(frames):
+        slot = ring.acquireFree()
+        ring.writeSlot(slot, bytes([i]) * ring.slotSize)
+        ring.publish(slot)
+    if finish:
+        ring.finish()
+        ring.close()
+        return
+    # give the queue time to send the frames, then die like a crashed or killed decoder
+    time.sleep(0.5)
+    os._exit(9)
+
+
+def readAll(finish: bool) -> list:
+    ring = SharedMemoryRing(slotSize=4, slotCount=4)
+    process = mp.get_context("spawn").Process(
+        target=producer, args=(ring.connectionInfo(), 3, finish), name="decoder"
+    )
+    process.start()
+    frames = []
+    try:
+        while (slot := ring.takeFilled(process)) is not None:
+            view = ring.slotView(slot)
+            frames.append(bytes(view)[0])
+            view.release()
+            ring.releaseFree(slot)
+    finally:
+        process.join()
+        ring.close()
+    return frames
+
+
+def test_take_filled_until_finished():
+    assert readAll(finish=True) == [0, 1, 2]
+
+
+def test_take_filled_raises_when_producer_dies():
+    with pytest.raises(RuntimeError, match="decoder stopped"):
+        readAll(finish=False)
@@ -0,0 +1,156 @@
+import queue
+import random
+import time
+from threading import Lock
+
+import pytest
+
+from src.StageGraph import ReorderBuffer, Stage, StageGraph, parseStageWorkers
+
+
+def runGraph(stages: list[Stage], items: list, queueSize: int = 4) -> list:
+    inputQueue = queue.Queue()
+    for item in items:
+        inputQueue.put(item)
+    inputQueue.put(None)
+    outputQueue = queue.Queue()
+    StageGraph(stages, inputQueue, outputQueue, queueSize=queueSize).run()
+    outputs = []
+    while not outputQueue.empty():
+        outputs.append(outputQueue.get())
+    return outputs
+
+
+def randomSleep(function, seed: int = 0):
+    """
+    Wraps a stage function so workers finish their items in a random order
+    """
+    rng = random.Random(seed)
+    lock = Lock()
+
+    def sleeping(item):
+        with lock:
+            seconds = rng.uniform(0, 0.005)
+        time.sleep(seconds)
+        return function(item)
+
+    return sleeping
+
+
+def test_reorder_buffer():
+    reorderBuffer = ReorderBuffer()
+    assert reorderBuffer.add(2, "c") == []
+    assert reorderBuffer.add(1, "b") == []
+    assert len(reorderBuffer) == 2
+    assert reorderBuffer.add(0, "a") == ["a", "b", "c"]
+    assert reorderBuffer.add(3, "d") == ["d"]
+    assert len(reorderBuffer) == 0
+
+
+def test_out_of_order_workers_keep_order():
+    stages = [
+        Stage("double", randomSleep(lambda item: [item * 2], seed=1), workers=4),
+        Stage("add", randomSleep(lambda item: [item + 1], seed=2), workers=3),
+    ]
+    assert runGraph(stages, list(range(200))) == [i * 2 + 1 for i in range(200)]
+
+
+def test_slow_first_item_keeps_order():
+    def slowFirst(item):
+        # like the first frame warming up a model, the other workers finish everything after it first
+        if item == 0:
+            time.sleep(0.1)
+        return [item]
+
+    stages = [Stage("warmup", slowFirst, workers=4)]
+    assert runGraph(stages, list(range(50))) == list(range(50))
+
+
+def test_stage_holds_at_most_workers_items():
+    """
+    Items taken but not passed on can't go past the worker count, the preallocated frame buffers are sized by it
+    """
+    lock = Lock()
+    state = {"held": 0, "most": 0}
+
+    def take(item):
+        with lock:
+            state["held"] += 1
+            state["most"] = max(state["most"], state["held"])
+        # a slow item makes the other workers finish ahead of it
+        time.sleep(0.05 if item % 10 == 0 else 0.001)
+        return [item]
+
+    def passOn(item):
+        with lock:
+            state["held"] -= 1
+        return [item]
+
+    stages = [
+        Stage("take", take, workers=3),
+        # one worker, so an item only counts as passed on once it left the first stage in order
+        Stage("passOn", passOn),
+    ]
+    assert runGraph(stages, list(range(60)), queueSize=1) == list(range(60))
+    # held by the first stage, 1 in the queue between them and 1 in the second stage
+    assert state["most"] <= 3 + 1 + 1
+
+
+def test_stages_can_drop_and_add_items():
+    stages = [
+        Stage("drop odd", lambda item: [] if item % 2 else [item], workers=2),
+        Stage("repeat", lambda item: [item, item], workers=2),
+    ]
+    assert runGraph(stages, list(range(10))) == [0, 0, 2, 2, 4, 4, 6, 6, 8, 8]
+
+
+def test_batched_stage_keeps_order():
+    batchSizes = []
+
+    def batched(items):
+        batchSizes.append(len(items))
+        return [[item * 10] for item in items]
+
+    stages = [
+        Stage("slow", randomSleep(lambda item: [item]), workers=2),
+        Stage("batch", batched, workers=2, batchSize=4),
+    ]
+    assert runGraph(stages, list(range(100))) == [i * 10 for i in range(100)]
+    assert max(batchSizes) <= 4
+
+
+def test_stateful_stage_uses_one_worker():
+    assert (
+        Stage("interpolate", lambda item: [item], workers=4, stateful=True).workers == 1
+    )
+
+
+def test_error_is_raised_after_draining():
+    def failing(item):
+        if item == 7:
+            raise ValueError("bad frame")
+        return [item]
+
+    inputQueue = queue.Queue()
+    for item in range(30):
+        inputQueue.put(item)
+    inputQueue.put(None)
+    graph = StageGraph(
+        [Stage("failing", failing, workers=2)], inputQueue, queue.Queue()
+    )
+    with pytest.raises(ValueError, match="bad frame"):
+        graph.run()
+    # every input was taken, the reader never blocks on a full queue
+    assert inputQueue.empty()
+
+
+def test_parse_stage_workers():
+    assert parseStageWorkers("") == {}
+    assert parseStageWorkers(None) == {}
+    assert parseStageWorkers("SceneDetect=1, denormalize=2") == {
+        "scenedetect": 1,
+        "denormalize": 2,
+    }
+    for stageWorkers in ("denormalize", "denormalize=two", "a=1=2", "upscale=1,"):
+        with pytest.raises(ValueError, match="Invalid stage worker setting"):
+            parseStageWorkers(stageWorkers)
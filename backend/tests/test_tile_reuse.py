@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from src.UpscaleTorch import UpscalePytorch
+
+from conftest import randomFrames
+
+WIDTH = 160
+HEIGHT = 96
+
+
+def changingFrames(count: int) -> list:
+    """
+    A frame that only changes in a small patch each time, so most tiles can be reused
+    """
+    frame = randomFrames(1, WIDTH, HEIGHT)[0]
+    patches = randomFrames(count, 12, 12, seed=1)
+    frames = []
+    for i, patch in enumerate(patches):
+        frame = frame.copy()
+        x = (i * 37) % (WIDTH - 12)
+        y = (i * 23) % (HEIGHT - 12)
+        frame[y : y + 12, x : x + 12] = patch
+        frames.append(frame)
+    return frames
+
+
+def recordBatches(upscale: UpscalePytorch) -> list:
+    """
+    Keeps a copy of every batch of tiles that goes through the model
+    """
+    batches = []
+    renderImage = upscale.renderImage
+
+    def recordingRenderImage(image):
+        batches.append(image.clone())
+        return renderImage(image)
+
+    upscale.renderImage = recordingRenderImage
+    return batches
+
+
+@pytest.mark.parametrize("tileBatch", [1, 2, 3])
+def test_reuse_at_threshold_0_matches_full_render(compactModelPath, tileBatch):
+    def upscaler(tileReuse: bool) -> UpscalePytorch:
+        return UpscalePytorch(
+            compactModelPath,
+            device="cpu",
+            precision="float32",
+            width=WIDTH,
+            height=HEIGHT,
+            tilesize=32,
+            tile_pad=4,
+            tileBatch=tileBatch,
+            tileReuse=tileReuse,
+        )
+
+    full = upscaler(False)
+    reuse = upscaler(True)
+    fullBatches = recordBatches(full)
+    reuseBatches = recordBatches(reuse)
+    for frame in changingFrames(6):
+        assert np.array_equal(
+            reuse.renderFrame(frame.tobytes()), full.renderFrame(frame.tobytes())
+        )
+        # a tile can come out slightly different in a batch of another size or makeup on some devices,
+        # so every batch with reuse has to be one the full render used too
+        for batch in reuseBatches:
+            assert any(torch.equal(batch, other) for other in fullBatches)
+        fullBatches.clear()
+        reuseBatches.clear()
+    assert reuse.tilesReused > 0